@@ -0,0 +1,242 @@
+"""
+Artifact Store Module
+
+Persists the intermediate results of an upload under the SHA-256 of its
+bytes, each tagged with the version of what produced it:
+
+    recognition             raw JewelryRecognizer output (YOLO box, type, metal)
+    mask-<mode>             background removal alpha mask (PNG)
+    embedding-<input>       ResNet-50 ImageNet class probabilities (.npy)
+
+A later request for the same image reuses every artifact whose version still
+matches and recomputes only the others, so turning on background removal
+after an auto_fill-only upload runs segmentation alone, and a change to the
+tag projection reuses the stored probabilities. Results derived from the
+artifacts (catalog suggestions, tags) are always rebuilt, which is what lets
+the re-suggestion job (POST /admin/resuggest) apply a taxonomy change to
+every stored image without running a model.
+
+Layout: <ARTIFACT_DIR>/<hash[:2]>/<hash>/ holds source.bin (the upload, with
+ARTIFACT_KEEP_SOURCE=1), source.json (filename, size) and per artifact a data
+file plus <kind>.meta.json with its version. Every file is written to a temporary
+name and renamed, so concurrent writers (DAG threads, uvicorn workers) never
+expose a partial artifact.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, Optional, Union
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from image_buffer import ImageBuffer
+from service_metrics import counters
+import model_workers
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_STORE = os.getenv("ARTIFACT_STORE", "0") == "1"
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", "/tmp/jewelry-ai/artifacts")
+
+# Keep the upload itself so stale artifacts can be recomputed offline
+ARTIFACT_KEEP_SOURCE = os.getenv("ARTIFACT_KEEP_SOURCE", "1") == "1"
+
+
+def content_hash(contents: bytes) -> str:
+    """Key of an upload in the store"""
+    return hashlib.sha256(contents).hexdigest()
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _encode(value: Any):
+    """(file extension, bytes) for an artifact value"""
+    if isinstance(value, np.ndarray):
+        if value.dtype == np.uint8 and value.ndim == 2:
+            ok, png = cv2.imencode(".png", value, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+            if not ok:
+                raise ValueError("Failed to encode mask")
+            return "png", png.tobytes()
+        return "npy", value.tobytes()
+    return "json", json.dumps(value).encode()
+
+
+def _decode(ext: str, data: bytes, meta: Dict) -> Any:
+    if ext == "png":
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    if ext == "npy":
+        return np.frombuffer(data, dtype=meta["dtype"]).reshape(meta["shape"]).copy()
+    return json.loads(data)
+
+
+class ArtifactStore:
+    """Versioned intermediate artifacts per upload content hash"""
+
+    def __init__(self, root: str = ARTIFACT_DIR):
+        self.root = root
+
+    def path(self, key: str, name: str = "") -> str:
+        return os.path.join(self.root, key[:2], key, name)
+
+    def get(self, key: str, kind: str, version: str) -> Optional[Any]:
+        """
+        Stored value of an artifact, or None if it is missing or was produced
+        by another version
+        """
+        try:
+            with open(self.path(key, f"{kind}.meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["version"] != version:
+                counters.incr(f"artifacts.stale.{kind.split('-')[0]}")
+                return None
+            with open(self.path(key, meta["file"]), "rb") as f:
+                value = _decode(meta["file"].rsplit(".", 1)[1], f.read(), meta)
+        except (OSError, ValueError, KeyError):
+            counters.incr(f"artifacts.miss.{kind.split('-')[0]}")
+            return None
+        counters.incr(f"artifacts.hit.{kind.split('-')[0]}")
+        return value
+
+    def put(self, key: str, kind: str, version: str, value: Any) -> None:
+        """Store an artifact, replacing any other version of it"""
+        ext, data = _encode(value)
+        os.makedirs(self.path(key), exist_ok=True)
+        meta = {"version": version, "file": f"{kind}.{ext}", "created": time.time()}
+        if ext == "npy":
+            meta.update(dtype=str(value.dtype), shape=list(value.shape))
+        _write_atomic(self.path(key, meta["file"]), data)
+        _write_atomic(self.path(key, f"{kind}.meta.json"), json.dumps(meta).encode())
+
+    def cached(self, key: Optional[str], kind: str, version: str, compute: Callable[[], Any]) -> Any:
+        """Stored artifact if current, else compute and store it (no-op store for key None)"""
+        if key is None:
+            return compute()
+        value = self.get(key, kind, version)
+        if value is None:
+            value = compute()
+            try:
+                self.put(key, kind, version, value)
+            except OSError as e:
+                logger.warning(f"Could not store artifact {kind} for {key}: {e}")
+        return value
+
+    def save_source(self, key: str, contents: bytes, filename: str) -> None:
+        """Record the upload (once per content hash); storage errors are logged"""
+        meta_path = self.path(key, "source.json")
+        if os.path.exists(meta_path):
+            return
+        try:
+            os.makedirs(self.path(key), exist_ok=True)
+            if ARTIFACT_KEEP_SOURCE:
+                _write_atomic(self.path(key, "source.bin"), contents)
+            meta = {"filename": filename, "bytes": len(contents), "created": time.time()}
+            _write_atomic(meta_path, json.dumps(meta).encode())
+        except OSError as e:
+            logger.warning(f"Could not store upload {key}: {e}")
+
+    def source(self, key: str) -> Dict:
+        """Upload metadata (filename, bytes)"""
+        with open(self.path(key, "source.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def load_source(self, key: str) -> Optional[bytes]:
+        """The upload bytes, if they were kept"""
+        try:
+            with open(self.path(key, "source.bin"), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def keys(self) -> Iterator[str]:
+        """Content hashes of every stored upload"""
+        if not os.path.isdir(self.root):
+            return
+        for prefix in sorted(os.listdir(self.root)):
+            directory = os.path.join(self.root, prefix)
+            if len(prefix) != 2 or not os.path.isdir(directory):
+                continue
+            for key in sorted(os.listdir(directory)):
+                if os.path.exists(os.path.join(directory, key, "source.json")):
+                    yield key
+
+
+artifacts = ArtifactStore()
+
+
+def store_key(source: Union[bytes, ImageBuffer]) -> Optional[str]:
+    """Content hash to store a request's artifacts under (None when disabled)"""
+    if not ARTIFACT_STORE or not isinstance(source, (bytes, bytearray)):
+        return None
+    return content_hash(source)
+
+
+# ==================== STAGE ARTIFACTS ====================
+# The model calls of the pipelines, going through the store when a key is
+# given. Version strings are built per call from models.json and each
+# module's parameters, so a model upgrade invalidates exactly its artifacts.
+
+def recognition_version() -> str:
+    from jewelry_recognition import RECOGNITION_REVISION
+    from model_store import model_version
+    return f"{model_version('yolov8n')}:r{RECOGNITION_REVISION}"
+
+
+def recognize(key: Optional[str], image: ImageBuffer) -> Dict:
+    """Jewelry recognition, reusing the stored result for this image"""
+    return artifacts.cached(key, "recognition", recognition_version(), lambda: model_workers.recognize(image))
+
+
+def segment(key: Optional[str], image: ImageBuffer, mode: str) -> Image.Image:
+    """Background removal, rebuilding the cutout from a stored mask when there is one"""
+    if key is None:
+        return model_workers.segment(image, mode)
+    from segmentation import apply_mask, mask_version
+
+    kind, version = f"mask-{mode}", mask_version(mode)
+    mask = artifacts.get(key, kind, version)
+    if mask is not None:
+        return apply_mask(image, mask, mode)
+    processed = model_workers.segment(image, mode)
+    # Only a real cutout is stored; the fallback returns the original image
+    if processed.mode == "RGBA":
+        try:
+            artifacts.put(key, kind, version, np.ascontiguousarray(np.asarray(processed)[..., 3]))
+        except OSError as e:
+            logger.warning(f"Could not store artifact {kind} for {key}: {e}")
+    return processed
+
+
+def tag(key: Optional[str], image: Union[Image.Image, ImageBuffer], source: str) -> Dict:
+    """
+    Auto-tagging from stored class probabilities when there are some
+
+    Args:
+        key: Content hash, or None to tag without the store
+        image: The image being tagged
+        source: What image is: "original" or "segmented-<background mode>"
+    """
+    if key is None:
+        return model_workers.tag(image)
+    from model_store import model_version
+    from tagging import embedding_version, fallback_tags, tags_from_probabilities
+
+    try:
+        probabilities = artifacts.cached(
+            key, f"embedding-{source}", embedding_version(),
+            lambda: model_workers.classify(image).astype(np.float32),
+        )
+        return {**tags_from_probabilities(image, probabilities), "model_version": model_version("resnet50")}
+    except Exception as e:
+        logger.error(f"Tag generation failed: {str(e)}")
+        return fallback_tags()
@@ -0,0 +1,83 @@
+"""
+Background Removal Benchmark
+
+Times the full-resolution rembg path against the lowres mask path for each
+input image and reports the mask IoU between them (alpha > 127 counts as
+foreground) plus the mean absolute alpha difference.
+
+    python benchmarks/bench_background_removal.py photos/*.jpg --sizes 512 1024
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_buffer import ImageBuffer  # noqa: E402
+from segmentation import get_session, remove_background_full, remove_background_lowres  # noqa: E402
+
+
+def best_time(fn, repeats: int):
+    """Run fn `repeats` times; return (min seconds, last result)"""
+    times, result = [], None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def alpha_of(image: Image.Image) -> np.ndarray:
+    return np.asarray(image.getchannel('A'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[512, 1024], help="Mask inference sizes to try")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    get_session()  # load U^2-Net before timing
+    report = []
+    for path in args.images:
+        with open(path, "rb") as f:
+            buffer = ImageBuffer.from_bytes(f.read())
+        pil_image = buffer.to_pil()
+
+        full_seconds, full = best_time(lambda: remove_background_full(pil_image), args.repeats)
+        full_alpha = alpha_of(full)
+        full_fg = full_alpha > 127
+
+        entry = {
+            "image": os.path.basename(path),
+            "megapixels": round(buffer.megapixels, 2),
+            "full_seconds": round(full_seconds, 3),
+            "lowres": [],
+        }
+        for size in args.sizes:
+            seconds, low = best_time(lambda: remove_background_lowres(buffer, size), args.repeats)
+            low_alpha = alpha_of(low)
+            low_fg = low_alpha > 127
+            union = np.logical_or(full_fg, low_fg).sum()
+            iou = np.logical_and(full_fg, low_fg).sum() / union if union else 1.0
+            entry["lowres"].append({
+                "max_side": size,
+                "seconds": round(seconds, 3),
+                "speedup": round(full_seconds / seconds, 2),
+                "mask_iou": round(float(iou), 4),
+                "mean_abs_alpha_diff": round(float(np.abs(full_alpha.astype(np.int16) - low_alpha).mean()), 2),
+            })
+        report.append(entry)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Binary vs Multipart API Benchmark
+
+Compares requests per second and CPU per request of the multipart
+endpoints against their /internal raw-bytes + msgpack counterparts.
+
+Start the service first, then pass its PID so server CPU can be sampled:
+
+    uvicorn main:app --port 8000 &
+    python benchmarks/bench_binary_api.py --image sample.jpg --pid $!
+
+Server CPU per request is the service process CPU time delta divided by the
+number of requests; client CPU is measured the same way for this process.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from typing import Dict, Optional
+
+import httpx
+import psutil
+
+ENDPOINT_PAIRS = {
+    "process-image": ("/process-image", "/internal/process-image"),
+    "catalog": ("/catalog/upload-with-recognition", "/internal/catalog/upload-with-recognition"),
+}
+
+
+async def _run(client: httpx.AsyncClient, send, requests: int, concurrency: int) -> int:
+    """Issue `requests` calls with at most `concurrency` in flight; returns error count"""
+    semaphore = asyncio.Semaphore(concurrency)
+    errors = 0
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            response = await send(client)
+            if response.status_code != 200:
+                errors += 1
+            # Touch the body so decoding cost is part of the measurement
+            response.read()
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return errors
+
+
+async def measure(name: str, send, requests: int, concurrency: int,
+                  server: Optional[psutil.Process]) -> Dict:
+    """Measure throughput and CPU for one request style"""
+    client_process = psutil.Process()
+    async with httpx.AsyncClient(timeout=120) as client:
+        # Warm up connections and models
+        await _run(client, send, min(concurrency, requests), concurrency)
+
+        server_cpu = sum(server.cpu_times()[:2]) if server else 0.0
+        client_cpu = sum(client_process.cpu_times()[:2])
+        start = time.perf_counter()
+        errors = await _run(client, send, requests, concurrency)
+        elapsed = time.perf_counter() - start
+        client_cpu = sum(client_process.cpu_times()[:2]) - client_cpu
+        if server:
+            server_cpu = sum(server.cpu_times()[:2]) - server_cpu
+
+    return {
+        "name": name,
+        "requests": requests,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(requests / elapsed, 2),
+        "server_cpu_ms_per_request": round(server_cpu / requests * 1000, 2) if server else None,
+        "client_cpu_ms_per_request": round(client_cpu / requests * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--image", required=True, help="Sample jewelry image")
+    parser.add_argument("--endpoint", choices=sorted(ENDPOINT_PAIRS), default="process-image")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--pid", type=int, help="PID of the service process (for server CPU)")
+    parser.add_argument("--remove-background", action="store_true",
+                        help="Include background removal (otherwise only the cheap stages run)")
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        image_bytes = f.read()
+
+    multipart_path, binary_path = ENDPOINT_PAIRS[args.endpoint]
+    flag = "true" if args.remove_background else "false"
+    form = {"remove_background": flag}
+
+    async def send_multipart(client):
+        return await client.post(
+            args.url + multipart_path,
+            files={"file": ("sample.jpg", image_bytes, "image/jpeg")},
+            data=form,
+        )
+
+    async def send_binary(client):
+        return await client.post(
+            args.url + binary_path,
+            content=image_bytes,
+            params=form,
+            headers={"Content-Type": "application/octet-stream"},
+        )
+
+    server = psutil.Process(args.pid) if args.pid else None
+
+    async def run_all():
+        return [
+            await measure("multipart", send_multipart, args.requests, args.concurrency, server),
+            await measure("binary", send_binary, args.requests, args.concurrency, server),
+        ]
+
+    results = asyncio.run(run_all())
+    print(json.dumps({"endpoint": args.endpoint, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Model Workers Benchmark
+
+Runs the catalog pipeline (recognition, background removal, tagging) over the
+given images at several concurrency levels, first with the models in-process
+and then in dedicated worker processes (see model_workers.py). Reports
+throughput, latency percentiles and the lag of a 1 ms ticker thread, which
+stands in for how long the event loop waits on the GIL.
+
+    python benchmarks/bench_model_workers.py photos/*.jpg --concurrency 1 4 8 --requests 64
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import model_workers  # noqa: E402
+from image_buffer import ImageBuffer  # noqa: E402
+
+
+def pipeline(buffer: ImageBuffer, background_mode: str) -> None:
+    model_workers.recognize(buffer)
+    processed = model_workers.segment(buffer, background_mode)
+    model_workers.tag(processed)
+
+
+class TickerLag:
+    """Measures how late a thread sleeping 1 ms wakes up"""
+
+    def __init__(self):
+        self.lags = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            start = time.perf_counter()
+            time.sleep(0.001)
+            self.lags.append(time.perf_counter() - start - 0.001)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def run(buffers, concurrency: int, requests: int, background_mode: str) -> dict:
+    latencies = []
+
+    def one(i):
+        start = time.perf_counter()
+        pipeline(buffers[i % len(buffers)], background_mode)
+        latencies.append(time.perf_counter() - start)
+
+    with TickerLag() as ticker, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        list(pool.map(one, range(requests)))
+        elapsed = time.perf_counter() - start
+
+    lat = np.array(latencies) * 1000
+    lag = np.array(ticker.lags) * 1000
+    return {
+        "concurrency": concurrency,
+        "images_per_second": round(requests / elapsed, 2),
+        "p50_ms": round(float(np.percentile(lat, 50)), 1),
+        "p95_ms": round(float(np.percentile(lat, 95)), 1),
+        "ticker_lag_mean_ms": round(float(lag.mean()), 2),
+        "ticker_lag_p99_ms": round(float(np.percentile(lag, 99)), 2),
+    }
+
+
+def wait_ready(timeout: float = 300.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        pools = model_workers.worker_status()["pools"]
+        if all(w["ready"] for workers in pools.values() for w in workers):
+            return
+        time.sleep(0.5)
+    raise RuntimeError("Model workers did not become ready")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 8])
+    parser.add_argument("--requests", type=int, default=32, help="Pipeline runs per concurrency level")
+    parser.add_argument("--background-mode", default="lowres", choices=["full", "lowres"])
+    args = parser.parse_args()
+
+    buffers = []
+    for path in args.images:
+        with open(path, "rb") as f:
+            buffers.append(ImageBuffer.from_bytes(f.read()))
+
+    report = {"in_process": [], "worker_processes": []}
+
+    pipeline(buffers[0], args.background_mode)  # load models before timing
+    for concurrency in args.concurrency:
+        report["in_process"].append(run(buffers, concurrency, args.requests, args.background_mode))
+
+    model_workers.MODEL_WORKERS = True
+    model_workers.start_workers()
+    try:
+        wait_ready()
+        pipeline(buffers[0], args.background_mode)
+        for concurrency in args.concurrency:
+            report["worker_processes"].append(run(buffers, concurrency, args.requests, args.background_mode))
+    finally:
+        model_workers.stop_workers()
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
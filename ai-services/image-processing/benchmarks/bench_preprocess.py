@@ -0,0 +1,124 @@
+"""
+Classifier Preprocessing Benchmark
+
+Checks that the batched preprocessing in tagging.py (classification_batch:
+fused resize-crop into one uint8 batch, one multiply-add normalization)
+gives the same ResNet input as torchvision's
+Resize(256) / CenterCrop(224) / ToTensor / Normalize on PIL images, and
+times both, plus the previous per-image path (resize the whole image,
+crop, normalize per image) and the uint8 tensor path.
+
+    python benchmarks/bench_preprocess.py photos/*.jpg --batch-sizes 1 8 32
+
+Differences are in normalized units (one uint8 step is about 0.017). With
+--check-model the classifier runs on both inputs and top-1 agreement is
+reported. Exits with status 1 when the mean difference exceeds --tolerance.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import torch
+from torchvision import transforms
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tagging  # noqa: E402
+from image_buffer import ImageBuffer  # noqa: E402
+
+reference = transforms.Compose([
+    transforms.Resize(tagging.PREPROCESS_RESIZE),
+    transforms.CenterCrop(tagging.PREPROCESS_CROP),
+    transforms.ToTensor(),
+    transforms.Normalize(mean=tagging.IMAGENET_MEAN, std=tagging.IMAGENET_STD),
+])
+normalize = transforms.Normalize(mean=tagging.IMAGENET_MEAN, std=tagging.IMAGENET_STD, inplace=True)
+
+
+def per_image_input(buffer: ImageBuffer) -> torch.Tensor:
+    """classification_input as it was before the batched path"""
+    rgb = buffer.rgb()
+    height, width = rgb.shape[:2]
+    if width <= height:
+        size = (tagging.PREPROCESS_RESIZE, int(tagging.PREPROCESS_RESIZE * height / width))
+    else:
+        size = (int(tagging.PREPROCESS_RESIZE * width / height), tagging.PREPROCESS_RESIZE)
+    resized = cv2.resize(rgb, size, interpolation=cv2.INTER_AREA)
+    top = int(round((resized.shape[0] - tagging.PREPROCESS_CROP) / 2.0))
+    left = int(round((resized.shape[1] - tagging.PREPROCESS_CROP) / 2.0))
+    crop = resized[top:top + tagging.PREPROCESS_CROP, left:left + tagging.PREPROCESS_CROP]
+    return normalize(torch.from_numpy(crop).permute(2, 0, 1).float().div_(255))
+
+
+def per_image_ms(fn, items, batch_size: int, repeats: int) -> float:
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    fn(batches[0])
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for batch in batches:
+            fn(batch)
+    return (time.perf_counter() - start) * 1000 / (repeats * len(items))
+
+
+def difference(a: torch.Tensor, b: torch.Tensor) -> dict:
+    delta = (a - b).abs()
+    return {"mean": round(float(delta.mean()), 4), "p99": round(float(delta.flatten().quantile(0.99)), 4), "max": round(float(delta.max()), 4)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=0.02, help="Largest acceptable mean difference")
+    parser.add_argument("--check-model", action="store_true")
+    args = parser.parse_args()
+
+    buffers = []
+    for path in args.images:
+        with open(path, "rb") as f:
+            buffers.append(ImageBuffer.from_bytes(f.read()))
+    pil_images = [buffer.to_pil() for buffer in buffers]
+
+    expected = torch.stack([reference(image) for image in pil_images])
+    batched = tagging.classification_batch(buffers)
+    report = {
+        "images": len(buffers),
+        "difference": {
+            "batched": difference(batched, expected),
+            "per_image": difference(torch.stack([per_image_input(b) for b in buffers]), expected),
+        },
+        "ms_per_image": [],
+    }
+
+    # The tensor path needs same-size images: the first image, repeated
+    tensor = buffers[0].as_tensor().unsqueeze(0).repeat(max(args.batch_sizes), 1, 1, 1).contiguous()
+    report["difference"]["tensor"] = difference(tagging.classification_batch(tensor[:1]), expected[:1])
+
+    for batch_size in args.batch_sizes:
+        report["ms_per_image"].append({
+            "batch_size": batch_size,
+            "torchvision": round(per_image_ms(lambda items: torch.stack([reference(i) for i in items]), pil_images, batch_size, args.repeats), 3),
+            "per_image": round(per_image_ms(lambda items: torch.stack([per_image_input(b) for b in items]), buffers, batch_size, args.repeats), 3),
+            "batched": round(per_image_ms(tagging.classification_batch, buffers, batch_size, args.repeats), 3),
+            "tensor": round(per_image_ms(lambda items: tagging.classification_batch(tensor[:len(items)]), buffers, batch_size, args.repeats), 3),
+        })
+
+    if args.check_model:
+        classifier = tagging.get_classifier()
+        with torch.no_grad():
+            top_expected = classifier(expected.to(tagging.device)).argmax(dim=1)
+            top_batched = classifier(batched.to(tagging.device)).argmax(dim=1)
+        report["top1_agreement"] = round(float((top_expected == top_batched).float().mean()), 4)
+
+    print(json.dumps(report, indent=2))
+    if report["difference"]["batched"]["mean"] > args.tolerance:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
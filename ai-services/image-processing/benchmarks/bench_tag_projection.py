@@ -0,0 +1,146 @@
+"""
+Tag Projection Benchmark
+
+Times the previous per-image generate_tags (softmax + top-5 that were then
+ignored, tags from color and aspect ratio only) against the projection
+engine in tagging.py, per image and batched.
+
+    python benchmarks/bench_tag_projection.py photos/*.jpg --batch-sizes 1 8 32
+
+With --labels (JSON mapping file name to its true tags) it also fits the
+per-tag Platt calibration on those images and writes it into
+tag_projection.json (or --config):
+
+    python benchmarks/bench_tag_projection.py photos/*.jpg --labels labels.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tagging  # noqa: E402
+from image_buffer import ImageBuffer  # noqa: E402
+
+
+def legacy_generate_tags(buffer: ImageBuffer):
+    """generate_tags as it was before the projection engine"""
+    input_batch = tagging.classification_input(buffer).unsqueeze(0).to(tagging.device)
+    with torch.no_grad():
+        output = tagging.get_classifier()(input_batch)
+    probabilities = torch.nn.functional.softmax(output[0], dim=0)
+    torch.topk(probabilities, 5)
+
+    tags = []
+    avg_color = buffer.mean_color()
+    if avg_color[0] > 180:
+        tags.append("gold")
+    elif avg_color.mean() > 200:
+        tags.append("silver")
+    aspect_ratio = buffer.width / buffer.height
+    if aspect_ratio > 1.5:
+        tags.append("necklace")
+    elif aspect_ratio < 0.8:
+        tags.append("earring")
+    else:
+        tags.append("ring")
+    tags.extend(["handcrafted", "elegant", "premium"])
+    return list(set(tags))
+
+
+def per_image_ms(fn, items, repeats: int) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(items)
+        best = min(best, time.perf_counter() - start)
+    return best / len(items) * 1000
+
+
+def fit_platt(raw: np.ndarray, labels: np.ndarray, steps: int = 2000, lr: float = 0.1):
+    """Fit sigmoid(a * logit(raw) + b) to 0/1 labels by gradient descent"""
+    x = np.log(np.clip(raw, 1e-6, 1 - 1e-6) / np.clip(1 - raw, 1e-6, 1))
+    a, b = 1.0, 0.0
+    for _ in range(steps):
+        p = 1 / (1 + np.exp(-(a * x + b)))
+        a -= lr * np.mean((p - labels) * x)
+        b -= lr * np.mean(p - labels)
+    return a, b
+
+
+def calibrate(paths, buffers, labels_path: str, config_path: str) -> dict:
+    with open(labels_path, "r", encoding="utf-8") as f:
+        labels = json.load(f)
+    projector = tagging.get_projector()
+    rows = []
+    for buffer in buffers:
+        batch = tagging.classification_input(buffer).unsqueeze(0).to(tagging.device)
+        with torch.no_grad():
+            probabilities = torch.softmax(tagging.get_classifier()(batch), dim=1).cpu()
+        rows.append(projector.project(probabilities)[0].numpy())
+    raw = np.stack(rows)
+
+    config = tagging.load_projection_config(config_path)
+    calibration = config.setdefault("calibration", {})
+    for column, tag in enumerate(projector.tags):
+        truth = np.array([tag in labels.get(os.path.basename(path), []) for path in paths], dtype=np.float64)
+        if truth.min() == truth.max():
+            continue  # Needs both positives and negatives
+        a, b = fit_platt(raw[:, column], truth)
+        calibration[tag] = {"a": round(float(a), 4), "b": round(float(b), 4)}
+    with open(config_path, "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+        f.write("\n")
+    return calibration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--labels", help="JSON {file name: [tags]} to fit calibration")
+    parser.add_argument("--config", default=tagging.TAG_PROJECTION_CONFIG)
+    args = parser.parse_args()
+
+    buffers = []
+    for path in args.images:
+        with open(path, "rb") as f:
+            buffers.append(ImageBuffer.from_bytes(f.read()))
+
+    tagging.get_classifier()
+    tagging.get_projector()
+    legacy_generate_tags(buffers[0])  # warm up
+
+    report = {
+        "images": len(buffers),
+        "legacy_ms_per_image": round(per_image_ms(lambda items: [legacy_generate_tags(b) for b in items], buffers, args.repeats), 2),
+        "projection": [],
+    }
+    for batch_size in args.batch_sizes:
+        items = (buffers * (batch_size // len(buffers) + 1))[:batch_size]
+        report["projection"].append({
+            "batch_size": batch_size,
+            "ms_per_image": round(per_image_ms(tagging.tag_images, items, args.repeats), 2),
+        })
+
+    # The projection step alone, on a large synthetic batch
+    probabilities = torch.softmax(torch.randn(1024, 1000), dim=1)
+    start = time.perf_counter()
+    tagging.get_projector().scores(probabilities)
+    report["projection_only_us_per_image"] = round((time.perf_counter() - start) / 1024 * 1e6, 3)
+
+    if args.labels:
+        report["calibration"] = calibrate(args.images, buffers, args.labels, args.config)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
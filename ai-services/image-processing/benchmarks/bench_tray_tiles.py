@@ -0,0 +1,92 @@
+"""
+Tray Tiling Benchmark
+
+Runs tray mode (JewelryRecognizer.recognize_tray) over the given tray photos
+for every combination of tile size, overlap, tiles per YOLO call and
+analysis threads, next to the single full-frame detection of recognize.
+Reports throughput (images and tiles per second), latency per image and the
+number of pieces found, so a tile configuration can be picked per machine.
+
+    python benchmarks/bench_tray_tiles.py trays/*.jpg --tile-sizes 512 640 960 --batch-sizes 1 4 8 16
+"""
+
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_buffer import ImageBuffer  # noqa: E402
+from jewelry_recognition import get_recognizer  # noqa: E402
+
+
+def run(buffers, repeats: int, **options) -> dict:
+    recognizer = get_recognizer()
+    latencies, tiles, pieces = [], 0, []
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for buffer in buffers:
+            begin = time.perf_counter()
+            result = recognizer.recognize_tray(buffer, **options)
+            latencies.append(time.perf_counter() - begin)
+            tiles += result["tiles"]
+            pieces.append(result["count"])
+    elapsed = time.perf_counter() - start
+
+    lat = np.array(latencies) * 1000
+    return {
+        **options,
+        "images_per_second": round(len(latencies) / elapsed, 2),
+        "tiles_per_second": round(tiles / elapsed, 1),
+        "tiles_per_image": round(tiles / len(latencies), 1),
+        "p50_ms": round(float(np.percentile(lat, 50)), 1),
+        "p95_ms": round(float(np.percentile(lat, 95)), 1),
+        "pieces_mean": round(float(np.mean(pieces)), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--tile-sizes", nargs="+", type=int, default=[512, 640, 960])
+    parser.add_argument("--overlaps", nargs="+", type=float, default=[0.2])
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 4, 8, 16])
+    parser.add_argument("--threads", nargs="+", type=int, default=[1, 4])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    buffers = []
+    for path in args.images:
+        with open(path, "rb") as f:
+            buffers.append(ImageBuffer.from_bytes(f.read()))
+
+    recognizer = get_recognizer()
+    recognizer.recognize(buffers[0])  # load and warm the detector before timing
+    for tile_size in args.tile_sizes:
+        recognizer.recognize_tray(buffers[0], tile_size=tile_size)
+
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        for buffer in buffers:
+            recognizer.recognize(buffer)
+    full_frame = {"images_per_second": round(args.repeats * len(buffers) / (time.perf_counter() - start), 2)}
+
+    configs = []
+    for tile_size, overlap, batch_size, threads in itertools.product(
+        args.tile_sizes, args.overlaps, args.batch_sizes, args.threads
+    ):
+        configs.append(run(
+            buffers, args.repeats,
+            tile_size=tile_size, overlap=overlap, batch_size=batch_size, threads=threads,
+        ))
+
+    print(json.dumps({"full_frame": full_frame, "tray": configs}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,448 @@
+"""
+Load Test and Traffic Replay
+
+Sends a mix of concurrent requests (e.g. /remove-background next to
+/recognize-jewelry next to /analyze-quality) to a service instance and
+writes a JSON report: p50/p95/p99 latency, throughput, error rate and status
+codes per endpoint, plus the server's RSS (including model worker
+processes) over time. Reports from two runs can be compared, so a
+deployment change can be checked before rollout.
+
+Open loop at a target rate (Poisson arrivals), against an instance this
+script starts and stops:
+
+    python benchmarks/load_test.py --images photos/*.jpg --start --rate 10 --duration 60 \\
+        --mix remove-background=1 recognize-jewelry=1 analyze-quality=2 --output before.json
+
+Closed loop at a fixed concurrency, against a running instance, compared
+with an earlier report (exit code 1 on a regression beyond 10%):
+
+    python benchmarks/load_test.py --images photos/*.jpg --url http://127.0.0.1:8000 --pid 1234 \\
+        --concurrency 8 --requests 500 --compare before.json --max-regression 10
+
+Replay of a recorded trace, one JSON object per line ("t" is the send time
+in seconds from the start, scaled by --speed):
+
+    {"t": 0.25, "endpoint": "remove-background", "image": "photos/ring.jpg", "form": {"background_mode": "lowres"},
+     "headers": {"X-Tenant-Id": "shop-a"}}
+
+    python benchmarks/load_test.py --replay trace.jsonl --start --env MODEL_WORKERS=1
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import httpx
+import numpy as np
+import psutil
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Name -> (path, default form fields)
+ENDPOINTS = {
+    "remove-background": ("/remove-background", {}),
+    "recognize-jewelry": ("/recognize-jewelry", {}),
+    "analyze-quality": ("/analyze-quality", {}),
+    "auto-tag": ("/auto-tag", {}),
+    "process-image": ("/process-image", {}),
+    "catalog": ("/catalog/upload-with-recognition", {}),
+}
+
+# Sends later than this behind schedule mean the client, not the server,
+# limited the offered rate
+LATE_SEND_SECONDS = 0.05
+
+
+class Request:
+    """One request of the workload"""
+
+    def __init__(self, endpoint: str, image: bytes, filename: str, form: Optional[Dict] = None, at: float = 0.0,
+                 headers: Optional[Dict] = None):
+        if endpoint not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint '{endpoint}' (one of {', '.join(ENDPOINTS)})")
+        self.endpoint = endpoint
+        self.path = ENDPOINTS[endpoint][0]
+        self.image = image
+        self.filename = filename
+        self.form = {**ENDPOINTS[endpoint][1], **(form or {})}
+        self.at = at
+        self.headers = headers or {}
+
+
+def parse_mix(entries: List[str]) -> Dict[str, float]:
+    """["remove-background=1", "analyze-quality=2"] -> normalized weights"""
+    mix = {}
+    for entry in entries:
+        name, _, weight = entry.partition("=")
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint '{name}' in --mix")
+        mix[name] = float(weight or 1)
+    total = sum(mix.values())
+    if total <= 0:
+        raise ValueError("--mix weights must add up to more than 0")
+    return {name: weight / total for name, weight in mix.items()}
+
+
+def synthetic_workload(images: Dict[str, bytes], mix: Dict[str, float], seed: int,
+                       headers: Optional[Dict] = None) -> Iterator[Request]:
+    """Endless requests drawn from the mix, each with a random image"""
+    rng = random.Random(seed)
+    names, weights = list(mix), list(mix.values())
+    files = sorted(images)
+    while True:
+        path = rng.choice(files)
+        yield Request(rng.choices(names, weights)[0], images[path], os.path.basename(path), headers=headers)
+
+
+def load_trace(path: str, speed: float) -> List[Request]:
+    """Recorded requests with their send offsets"""
+    cache: Dict[str, bytes] = {}
+    requests = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            image = entry["image"]
+            if image not in cache:
+                with open(image, "rb") as img:
+                    cache[image] = img.read()
+            requests.append(Request(
+                entry["endpoint"], cache[image], os.path.basename(image),
+                entry.get("form"), float(entry.get("t", 0.0)) / speed, entry.get("headers"),
+            ))
+    requests.sort(key=lambda r: r.at)
+    return requests
+
+
+class Recorder:
+    """Collects per-request samples and the RSS/throughput timeline"""
+
+    def __init__(self):
+        self.samples = []  # (endpoint, start offset, latency seconds, status)
+        self.late_sends = 0
+        self.started = time.perf_counter()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def add(self, endpoint: str, start: float, latency: float, status: str) -> None:
+        self.samples.append((endpoint, start, latency, status))
+
+
+async def send(client: httpx.AsyncClient, url: str, request: Request, recorder: Optional[Recorder]) -> None:
+    start = time.perf_counter()
+    try:
+        response = await client.post(
+            url + request.path,
+            files={"file": (request.filename, request.image, "image/jpeg")},
+            data=request.form,
+            headers=request.headers,
+        )
+        # Read the whole body so transfer time is part of the latency
+        await response.aread()
+        status = str(response.status_code)
+    except httpx.HTTPError as e:
+        status = f"exception:{type(e).__name__}"
+    if recorder is not None:
+        recorder.add(request.endpoint, start - recorder.started, time.perf_counter() - start, status)
+
+
+async def run_open_loop(client, url: str, requests: List[Request], recorder: Recorder, max_in_flight: int) -> None:
+    """Send each request at its scheduled offset (at most max_in_flight at a time)"""
+    semaphore = asyncio.Semaphore(max_in_flight)
+    tasks = []
+
+    async def one(request: Request):
+        async with semaphore:
+            await send(client, url, request, recorder)
+
+    for request in requests:
+        delay = request.at - recorder.elapsed()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        elif -delay > LATE_SEND_SECONDS:
+            recorder.late_sends += 1
+        tasks.append(asyncio.ensure_future(one(request)))
+    await asyncio.gather(*tasks)
+
+
+async def run_closed_loop(client, url: str, requests: Iterable[Request], recorder: Recorder,
+                          concurrency: int, duration: Optional[float]) -> None:
+    """concurrency clients, each sending its next request when the previous one returns"""
+    queue = iter(requests)
+
+    async def client_loop():
+        for request in queue:
+            if duration is not None and recorder.elapsed() >= duration:
+                return
+            await send(client, url, request, recorder)
+
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+
+
+async def sample_rss(process: Optional[psutil.Process], recorder: Recorder, interval: float,
+                     timeline: List[Dict], stop: asyncio.Event) -> None:
+    """Server RSS (process and children) and completed requests every interval"""
+    while not stop.is_set():
+        point = {"t": round(recorder.elapsed(), 2), "completed": len(recorder.samples)}
+        if process is not None:
+            try:
+                processes = [process] + process.children(recursive=True)
+                point["rss_mb"] = round(sum(p.memory_info().rss for p in processes if p.is_running()) / 2 ** 20, 1)
+            except psutil.Error:
+                point["rss_mb"] = None
+        timeline.append(point)
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+def summarize(samples: List, seconds: float) -> Dict:
+    """Latency percentiles, throughput and error rate of a set of samples"""
+    if not samples:
+        return {"requests": 0}
+    latencies = np.array([s[2] for s in samples]) * 1000
+    statuses: Dict[str, int] = {}
+    for s in samples:
+        statuses[s[3]] = statuses.get(s[3], 0) + 1
+    errors = sum(count for status, count in statuses.items() if not status.startswith("2"))
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4),
+        "throughput_rps": round(len(samples) / seconds, 2),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 1),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 1),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 1),
+        "mean_ms": round(float(latencies.mean()), 1),
+        "max_ms": round(float(latencies.max()), 1),
+        "status_codes": statuses,
+    }
+
+
+def compare(report: Dict, baseline: Dict) -> Dict:
+    """Relative change (%) of the headline numbers against a baseline report"""
+    def change(new, old):
+        if new is None or not old:
+            return None
+        return round((new - old) / old * 100, 1)
+
+    comparison = {}
+    for name, stats in report["endpoints"].items():
+        old = baseline.get("endpoints", {}).get(name)
+        if not old or not stats.get("requests") or not old.get("requests"):
+            continue
+        comparison[name] = {
+            metric: change(stats[metric], old[metric])
+            for metric in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps")
+        }
+        comparison[name]["error_rate_delta"] = round(stats["error_rate"] - old["error_rate"], 4)
+    comparison["peak_rss_mb"] = change(report["rss"].get("peak_mb"), baseline.get("rss", {}).get("peak_mb"))
+    return comparison
+
+
+def regressions(comparison: Dict, max_regression: float) -> List[str]:
+    """Endpoints whose p95 rose or throughput fell by more than max_regression percent"""
+    found = []
+    for name, changes in comparison.items():
+        if not isinstance(changes, dict):
+            continue
+        if (changes["p95_ms"] or 0) > max_regression:
+            found.append(f"{name}: p95 +{changes['p95_ms']}%")
+        if (changes["throughput_rps"] or 0) < -max_regression:
+            found.append(f"{name}: throughput {changes['throughput_rps']}%")
+        if changes["error_rate_delta"] > 0:
+            found.append(f"{name}: error rate +{changes['error_rate_delta']}")
+    return found
+
+
+def start_service(port: int, env: List[str], timeout: float) -> subprocess.Popen:
+    """Start uvicorn on main:app and wait until GET / answers"""
+    child_env = dict(os.environ)
+    for entry in env:
+        key, _, value = entry.partition("=")
+        child_env[key] = value
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=SERVICE_DIR,
+        env=child_env,
+    )
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Service exited with code {process.returncode} during startup")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/", timeout=2).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"Service did not become healthy within {timeout:.0f}s")
+
+
+async def run(args, requests: Iterable[Request], warmup: List[Request], url: str, pid: Optional[int]) -> Dict:
+    process = psutil.Process(pid) if pid else None
+    limits = httpx.Limits(max_connections=max(args.concurrency or 0, args.max_in_flight))
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        # Warm up connections and models; not part of the report
+        for sample in warmup:
+            for _ in range(args.warmup):
+                await send(client, url, sample, None)
+
+        recorder = Recorder()
+        timeline: List[Dict] = []
+        stop = asyncio.Event()
+        sampler = asyncio.ensure_future(sample_rss(process, recorder, args.rss_interval, timeline, stop))
+        if args.concurrency:
+            await run_closed_loop(client, url, requests, recorder, args.concurrency, args.duration)
+        else:
+            await run_open_loop(client, url, requests, recorder, args.max_in_flight)
+        seconds = recorder.elapsed()
+        stop.set()
+        await sampler
+
+    by_endpoint: Dict[str, List] = {}
+    for sample in recorder.samples:
+        by_endpoint.setdefault(sample[0], []).append(sample)
+    rss = [point["rss_mb"] for point in timeline if point.get("rss_mb") is not None]
+    return {
+        "seconds": round(seconds, 2),
+        "late_sends": recorder.late_sends,
+        "overall": summarize(recorder.samples, seconds),
+        "endpoints": {name: summarize(samples, seconds) for name, samples in sorted(by_endpoint.items())},
+        "rss": {
+            "start_mb": rss[0] if rss else None,
+            "peak_mb": max(rss) if rss else None,
+            "end_mb": rss[-1] if rss else None,
+        },
+        "timeline": timeline,
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=SERVICE_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--images", nargs="+", help="Images for a synthetic request mix")
+    source.add_argument("--replay", help="Recorded trace (JSON lines) to replay")
+    parser.add_argument("--mix", nargs="+", default=["remove-background=1", "recognize-jewelry=1", "analyze-quality=1"],
+                        help="endpoint=weight entries for the synthetic mix")
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument("--rate", type=float, help="Open loop: requests per second (Poisson arrivals)")
+    load.add_argument("--concurrency", type=int, help="Closed loop: clients sending back to back")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds of load (synthetic mix)")
+    parser.add_argument("--requests", type=int, help="Number of requests instead of --duration (synthetic mix)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed factor")
+    parser.add_argument("--headers", nargs="*", default=[],
+                        help="KEY=VALUE request headers for the synthetic mix, e.g. X-Tenant-Id=shop-a X-Priority=bulk")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--pid", type=int, help="PID of a running service (for RSS)")
+    parser.add_argument("--start", action="store_true", help="Start a local instance for the run")
+    parser.add_argument("--port", type=int, default=8765, help="Port of the started instance")
+    parser.add_argument("--env", nargs="*", default=[], help="KEY=VALUE settings for the started instance")
+    parser.add_argument("--startup-timeout", type=float, default=300)
+    parser.add_argument("--warmup", type=int, default=2, help="Unrecorded requests per endpoint first")
+    parser.add_argument("--timeout", type=float, default=120, help="Per-request timeout in seconds")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="Open-loop cap on concurrent requests")
+    parser.add_argument("--rss-interval", type=float, default=1.0, help="Seconds between RSS samples")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report here (default: stdout)")
+    parser.add_argument("--compare", help="Baseline report to compare against")
+    parser.add_argument("--max-regression", type=float,
+                        help="With --compare: exit 1 if p95 or throughput regresses by more than this percent")
+    args = parser.parse_args()
+
+    if args.replay:
+        requests = load_trace(args.replay, args.speed)
+        args.concurrency = None
+    else:
+        images = {}
+        for path in args.images:
+            with open(path, "rb") as f:
+                images[path] = f.read()
+        headers = dict(entry.partition("=")[::2] for entry in args.headers)
+        workload = synthetic_workload(images, parse_mix(args.mix), args.seed, headers)
+        if args.concurrency:
+            # Runs until --requests are sent or --duration has passed
+            requests = islice(workload, args.requests) if args.requests else workload
+            if args.requests:
+                args.duration = None
+        else:
+            rate = args.rate or 1.0
+            requests = list(islice(workload, args.requests or max(1, int(rate * args.duration))))
+            rng = random.Random(args.seed)
+            at = 0.0
+            for request in requests:
+                request.at = at
+                at += rng.expovariate(rate)
+    # One request per endpoint for the warm-up
+    sample = args.images[0] if args.images else None
+    warmup = list({r.endpoint: r for r in requests}.values()) if isinstance(requests, list) else [
+        Request(name, images[sample], os.path.basename(sample), headers=headers) for name in parse_mix(args.mix)
+    ]
+
+    service = None
+    url, pid = args.url, args.pid
+    if args.start:
+        service = start_service(args.port, args.env, args.startup_timeout)
+        url, pid = f"http://127.0.0.1:{args.port}", service.pid
+    try:
+        results = asyncio.run(run(args, requests, warmup, url, pid))
+    finally:
+        if service is not None:
+            service.terminate()
+            service.wait(timeout=30)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_revision": git_revision(),
+        "config": {
+            "mode": "replay" if args.replay else ("closed_loop" if args.concurrency else "open_loop"),
+            "rate": args.rate,
+            "concurrency": args.concurrency,
+            "mix": None if args.replay else parse_mix(args.mix),
+            "trace": args.replay,
+            "env": args.env,
+        },
+        **results,
+    }
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            report["comparison"] = compare(report, json.load(f))
+        if args.max_regression is not None:
+            report["regressions"] = regressions(report["comparison"], args.max_regression)
+            exit_code = 1 if report["regressions"] else 0
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(json.dumps({"overall": report["overall"], "comparison": report.get("comparison")}, indent=2))
+    else:
+        print(text)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""
+Per-Endpoint Allocation Profile
+
+Sends one image through each endpoint in-process (FastAPI TestClient) and
+reports the peak Python-visible allocation with tracemalloc. NumPy and
+Pillow report their pixel buffers to tracemalloc; torch CPU tensors do not,
+so model activations are excluded and only the pixel copies are compared.
+
+To compare before/after, check the older revision out into a worktree and
+point --source-dir at its image-processing directory:
+
+    git worktree add /tmp/before <commit>
+    python benchmarks/profile_allocations.py --image sample.jpg \\
+        --source-dir /tmp/before/ai-services/image-processing
+    python benchmarks/profile_allocations.py --image sample.jpg
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+ENDPOINTS = {
+    "process-image": ("/process-image", {"remove_background": "false", "auto_tag": "true"}),
+    "process-image+bg": ("/process-image", {"remove_background": "true", "auto_tag": "true"}),
+    "catalog": ("/catalog/upload-with-recognition", {"remove_background": "false", "auto_fill": "true"}),
+    "recognize-jewelry": ("/recognize-jewelry", {}),
+    "auto-tag": ("/auto-tag", {}),
+}
+
+
+def profile(client, path: str, form: dict, image_bytes: bytes, repeats: int) -> dict:
+    """Peak traced allocation (MB) of one request, best of `repeats`"""
+    peaks = []
+    for _ in range(repeats):
+        gc.collect()
+        tracemalloc.start()
+        baseline, _ = tracemalloc.get_traced_memory()
+        response = client.post(path, files={"file": ("sample.jpg", image_bytes, "image/jpeg")}, data=form)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        if response.status_code != 200:
+            return {"error": response.text}
+        peaks.append((peak - baseline) / 1e6)
+    return {"peak_mb": round(min(peaks), 2)}
+
+
+def main():
+    default_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", required=True, help="Sample jewelry image (ideally a 12 MP photo)")
+    parser.add_argument("--source-dir", default=default_dir, help="image-processing directory to profile")
+    parser.add_argument("--endpoints", nargs="*", default=sorted(ENDPOINTS), choices=sorted(ENDPOINTS))
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.abspath(args.source_dir))
+    from fastapi.testclient import TestClient
+    import main as service
+
+    with open(args.image, "rb") as f:
+        image_bytes = f.read()
+
+    client = TestClient(service.app)
+    # Warm up lazily initialized models so their weights are not counted
+    client.post("/catalog/upload-with-recognition",
+                files={"file": ("sample.jpg", image_bytes, "image/jpeg")},
+                data={"remove_background": "true"})
+
+    report = {
+        "source_dir": os.path.abspath(args.source_dir),
+        "image_bytes": len(image_bytes),
+        "endpoints": {
+            name: profile(client, *ENDPOINTS[name], image_bytes, args.repeats)
+            for name in args.endpoints
+        },
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
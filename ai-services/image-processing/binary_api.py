@@ -0,0 +1,101 @@
+"""
+Binary Service-to-Service API Helpers
+
+Raw-bytes request decoding and msgpack response envelopes for the internal
+endpoints called by the Node backend (no multipart parsing, no temp files)
+"""
+
+import io
+from typing import Dict, Optional, Union
+
+import msgpack
+from fastapi import Request
+from fastapi.responses import Response
+from PIL import Image
+
+from image_buffer import ImageBuffer
+
+MSGPACK_MEDIA_TYPE = "application/x-msgpack"
+
+_TRUE_VALUES = {"1", "true", "yes", "on"}
+_FALSE_VALUES = {"0", "false", "no", "off"}
+
+
+def read_option(request: Request, name: str, default: Optional[str] = None) -> Optional[str]:
+    """
+    Read an option from the query string, falling back to an X- header
+
+    Args:
+        request: Incoming request
+        name: Option name in snake_case (header form is X-Option-Name)
+        default: Value used when neither is present
+
+    Returns:
+        Raw option string or default
+    """
+    value = request.query_params.get(name)
+    if value is None:
+        header = "x-" + name.replace("_", "-")
+        value = request.headers.get(header)
+    return default if value is None else value
+
+
+def read_bool_option(request: Request, name: str, default: bool) -> bool:
+    """Read a boolean option (1/0, true/false, yes/no, on/off)"""
+    value = read_option(request, name)
+    if value is None:
+        return default
+    value = value.strip().lower()
+    if value in _TRUE_VALUES:
+        return True
+    if value in _FALSE_VALUES:
+        return False
+    raise ValueError(f"Invalid boolean for {name}: {value!r}")
+
+
+def decode_raw_image(body: bytes) -> ImageBuffer:
+    """
+    Decode a raw request body into an image buffer
+
+    Args:
+        body: Encoded image bytes (JPEG, PNG, WebP, ...)
+
+    Returns:
+        RGB ImageBuffer
+    """
+    if not body:
+        raise ValueError("Request body is empty; send the image bytes as the body")
+    return ImageBuffer.from_bytes(body)
+
+
+def encode_png(image: Image.Image) -> bytes:
+    """Encode a PIL Image as PNG bytes in memory"""
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def pack_envelope(result: Dict, image: Optional[Union[Image.Image, bytes]] = None) -> bytes:
+    """
+    Pack a result (and optionally the processed image) into a msgpack envelope
+
+    The envelope is a map with "result" (the same structure the JSON
+    endpoints return) and "image" (PNG bytes or nil).
+
+    Args:
+        result: Endpoint result dictionary
+        image: Processed image to inline as PNG (or already-encoded PNG bytes)
+
+    Returns:
+        Encoded envelope
+    """
+    payload = {
+        "result": result,
+        "image": encode_png(image) if isinstance(image, Image.Image) else image,
+    }
+    return msgpack.packb(payload, use_bin_type=True)
+
+
+def msgpack_response(content: bytes, status_code: int = 200) -> Response:
+    """Wrap an encoded envelope in an application/x-msgpack response"""
+    return Response(content=content, media_type=MSGPACK_MEDIA_TYPE, status_code=status_code)
@@ -0,0 +1,149 @@
+"""
+Deadlines Module
+
+Per-request time budgets. A caller sends either an absolute deadline
+(X-Request-Deadline, unix epoch seconds) or a relative budget
+(X-Request-Timeout-Ms header or timeout_ms form field). Each pipeline stage
+is skipped when its estimated duration no longer fits, or abandoned when it
+runs past the deadline, and the response reports what completed.
+"""
+
+import os
+import time
+from typing import Any, Callable, Dict, Optional
+
+from service_metrics import counters, stage_stats
+
+DEADLINE_HEADER = "x-request-deadline"
+TIMEOUT_HEADER = "x-request-timeout-ms"
+
+# Extra time an endpoint waits past the deadline for the pipeline to assemble
+# its partial result before answering 504
+WAIT_GRACE_SECONDS = float(os.getenv("DEADLINE_WAIT_GRACE_MS", "250")) / 1000.0
+
+
+class Deadline:
+    """An absolute point in (wall-clock) time by which a request must finish"""
+
+    def __init__(self, expires_at: float):
+        """
+        Args:
+            expires_at: Unix timestamp in seconds
+        """
+        self.expires_at = expires_at
+
+    @classmethod
+    def from_timeout_ms(cls, timeout_ms: float) -> "Deadline":
+        return cls(time.time() + timeout_ms / 1000.0)
+
+    @classmethod
+    def from_headers(cls, headers, timeout_ms: Optional[float] = None) -> Optional["Deadline"]:
+        """
+        Build a deadline from request headers and an optional explicit budget
+
+        When several are given, the earliest wins.
+
+        Args:
+            headers: Request headers (case-insensitive mapping)
+            timeout_ms: Budget from a form field or query option
+
+        Returns:
+            Deadline, or None when the caller did not set one
+        """
+        candidates = []
+        if headers.get(DEADLINE_HEADER):
+            candidates.append(float(headers[DEADLINE_HEADER]))
+        if headers.get(TIMEOUT_HEADER):
+            candidates.append(time.time() + float(headers[TIMEOUT_HEADER]) / 1000.0)
+        if timeout_ms is not None:
+            candidates.append(time.time() + float(timeout_ms) / 1000.0)
+        return cls(min(candidates)) if candidates else None
+
+    def remaining(self) -> float:
+        """Seconds left (negative once expired)"""
+        return self.expires_at - time.time()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+def remaining_ms(deadline: Optional[Deadline]) -> Optional[int]:
+    """Remaining budget in whole milliseconds, for responses"""
+    if deadline is None:
+        return None
+    return int(max(0.0, deadline.remaining()) * 1000)
+
+
+def skip_reason(
+    stage: str,
+    deadline: Optional[Deadline],
+    megapixels: Optional[float] = None,
+) -> Optional[str]:
+    """
+    Decide whether a pipeline stage still fits the request's deadline
+
+    A stage is skipped when its running-average duration (from stage_stats)
+    exceeds the remaining budget. Stages that start but run past the
+    deadline are abandoned by the caller waiting on them (see
+    pipeline_dag.run_dag).
+
+    Args:
+        stage: Stage name, as recorded in stage_stats
+        deadline: Request deadline, or None
+        megapixels: Input size for per-megapixel estimates
+
+    Returns:
+        None when the stage should run, otherwise "insufficient_time"
+    """
+    if deadline is None:
+        return None
+    remaining = deadline.remaining()
+    if remaining <= 0 or stage_stats.estimate(stage, megapixels) > remaining:
+        counters.incr(f"deadline.skipped.{stage}")
+        return "insufficient_time"
+    return None
+
+
+def timed_call(
+    stage: str,
+    fn: Callable[[], Any],
+    megapixels: Optional[float] = None,
+    record: bool = True,
+) -> Callable[[], Any]:
+    """
+    Wrap a stage so its duration is recorded in stage_stats
+
+    Args:
+        stage: Stage name
+        fn: Zero-argument callable doing the work
+        megapixels: Input size for per-megapixel estimates
+        record: Record the duration (False when fn records itself)
+    """
+    def timed():
+        start = time.perf_counter()
+        try:
+            return fn()
+        finally:
+            if record:
+                stage_stats.record(stage, time.perf_counter() - start, megapixels)
+
+    return timed
+
+
+def record_timeout(stage: str) -> None:
+    """Count a stage abandoned because it ran past the deadline"""
+    counters.incr(f"deadline.timed_out.{stage}")
+
+
+def record_skip(result: Dict, operation: str, reason: str) -> None:
+    """Mark an operation as skipped in an endpoint result"""
+    result["partial"] = True
+    result.setdefault("skipped_operations", []).append({
+        "operation": operation,
+        "reason": reason,
+    })
+
+
+def wait_timeout(deadline: Optional[Deadline]) -> Optional[float]:
+    """Seconds an endpoint may wait for its result (None without a deadline)"""
+    return None if deadline is None else max(0.0, deadline.remaining()) + WAIT_GRACE_SECONDS
@@ -0,0 +1,69 @@
+"""
+Event Stream Module
+
+Progressive results for the multi-stage endpoints. A pipeline running in a
+worker thread emits (event, data) pairs as its stages finish; they are
+forwarded to the event loop and written to the client as NDJSON lines or
+server-sent events, so the client can act on early results (e.g. fill in
+the product details from recognition) while slower stages still run.
+"""
+
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterator, Callable, Optional
+
+STREAM_FORMATS = ("ndjson", "sse")
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+
+# Receives (event, data) from the pipeline thread
+EventSink = Callable[[str, dict], None]
+
+
+def resolve_stream_format(value: Optional[str], accept: str = "") -> str:
+    """Pick the stream format from an explicit value or the Accept header"""
+    if value:
+        value = value.lower()
+        if value not in STREAM_FORMATS:
+            raise ValueError(f"stream_format must be one of {', '.join(STREAM_FORMATS)}")
+        return value
+    return "sse" if "text/event-stream" in accept else "ndjson"
+
+
+def format_event(stream_format: str, event: str, data: Any) -> str:
+    """Serialize one event as an NDJSON line or an SSE message"""
+    if stream_format == "sse":
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return json.dumps({"event": event, "data": data}) + "\n"
+
+
+class EventChannel:
+    """Thread-to-event-loop channel for pipeline events"""
+
+    _END = object()
+
+    def __init__(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._started = time.perf_counter()
+
+    def emit(self, event: str, data: Any) -> None:
+        """Queue an event (safe to call from any thread)"""
+        elapsed_ms = round((time.perf_counter() - self._started) * 1000, 1)
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, (event, data, elapsed_ms))
+
+    def close(self) -> None:
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, self._END)
+
+    async def stream(self, stream_format: str) -> AsyncIterator[str]:
+        """Formatted events until close(); each carries elapsed_ms since the request started"""
+        while True:
+            item = await self._queue.get()
+            if item is self._END:
+                return
+            event, data, elapsed_ms = item
+            yield format_event(stream_format, event, {"elapsed_ms": elapsed_ms, **data})
+
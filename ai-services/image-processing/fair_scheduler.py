@@ -0,0 +1,307 @@
+"""
+Fair Scheduler Module
+
+Admission of inference work per tenant. Requests carry a tenant id
+(X-Tenant-Id) and a priority class (X-Priority: interactive or bulk). At
+most SCHEDULER_SLOTS pipelines run at a time; the rest wait in the
+scheduler, which decides whose work runs next:
+
+- Within a class, tenants share the slots by weighted fair queuing
+  (self-clocked: each request gets the finish tag
+  max(class virtual time, tenant's last tag) + cost / weight, and the
+  smallest tag runs first). A shop with 1,000 queued uploads gets its
+  share, not the whole queue.
+- Interactive work goes before bulk work. Bulk work never holds the last
+  SCHEDULER_INTERACTIVE_RESERVED slots, so an interactive upload does not
+  wait behind running bulk pipelines. It still gets at least
+  SCHEDULER_BULK_SHARE of the dispatches while both classes wait, so it
+  does not starve.
+- A request without X-Priority is classed bulk once its tenant has
+  SCHEDULER_AUTO_BULK requests queued or running, so bulk uploads that do
+  not label themselves are demoted too.
+
+Per-tenant queue length, queue wait and latency percentiles are reported
+on /metrics. Tenant ids come from clients, so a tenant's finish tags are
+dropped once it has nothing queued, and the statistics of at most
+SCHEDULER_MAX_TENANTS tenants are kept (idle ones are forgotten first).
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import re
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from service_metrics import counters
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1") == "1"
+SCHEDULER_SLOTS = int(os.getenv("SCHEDULER_SLOTS", "4"))
+SCHEDULER_INTERACTIVE_RESERVED = int(os.getenv("SCHEDULER_INTERACTIVE_RESERVED", "1"))
+SCHEDULER_BULK_SHARE = float(os.getenv("SCHEDULER_BULK_SHARE", "0.1"))
+SCHEDULER_AUTO_BULK = int(os.getenv("SCHEDULER_AUTO_BULK", "8"))
+SCHEDULER_MAX_TENANTS = int(os.getenv("SCHEDULER_MAX_TENANTS", "1000"))
+
+# "shop-a=2,shop-b=0.5"; tenants not listed have weight 1
+SCHEDULER_TENANT_WEIGHTS = {
+    name.strip(): float(weight)
+    for name, _, weight in (entry.partition("=") for entry in os.getenv("SCHEDULER_TENANT_WEIGHTS", "").split(","))
+    if name.strip()
+}
+
+TENANT_HEADER = "x-tenant-id"
+PRIORITY_HEADER = "x-priority"
+DEFAULT_TENANT = "default"
+PRIORITY_CLASSES = ("interactive", "bulk")
+
+# Latency samples kept per tenant and class for the percentiles
+STATS_WINDOW = 1000
+
+_TENANT_ID = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
+
+
+def request_class(headers) -> Tuple[str, Optional[str]]:
+    """
+    Tenant id and explicit priority class (None when not given) of a request
+
+    Raises:
+        ValueError: On a malformed tenant id or unknown priority class
+    """
+    tenant = headers.get(TENANT_HEADER) or DEFAULT_TENANT
+    if not _TENANT_ID.match(tenant):
+        raise ValueError("X-Tenant-Id must be 1-64 characters of letters, digits, '.', '_', ':' or '-'")
+    priority = headers.get(PRIORITY_HEADER)
+    if priority is not None:
+        priority = priority.lower()
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"X-Priority must be one of {', '.join(PRIORITY_CLASSES)}")
+    return tenant, priority
+
+
+class _Ticket:
+    """One queued request"""
+
+    __slots__ = ("tenant", "priority", "finish", "future", "enqueued", "cancelled")
+
+    def __init__(self, tenant: str, priority: str, finish: float, future: asyncio.Future):
+        self.tenant = tenant
+        self.priority = priority
+        self.finish = finish
+        self.future = future
+        self.enqueued = time.perf_counter()
+        self.cancelled = False
+
+
+class _TenantStats:
+    def __init__(self):
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.queue_wait = {name: deque(maxlen=STATS_WINDOW) for name in PRIORITY_CLASSES}
+        self.latency = {name: deque(maxlen=STATS_WINDOW) for name in PRIORITY_CLASSES}
+
+    def snapshot(self) -> Dict:
+        def percentiles(samples) -> Optional[Dict]:
+            if not samples:
+                return None
+            values = np.array(samples) * 1000
+            return {
+                "count": len(values),
+                "p50_ms": round(float(np.percentile(values, 50)), 1),
+                "p95_ms": round(float(np.percentile(values, 95)), 1),
+            }
+
+        return {
+            "queued": self.queued,
+            "running": self.running,
+            "completed": self.completed,
+            "queue_wait": {name: percentiles(self.queue_wait[name]) for name in PRIORITY_CLASSES},
+            "latency": {name: percentiles(self.latency[name]) for name in PRIORITY_CLASSES},
+        }
+
+
+class FairScheduler:
+    """Weighted fair queuing of async jobs across tenants, in two priority classes"""
+
+    def __init__(
+        self,
+        slots: int = SCHEDULER_SLOTS,
+        interactive_reserved: int = SCHEDULER_INTERACTIVE_RESERVED,
+        bulk_share: float = SCHEDULER_BULK_SHARE,
+        auto_bulk: int = SCHEDULER_AUTO_BULK,
+        weights: Optional[Dict[str, float]] = None,
+        max_tenants: int = SCHEDULER_MAX_TENANTS,
+    ):
+        self.slots = max(1, slots)
+        self.bulk_slots = max(1, self.slots - interactive_reserved)
+        self.bulk_share = bulk_share
+        self.auto_bulk = auto_bulk
+        self.weights = weights if weights is not None else SCHEDULER_TENANT_WEIGHTS
+        self.max_tenants = max(1, max_tenants)
+        self._queues = {name: [] for name in PRIORITY_CLASSES}
+        self._virtual_time = {name: 0.0 for name in PRIORITY_CLASSES}
+        self._last_finish: Dict[Tuple[str, str], float] = {}
+        self._running = {name: 0 for name in PRIORITY_CLASSES}
+        self._dispatched = {name: 0 for name in PRIORITY_CLASSES}
+        self._seq = itertools.count()
+        self._stats: "OrderedDict[str, _TenantStats]" = OrderedDict()
+
+    def _tenant(self, tenant: str) -> _TenantStats:
+        stats = self._stats.get(tenant)
+        if stats is None:
+            stats = self._stats[tenant] = _TenantStats()
+            self._evict()
+        self._stats.move_to_end(tenant)
+        return stats
+
+    def _evict(self) -> None:
+        """Forget the least recently active idle tenants beyond max_tenants"""
+        excess = len(self._stats) - self.max_tenants
+        if excess > 0:
+            idle = [tenant for tenant, stats in self._stats.items() if not stats.queued and not stats.running]
+            for tenant in idle[:excess]:
+                del self._stats[tenant]
+                counters.incr("scheduler.evicted_tenants")
+
+    def _dequeued(self, tenant: str, stats: _TenantStats) -> None:
+        """
+        Drop the finish tags of a tenant with nothing left queued
+
+        Its last tag is then at most the class virtual time, so the next
+        request gets the same tag without it.
+        """
+        if not stats.queued:
+            for priority in PRIORITY_CLASSES:
+                self._last_finish.pop((priority, tenant), None)
+
+    def classify(self, tenant: str, priority: Optional[str]) -> str:
+        """Explicit class, else bulk for a tenant with auto_bulk requests already in the system"""
+        if priority is not None:
+            return priority
+        stats = self._stats.get(tenant)
+        if stats is not None and stats.queued + stats.running >= self.auto_bulk:
+            return "bulk"
+        return "interactive"
+
+    def _waiting(self, priority: str) -> bool:
+        queue = self._queues[priority]
+        while queue and queue[0][2].cancelled:
+            heapq.heappop(queue)
+        return bool(queue)
+
+    def _dispatch(self) -> None:
+        """Grant free slots to the waiting tickets with the smallest finish tags"""
+        while sum(self._running.values()) < self.slots:
+            interactive = self._waiting("interactive")
+            bulk = self._waiting("bulk") and self._running["bulk"] < self.bulk_slots
+            if not interactive and not bulk:
+                return
+            if interactive and bulk:
+                total = self._dispatched["interactive"] + self._dispatched["bulk"]
+                priority = "bulk" if self._dispatched["bulk"] < self.bulk_share * total else "interactive"
+            else:
+                priority = "interactive" if interactive else "bulk"
+
+            _, _, ticket = heapq.heappop(self._queues[priority])
+            self._virtual_time[priority] = ticket.finish
+            self._running[priority] += 1
+            self._dispatched[priority] += 1
+            stats = self._tenant(ticket.tenant)
+            stats.queued -= 1
+            stats.running += 1
+            stats.queue_wait[priority].append(time.perf_counter() - ticket.enqueued)
+            self._dequeued(ticket.tenant, stats)
+            ticket.future.set_result(None)
+
+    async def run(
+        self,
+        tenant: str,
+        priority: Optional[str],
+        fn: Callable[[], Awaitable[Any]],
+        cost: float = 1.0,
+    ) -> Any:
+        """
+        Wait for a slot, then await fn()
+
+        Args:
+            tenant: Tenant id
+            priority: "interactive", "bulk" or None (see classify)
+            fn: The work, e.g. lambda: run_in_threadpool(job)
+            cost: Relative size of the work (finish tag increment before weighting)
+
+        Returns:
+            fn's result
+        """
+        priority = self.classify(tenant, priority)
+        key = (priority, tenant)
+        weight = self.weights.get(tenant, 1.0)
+        previous = self._last_finish.get(key)
+        finish = max(self._virtual_time[priority], previous or 0.0) + cost / weight
+        self._last_finish[key] = finish
+
+        ticket = _Ticket(tenant, priority, finish, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queues[priority], (finish, next(self._seq), ticket))
+        stats = self._tenant(tenant)
+        stats.queued += 1
+        counters.incr(f"scheduler.{priority}")
+        self._dispatch()
+
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket.future.done() and not ticket.future.cancelled():
+                # Granted just as the caller went away
+                self._finish(ticket, None)
+            else:
+                ticket.cancelled = True
+                stats.queued -= 1
+                # Give back the tenant's share the ticket reserved (tickets
+                # queued after it keep the tags they were given)
+                if self._last_finish.get(key) == finish:
+                    if previous is None:
+                        del self._last_finish[key]
+                    else:
+                        self._last_finish[key] = previous
+                self._dequeued(tenant, stats)
+                counters.incr("scheduler.cancelled_in_queue")
+            raise
+
+        started = time.perf_counter()
+        try:
+            return await fn()
+        finally:
+            self._finish(ticket, started)
+
+    def _finish(self, ticket: _Ticket, started: Optional[float]) -> None:
+        self._running[ticket.priority] -= 1
+        stats = self._tenant(ticket.tenant)
+        stats.running -= 1
+        if started is not None:
+            stats.completed += 1
+            stats.latency[ticket.priority].append(time.perf_counter() - ticket.enqueued)
+        self._dispatch()
+
+    def status(self) -> Dict:
+        return {
+            "enabled": SCHEDULER_ENABLED,
+            "slots": self.slots,
+            "bulk_slots": self.bulk_slots,
+            "running": dict(self._running),
+            "queued": {name: sum(not t.cancelled for _, _, t in queue) for name, queue in self._queues.items()},
+            "tenants": {tenant: stats.snapshot() for tenant, stats in sorted(self._stats.items())},
+        }
+
+
+scheduler = FairScheduler()
+
+
+async def scheduled(headers, fn: Callable[[], Awaitable[Any]], cost: float = 1.0) -> Any:
+    """Run fn under the scheduler as the request's tenant and class (directly when disabled)"""
+    if not SCHEDULER_ENABLED:
+        return await fn()
+    tenant, priority = request_class(headers)
+    return await scheduler.run(tenant, priority, fn, cost)
@@ -0,0 +1,120 @@
+"""
+Image Buffer Module
+
+A single contiguous uint8 RGB array shared by every stage of a request.
+Stages receive views of it (crops as slices, torch tensors via
+torch.from_numpy) instead of their own copies; only the BGR input of the
+OpenCV/YOLO paths is a copy.
+"""
+
+from typing import Tuple, Union
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+# Match PIL's decoding: do not rotate according to EXIF orientation
+_DECODE_FLAGS = cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION
+
+
+class ImageBuffer:
+    """
+    Owns one C-contiguous (H, W, 3) uint8 RGB array
+
+    Every accessor returns a view; the only methods that allocate are
+    bgr(), to_pil() (PIL keeps its own pixel storage) and the explicit
+    resize helpers used to build model inputs.
+    """
+
+    def __init__(self, array: np.ndarray):
+        """
+        Wrap an existing RGB array
+
+        Args:
+            array: (H, W, 3) uint8 array in RGB order; copied only if it is
+                not already C-contiguous uint8
+        """
+        if array.ndim != 3 or array.shape[2] != 3:
+            raise ValueError(f"Expected an (H, W, 3) array, got shape {array.shape}")
+        self._array = np.ascontiguousarray(array, dtype=np.uint8)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "ImageBuffer":
+        """
+        Decode encoded image bytes straight into the buffer
+
+        OpenCV decodes to BGR; the swap to RGB happens in place, so decoding
+        costs exactly one pixel allocation.
+        """
+        array = cv2.imdecode(np.frombuffer(data, np.uint8), _DECODE_FLAGS)
+        if array is None:
+            raise ValueError("Could not decode image bytes")
+        cv2.cvtColor(array, cv2.COLOR_BGR2RGB, dst=array)
+        return cls(array)
+
+    @classmethod
+    def from_pil(cls, image: Image.Image) -> "ImageBuffer":
+        """Build a buffer from a PIL Image (alpha is dropped)"""
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        # np.array rather than np.asarray: the latter is a read-only view of
+        # PIL's exported bytes, which torch.from_numpy refuses to share
+        return cls(np.array(image))
+
+    @classmethod
+    def wrap(cls, image: Union["ImageBuffer", Image.Image, np.ndarray]) -> "ImageBuffer":
+        """Return image as an ImageBuffer, converting PIL Images or RGB arrays"""
+        if isinstance(image, ImageBuffer):
+            return image
+        if isinstance(image, Image.Image):
+            return cls.from_pil(image)
+        return cls(image)
+
+    @property
+    def width(self) -> int:
+        return self._array.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self._array.shape[0]
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """(width, height), like PIL's Image.size"""
+        return self.width, self.height
+
+    @property
+    def megapixels(self) -> float:
+        return self.width * self.height / 1e6
+
+    def rgb(self) -> np.ndarray:
+        """The underlying RGB array (no copy)"""
+        return self._array
+
+    def bgr(self) -> np.ndarray:
+        """
+        C-contiguous BGR copy, for OpenCV and YOLO
+
+        A reversed-channel view would not save the copy: both need
+        contiguous memory and copy negative-stride arrays themselves.
+        """
+        return cv2.cvtColor(self._array, cv2.COLOR_RGB2BGR)
+
+    def crop(self, x1: int, y1: int, x2: int, y2: int) -> np.ndarray:
+        """RGB crop as a slice of the buffer (no copy); coordinates are clamped"""
+        x1, x2 = max(0, int(x1)), min(self.width, int(x2))
+        y1, y2 = max(0, int(y1)), min(self.height, int(y2))
+        return self._array[y1:y2, x1:x2]
+
+    def mean_color(self) -> np.ndarray:
+        """Mean (R, G, B) without materializing a float copy of the image"""
+        return np.array(cv2.mean(self._array)[:3])
+
+    def as_tensor(self) -> torch.Tensor:
+        """(3, H, W) uint8 tensor sharing memory with the buffer"""
+        return torch.from_numpy(self._array).permute(2, 0, 1)
+
+    def to_pil(self) -> Image.Image:
+        """Copy into a PIL Image (for libraries that require one, e.g. rembg)"""
+        return Image.fromarray(self._array, mode='RGB')
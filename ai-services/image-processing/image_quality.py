@@ -0,0 +1,231 @@
+"""
+Image Quality Module
+
+Vectorized sharpness, brightness and contrast metrics for batches of images,
+and the quality gate that protects the expensive stages (rembg, YOLO)
+"""
+
+import io
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import cv2
+from PIL import Image
+
+from image_buffer import ImageBuffer
+from service_metrics import counters, stage_stats, timed_stage
+
+# Side length of the square grayscale copy the batch metrics are computed on
+ANALYSIS_SIZE = int(os.getenv("QUALITY_ANALYSIS_SIZE", "256"))
+
+# Quality gate configuration (thresholds apply to the downscaled analysis copy)
+QUALITY_GATE_MODE = os.getenv("QUALITY_GATE_MODE", "off")
+QUALITY_GATE_MODES = ("off", "flag", "reject")
+QUALITY_GATE_THRESHOLDS = {
+    "min_sharpness": float(os.getenv("QUALITY_GATE_MIN_SHARPNESS", "40")),
+    "min_brightness": float(os.getenv("QUALITY_GATE_MIN_BRIGHTNESS", "40")),
+    "max_brightness": float(os.getenv("QUALITY_GATE_MAX_BRIGHTNESS", "235")),
+    "min_contrast": float(os.getenv("QUALITY_GATE_MIN_CONTRAST", "15")),
+}
+
+
+def quality_score(sharpness: float, brightness: float, contrast: float) -> float:
+    """Combine the three metrics into a 0-100 quality score"""
+    return min(100, (sharpness / 100 + brightness / 2.55 + contrast / 2.55) / 3)
+
+
+def quality_recommendations(sharpness: float, brightness: float, contrast: float) -> List[str]:
+    """Human-readable recommendations for the given metrics"""
+    recommendations = []
+    if sharpness < 100:
+        recommendations.append("Image appears blurry. Use better focus.")
+    if brightness < 100:
+        recommendations.append("Image is too dark. Increase lighting.")
+    if brightness > 200:
+        recommendations.append("Image is too bright. Reduce lighting.")
+    if contrast < 50:
+        recommendations.append("Low contrast. Adjust lighting or camera settings.")
+    return recommendations if recommendations else ["Image quality is good!"]
+
+
+def load_analysis_image(source, size: int = ANALYSIS_SIZE) -> np.ndarray:
+    """
+    Decode an image straight into a small grayscale analysis copy
+
+    For JPEG input, PIL's draft mode lets libjpeg downscale in the DCT
+    domain, so the full-resolution frame is never materialized. Every input
+    is then brought to the analysis size with the same area resize, so
+    bytes and decoded buffers of one image score the same.
+
+    Args:
+        source: Encoded image bytes, a PIL Image or an ImageBuffer
+        size: Side length of the square output
+
+    Returns:
+        float32 array of shape (size, size)
+    """
+    if isinstance(source, ImageBuffer):
+        gray = cv2.cvtColor(source.rgb(), cv2.COLOR_RGB2GRAY)
+    else:
+        if isinstance(source, Image.Image):
+            image = source
+        else:
+            image = Image.open(io.BytesIO(source))
+            image.draft('L', (size, size))
+        gray = np.asarray(image.convert('L'))
+    gray = cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA)
+    return gray.astype(np.float32)
+
+
+def compute_quality_metrics_batch(gray_batch: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Compute quality metrics for a stack of grayscale images in one pass
+
+    Sharpness is the variance of the 4-neighbour Laplacian (the same kernel
+    as cv2.Laplacian with ksize=1), evaluated on the interior pixels.
+
+    Args:
+        gray_batch: float32 array of shape (N, H, W)
+
+    Returns:
+        Dictionary of (N,) arrays: sharpness, brightness, contrast, quality_score
+    """
+    g = gray_batch
+    laplacian = (
+        g[:, :-2, 1:-1] + g[:, 2:, 1:-1] + g[:, 1:-1, :-2] + g[:, 1:-1, 2:]
+        - 4.0 * g[:, 1:-1, 1:-1]
+    )
+    n = g.shape[0]
+    sharpness = laplacian.reshape(n, -1).var(axis=1)
+    flat = g.reshape(n, -1)
+    brightness = flat.mean(axis=1)
+    contrast = flat.std(axis=1)
+    score = np.minimum(100, (sharpness / 100 + brightness / 2.55 + contrast / 2.55) / 3)
+    return {
+        "sharpness": sharpness,
+        "brightness": brightness,
+        "contrast": contrast,
+        "quality_score": score,
+    }
+
+
+def failed_checks(metrics: Dict[str, float], thresholds: Optional[Dict[str, float]] = None) -> List[str]:
+    """
+    Names of the gate checks an image fails
+
+    Args:
+        metrics: Dictionary with sharpness, brightness and contrast
+        thresholds: Gate thresholds (defaults to QUALITY_GATE_THRESHOLDS)
+
+    Returns:
+        List of failed check names (empty when the image passes)
+    """
+    t = thresholds or QUALITY_GATE_THRESHOLDS
+    failed = []
+    if metrics["sharpness"] < t["min_sharpness"]:
+        failed.append("blurry")
+    if metrics["brightness"] < t["min_brightness"]:
+        failed.append("too_dark")
+    if metrics["brightness"] > t["max_brightness"]:
+        failed.append("too_bright")
+    if metrics["contrast"] < t["min_contrast"]:
+        failed.append("low_contrast")
+    return failed
+
+
+def analyze_batch(sources: List, size: int = ANALYSIS_SIZE) -> List[Dict]:
+    """
+    Analyze a batch of images with one vectorized metrics pass
+
+    Args:
+        sources: Encoded image bytes, PIL Images or ImageBuffers
+        size: Analysis side length
+
+    Returns:
+        One report per input with quality_score, metrics, recommendations
+        and the gate verdict; an input that cannot be decoded gets
+        {"error": ...} instead and the rest are still scored
+    """
+    reports: List[Dict] = []
+    images = []
+    for source in sources:
+        try:
+            images.append(load_analysis_image(source, size))
+            reports.append({})
+        except Exception as e:
+            reports.append({"error": f"Could not decode image ({type(e).__name__})"})
+    if not images:
+        return reports
+
+    metrics = compute_quality_metrics_batch(np.stack(images))
+    decoded = (report for report in reports if "error" not in report)
+    for i, report in enumerate(decoded):
+        values = {name: float(metrics[name][i]) for name in ("sharpness", "brightness", "contrast")}
+        failed = failed_checks(values)
+        report.update({
+            "quality_score": round(float(metrics["quality_score"][i]), 2),
+            "metrics": {name: round(value, 2) for name, value in values.items()},
+            "recommendations": quality_recommendations(**values),
+            "passes_gate": not failed,
+            "failed_checks": failed,
+        })
+    return reports
+
+
+def resolve_gate_mode(mode: Optional[str]) -> str:
+    """Validate a per-request gate mode, falling back to QUALITY_GATE_MODE"""
+    mode = (mode or QUALITY_GATE_MODE).lower()
+    if mode not in QUALITY_GATE_MODES:
+        raise ValueError(f"quality_gate must be one of {', '.join(QUALITY_GATE_MODES)}")
+    return mode
+
+
+def run_quality_gate(image: ImageBuffer, mode: str, guarded_stages: List[str]) -> Optional[Dict]:
+    """
+    Check an image against the gate before the expensive stages run
+
+    When the image fails, the stages in guarded_stages are counted as saved
+    using their running average duration from stage_stats.
+
+    Args:
+        image: Decoded image buffer
+        mode: "off", "flag" or "reject"
+        guarded_stages: Stage names that will be skipped if the gate trips
+
+    Returns:
+        Gate report, or None when the gate is off
+    """
+    if mode == "off":
+        return None
+
+    with timed_stage("quality_gate"):
+        report = analyze_batch([image])[0]
+
+    counters.incr("quality_gate.checked")
+    report["mode"] = mode
+    report["analysis_size"] = ANALYSIS_SIZE
+    report["passed"] = report.pop("passes_gate")
+
+    if not report["passed"]:
+        counters.incr(f"quality_gate.{'rejected' if mode == 'reject' else 'flagged'}")
+        saved = sum(stage_stats.estimate(stage, image.megapixels) for stage in guarded_stages)
+        counters.incr("quality_gate.estimated_seconds_saved", saved)
+        report["skipped_operations"] = guarded_stages
+    return report
+
+
+def gate_summary() -> Dict:
+    """Aggregate quality gate savings for the metrics endpoint"""
+    gate_cost = stage_stats.snapshot().get("quality_gate", {}).get("total_seconds", 0.0)
+    saved = counters.get("quality_gate.estimated_seconds_saved")
+    return {
+        "mode": QUALITY_GATE_MODE,
+        "thresholds": QUALITY_GATE_THRESHOLDS,
+        "checked": int(counters.get("quality_gate.checked")),
+        "flagged": int(counters.get("quality_gate.flagged")),
+        "rejected": int(counters.get("quality_gate.rejected")),
+        "gate_seconds": round(gate_cost, 4),
+        "estimated_seconds_saved": round(saved, 4),
+        "estimated_net_seconds_saved": round(saved - gate_cost, 4),
+    }
@@ -2,18 +2,106 @@
 Jewelry Recognition Module
 
 Uses YOLO for object detection and custom classification for jewelry type and metal detection
+
+Tray mode (recognize_tray) finds every piece in a photo of a whole tray: the
+frame is cut into overlapping tiles of TRAY_TILE_SIZE px that YOLO sees at
+full resolution (a 12 MP frame shrunk to 640 px loses small studs), run in
+batches of TRAY_TILE_BATCH, and the boxes are merged across tiles.
 """
 
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
 import numpy as np
 from PIL import Image
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional, Union
 import torch
-from ultralytics import YOLO  # YOLOv8
 import logging
+from image_buffer import ImageBuffer
+from model_registry import registry
+from model_store import load_yolo
+from profiling import model_profiler
 
 logger = logging.getLogger(__name__)
 
+# Bump when the type/metal heuristics or the result fields change (part of the version stored
+# recognition results are tagged with, see artifact_store.py)
+RECOGNITION_REVISION = 2
+
+# Tray mode: tile side (also YOLO's input size), overlap between neighbouring
+# tiles as a fraction of the side, tiles per YOLO call, and threads for the
+# per-piece type/metal analysis
+TRAY_TILE_SIZE = int(os.getenv("TRAY_TILE_SIZE", "640"))
+TRAY_TILE_OVERLAP = float(os.getenv("TRAY_TILE_OVERLAP", "0.2"))
+TRAY_TILE_BATCH = int(os.getenv("TRAY_TILE_BATCH", "8"))
+TRAY_THREADS = int(os.getenv("TRAY_THREADS", "4"))
+
+# Cross-tile merge: a box is dropped when it overlaps a higher-scoring one by
+# more than TRAY_NMS_IOU (intersection over union), or when more than
+# TRAY_NMS_IOS of the smaller box lies inside it (a piece cut by a tile edge)
+TRAY_NMS_IOU = float(os.getenv("TRAY_NMS_IOU", "0.5"))
+TRAY_NMS_IOS = float(os.getenv("TRAY_NMS_IOS", "0.7"))
+
+DETECTION_CONFIDENCE = 0.3
+
+
+def tile_grid(width: int, height: int, tile_size: int, overlap: float) -> List[Tuple[int, int, int, int]]:
+    """
+    Overlapping tiles (x1, y1, x2, y2) covering an image; the last row and
+    column are aligned to the image edge, so every tile is full size unless
+    the image is smaller than one tile
+    """
+    stride = max(1, int(tile_size * (1 - overlap)))
+
+    def starts(length: int) -> List[int]:
+        if length <= tile_size:
+            return [0]
+        points = list(range(0, length - tile_size, stride))
+        return points + [length - tile_size]
+
+    return [
+        (x, y, min(x + tile_size, width), min(y + tile_size, height))
+        for y in starts(height)
+        for x in starts(width)
+    ]
+
+
+def merge_detections(
+    boxes: np.ndarray,
+    scores: np.ndarray,
+    iou_threshold: float = TRAY_NMS_IOU,
+    ios_threshold: float = TRAY_NMS_IOS,
+) -> List[int]:
+    """
+    Class-agnostic greedy NMS over the detections of all tiles
+
+    The same piece can get different COCO classes in two tiles, so classes
+    are ignored. Besides IoU, a box is suppressed when most of the smaller
+    of the two boxes is covered (intersection over smaller area): the part
+    of a piece cut off by one tile's edge sits inside the whole piece seen
+    by its neighbour, at a low IoU.
+
+    Returns:
+        Indices of the kept boxes, highest score first
+    """
+    if len(boxes) == 0:
+        return []
+    x1, y1, x2, y2 = boxes.T
+    areas = np.maximum(x2 - x1, 0) * np.maximum(y2 - y1, 0)
+    order = np.argsort(-scores)
+    keep = []
+    while order.size:
+        best, rest = order[0], order[1:]
+        keep.append(int(best))
+        width = np.maximum(np.minimum(x2[best], x2[rest]) - np.maximum(x1[best], x1[rest]), 0)
+        height = np.maximum(np.minimum(y2[best], y2[rest]) - np.maximum(y1[best], y1[rest]), 0)
+        intersection = width * height
+        iou = intersection / np.maximum(areas[best] + areas[rest] - intersection, 1e-6)
+        ios = intersection / np.maximum(np.minimum(areas[best], areas[rest]), 1e-6)
+        order = rest[(iou <= iou_threshold) & (ios <= ios_threshold)]
+    return keep
+
 
 class JewelryRecognizer:
     """
@@ -24,9 +112,9 @@ class JewelryRecognizer:
         """Initialize YOLO model and classification parameters"""
         logger.info("Initializing Jewelry Recognizer...")
         
-        # Load YOLOv8 model (nano version for speed)
-        # In production, you would fine-tune this on jewelry dataset
-        self.yolo_model = YOLO('yolov8n.pt')
+        # Load YOLOv8 model (nano version for speed) from the local model store;
+        # a fine-tuned version can be swapped in at runtime (model_registry.py)
+        registry.active("yolov8n")
         
         # Jewelry type keywords for classification
         self.jewelry_types = {
@@ -63,36 +151,38 @@ class JewelryRecognizer:
         
         logger.info("Jewelry Recognizer initialized successfully")
     
-    def recognize(self, image: Image.Image) -> Dict:
+    def recognize(self, image: Union[Image.Image, ImageBuffer]) -> Dict:
         """
         Recognize jewelry type and metal from image
         
         Args:
-            image: PIL Image object
+            image: PIL Image or ImageBuffer
             
         Returns:
             Dictionary with jewelry_type, metal, confidence, and bounding_box
         """
-        # Convert PIL to CV2
-        cv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+        buffer = ImageBuffer.wrap(image)
+        rgb_image = buffer.rgb()
         
-        # Detect objects using YOLO
-        results = self.yolo_model(cv_image, conf=0.3)
+        # Detect objects using YOLO (expects BGR; one explicit copy)
+        with registry.acquire("yolov8n") as detector, model_profiler("yolov8n"):
+            results = detector.model(buffer.bgr(), conf=DETECTION_CONFIDENCE)
+            model_version = detector.version
         
         # Analyze detected objects
         jewelry_detections = []
         
         for result in results:
-            boxes = result.boxes
-            for box in boxes:
-                # Get bounding box coordinates
-                x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                confidence = box.conf[0].cpu().numpy()
-                class_id = int(box.cls[0].cpu().numpy())
-                class_name = result.names[class_id]
+            # Move all boxes to host memory in one transfer instead of per box
+            xyxy = result.boxes.xyxy.cpu().numpy()
+            confidences = result.boxes.conf.cpu().numpy()
+            class_ids = result.boxes.cls.cpu().numpy().astype(int)
+            
+            for (x1, y1, x2, y2), confidence, class_id in zip(xyxy, confidences, class_ids):
+                class_name = result.names[int(class_id)]
                 
-                # Crop detected region
-                cropped = cv_image[int(y1):int(y2), int(x1):int(x2)]
+                # Crop detected region (a slice of the shared buffer)
+                cropped = buffer.crop(x1, y1, x2, y2)
                 
                 # Classify jewelry type based on shape and features
                 jewelry_type = self._classify_jewelry_type(cropped, class_name)
@@ -113,27 +203,113 @@ class JewelryRecognizer:
         
         # If no specific jewelry detected, analyze full image
         if not jewelry_detections:
-            jewelry_type = self._classify_jewelry_type(cv_image)
-            metal = self._detect_metal(cv_image)
+            jewelry_type = self._classify_jewelry_type(rgb_image)
+            metal = self._detect_metal(rgb_image)
             
             return {
                 'jewelry_type': jewelry_type,
                 'metal': metal,
                 'confidence': 0.6,  # Lower confidence for full image analysis
                 'bounding_box': None,
-                'detected_class': 'unknown'
+                'detected_class': 'unknown',
+                'model_version': model_version,
             }
         
         # Return the detection with highest confidence
         best_detection = max(jewelry_detections, key=lambda x: x['confidence'])
+        best_detection['model_version'] = model_version
         return best_detection
     
+    def recognize_tray(
+        self,
+        image: Union[Image.Image, ImageBuffer],
+        tile_size: Optional[int] = None,
+        overlap: Optional[float] = None,
+        batch_size: Optional[int] = None,
+        threads: Optional[int] = None,
+    ) -> Dict:
+        """
+        Recognize every piece in a tray photo by tiled detection
+        
+        Args:
+            image: PIL Image or ImageBuffer
+            tile_size: Tile side in pixels (defaults to TRAY_TILE_SIZE)
+            overlap: Tile overlap fraction (defaults to TRAY_TILE_OVERLAP)
+            batch_size: Tiles per YOLO call (defaults to TRAY_TILE_BATCH)
+            threads: Threads for per-piece analysis (defaults to TRAY_THREADS)
+            
+        Returns:
+            Dictionary with pieces (jewelry_type, metal, confidence,
+            bounding_box and detected_class each, in reading order), count,
+            tiles and model_version
+        """
+        tile_size = tile_size or TRAY_TILE_SIZE
+        overlap = TRAY_TILE_OVERLAP if overlap is None else overlap
+        batch_size = batch_size or TRAY_TILE_BATCH
+        threads = threads or TRAY_THREADS
+        
+        buffer = ImageBuffer.wrap(image)
+        bgr = buffer.bgr()
+        tiles = tile_grid(buffer.width, buffer.height, tile_size, overlap)
+        
+        boxes, scores, classes = [], [], []
+        # One model version for the whole tray, even across a hot swap
+        with registry.acquire("yolov8n") as detector:
+            for start in range(0, len(tiles), batch_size):
+                batch = tiles[start:start + batch_size]
+                with model_profiler("yolov8n"):
+                    results = detector.model(
+                        [bgr[y1:y2, x1:x2] for x1, y1, x2, y2 in batch],
+                        conf=DETECTION_CONFIDENCE, imgsz=tile_size, verbose=False,
+                    )
+                for (x1, y1, _, _), result in zip(batch, results):
+                    # Tile coordinates to image coordinates
+                    boxes.append(result.boxes.xyxy.cpu().numpy() + np.array([x1, y1, x1, y1], dtype=np.float32))
+                    scores.append(result.boxes.conf.cpu().numpy())
+                    classes.extend(result.names[int(c)] for c in result.boxes.cls.cpu().numpy())
+            model_version = detector.version
+        
+        boxes = np.concatenate(boxes) if boxes else np.zeros((0, 4), dtype=np.float32)
+        scores = np.concatenate(scores) if scores else np.zeros(0, dtype=np.float32)
+        keep = merge_detections(boxes, scores)
+        
+        def analyze(index: int) -> Dict:
+            x1, y1, x2, y2 = boxes[index]
+            cropped = buffer.crop(x1, y1, x2, y2)
+            return {
+                'jewelry_type': self._classify_jewelry_type(cropped, classes[index]),
+                'metal': self._detect_metal(cropped),
+                'confidence': float(scores[index]),
+                'bounding_box': {
+                    'x1': int(x1), 'y1': int(y1),
+                    'x2': int(x2), 'y2': int(y2)
+                },
+                'detected_class': classes[index]
+            }
+        
+        # The type/metal heuristics are OpenCV calls that release the GIL
+        if threads > 1 and len(keep) > 1:
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                pieces = list(pool.map(analyze, keep))
+        else:
+            pieces = [analyze(index) for index in keep]
+        pieces.sort(key=lambda piece: (piece['bounding_box']['y1'], piece['bounding_box']['x1']))
+        
+        return {
+            'pieces': pieces,
+            'count': len(pieces),
+            'tiles': len(tiles),
+            'tile_size': tile_size,
+            'overlap': overlap,
+            'model_version': model_version,
+        }
+    
     def _classify_jewelry_type(self, image: np.ndarray, detected_class: str = '') -> str:
         """
         Classify jewelry type based on shape analysis and detected class
         
         Args:
-            image: OpenCV image (BGR)
+            image: RGB image array
             detected_class: Pre-detected class from YOLO
             
         Returns:
@@ -147,7 +323,7 @@ class JewelryRecognizer:
                     return jewelry_type
         
         # Shape-based classification
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
         blurred = cv2.GaussianBlur(gray, (5, 5), 0)
         edges = cv2.Canny(blurred, 50, 150)
         
@@ -193,13 +369,13 @@ class JewelryRecognizer:
         Detect metal type based on color analysis
         
         Args:
-            image: OpenCV image (BGR)
+            image: RGB image array
             
         Returns:
             Metal type string
         """
         # Convert to HSV for better color detection
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        hsv = cv2.cvtColor(image, cv2.COLOR_RGB2HSV)
         
         # Calculate percentage of each metal color
         metal_percentages = {}
@@ -218,7 +394,7 @@ class JewelryRecognizer:
             return 'silver'
         else:
             # Fallback: analyze brightness
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
             avg_brightness = np.mean(gray)
             
             if avg_brightness > 180:
@@ -228,12 +404,12 @@ class JewelryRecognizer:
             else:
                 return 'unknown'
     
-    def recognize_batch(self, images: List[Image.Image]) -> List[Dict]:
+    def recognize_batch(self, images: List[Union[Image.Image, ImageBuffer]]) -> List[Dict]:
         """
         Recognize multiple jewelry images in batch
         
         Args:
-            images: List of PIL Image objects
+            images: List of PIL Images or ImageBuffers
             
         Returns:
             List of recognition results
@@ -255,6 +431,14 @@ class JewelryRecognizer:
         return results
 
 
+def _warm_detector(model, images: List[ImageBuffer]) -> None:
+    """Run a newly loaded detector on sample images before it takes traffic"""
+    for image in images:
+        model(image.bgr(), conf=DETECTION_CONFIDENCE, verbose=False)
+
+
+registry.register("yolov8n", load_yolo, _warm_detector)
+
 # Global instance
 recognizer: Optional[JewelryRecognizer] = None
 
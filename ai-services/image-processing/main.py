@@ -3,21 +3,54 @@ AI Image Processing Service
 FastAPI endpoint for background removal, auto-tagging, and description generation
 """
 
+import asyncio
+import hmac
+import json
+import math
 import os
 import io
+import time
 import uuid
-from typing import List, Optional
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+from typing import List, Optional, Set, Tuple, Union
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from PIL import Image
 import cv2
 import numpy as np
-from rembg import remove
-import torch
-from torchvision import models, transforms
 import logging
-from jewelry_recognition import get_recognizer
+from image_quality import (
+    analyze_batch,
+    gate_summary,
+    quality_recommendations,
+    quality_score as compute_quality_score,
+    resolve_gate_mode,
+    run_quality_gate,
+)
+from service_metrics import counters, stage_stats, timed_stage
+from image_buffer import ImageBuffer
+from segmentation import (
+    padded_box,
+    paste_on_canvas,
+    resolve_background_mode,
+    resolve_crop_output,
+)
+from binary_api import decode_raw_image, encode_png, msgpack_response, pack_envelope, read_bool_option, read_option
+from singleflight import ClientDisconnected, SingleFlight, request_key
+from deadlines import Deadline, record_skip, remaining_ms, wait_timeout
+from profiling import profiler
+from pipeline_dag import Stage, TAGGING_INPUT, resolve_stage_input, run_dag
+from event_stream import MEDIA_TYPES, EventChannel, EventSink, resolve_stream_format
+from tagging import device, get_classifier, get_projector
+from variants import image_file, write_variants
+import model_workers
+import artifact_store
+from artifact_store import ARTIFACT_DIR, ARTIFACT_STORE, artifacts, store_key
+from fair_scheduler import request_class, scheduled, scheduler
+from model_registry import SWAPPABLE, registry
+from model_store import ModelArtifactError, artifact_path, model_version, verify_artifacts
+from jewelry_recognition import TRAY_TILE_OVERLAP, TRAY_TILE_SIZE, tile_grid
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -39,39 +72,66 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def request_lifecycle(request: Request, call_next):
+    """
+    Answer 504 without reading the body when the header deadline has passed,
+    reject malformed tenant/priority headers, and count finished requests
+    against an active profiling session
+    """
+    try:
+        deadline = Deadline.from_headers(request.headers)
+    except ValueError:
+        return JSONResponse(status_code=400, content={"detail": "Invalid request deadline header"})
+    try:
+        request_class(request.headers)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"detail": str(e)})
+    if deadline is not None and deadline.expired():
+        counters.incr("deadline.dropped_on_arrival")
+        return JSONResponse(status_code=504, content={"detail": "Request deadline already passed"})
+    response = await call_next(request)
+    if profiler.active and not request.url.path.startswith("/admin"):
+        await run_in_threadpool(profiler.request_finished)
+    return response
+
+# Token for the /admin endpoints; they are disabled when unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
 # Create temp directory for processing
 TEMP_DIR = "/tmp/jewelry-ai"
 os.makedirs(TEMP_DIR, exist_ok=True)
 
-# Initialize models
-logger.info("Loading AI models...")
-
-# Load pre-trained ResNet for image classification/tagging
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-classification_model = models.resnet50(pretrained=True)
-classification_model.eval()
-classification_model.to(device)
-
-# Image preprocessing for classification
-preprocess = transforms.Compose([
-    transforms.Resize(256),
-    transforms.CenterCrop(224),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-])
-
-# Jewelry-specific tags mapping (simplified)
-JEWELRY_TAGS = {
-    "necklace": ["necklace", "chain", "pendant"],
-    "ring": ["ring", "band", "engagement ring"],
-    "earring": ["earring", "ear stud", "drop earring"],
-    "bracelet": ["bracelet", "bangle", "cuff"],
-    "gold": ["gold", "yellow gold", "rose gold"],
-    "silver": ["silver", "white gold", "platinum"],
-    "diamond": ["diamond", "gemstone", "precious stone"],
-}
-
-logger.info("AI models loaded successfully")
+# Fail startup on a missing or corrupted artifact (YOLO and U^2-Net load
+# lazily, so they would otherwise only fail their first request)
+verify_artifacts()
+
+# Initialize models: in-process unless MODEL_WORKERS=1, in which case each
+# model family is loaded by its worker processes at startup
+if not model_workers.MODEL_WORKERS:
+    logger.info("Loading AI models...")
+    get_classifier()
+    get_projector()
+    logger.info("AI models loaded successfully")
+
+# Coalescing of identical in-flight requests
+process_flight = SingleFlight("process_image")
+catalog_flight = SingleFlight("catalog")
+
+# Background jobs of the streaming endpoint, held until they finish so they
+# are not garbage-collected while running
+stream_tasks: Set[asyncio.Task] = set()
+
+
+@app.on_event("startup")
+async def start_model_workers():
+    model_workers.start_workers()
+
+
+@app.on_event("shutdown")
+async def stop_model_workers():
+    model_workers.stop_workers()
 
 
 @app.get("/")
@@ -85,92 +145,269 @@ async def root():
     }
 
 
+@app.get("/metrics")
+async def metrics():
+    """Per-stage latency statistics and service counters"""
+    return {
+        "stages": stage_stats.snapshot(),
+        "counters": counters.snapshot(),
+        "quality_gate": gate_summary(),
+        "model_workers": model_workers.worker_status(),
+        "scheduler": scheduler.status(),
+    }
+
+
+@app.get("/images/{image_id}")
+async def get_image(image_id: str):
+    """
+    Download a processed image (by processed_image_id, as PNG) or one of its
+    variants (by variant_id)
+    """
+    resolved = image_file(image_id, TEMP_DIR)
+    if resolved is None or not os.path.exists(resolved[0]):
+        raise HTTPException(status_code=404, detail="Image not found")
+    path, media_type = resolved
+    # Ids are never reused, so the content behind one never changes
+    return FileResponse(path, media_type=media_type, headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+
+# ==================== ADMIN ====================
+
+def require_admin(request: Request) -> None:
+    """Check the X-Admin-Token header against ADMIN_TOKEN"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    token = request.headers.get("x-admin-token", "")
+    if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+@app.post("/admin/profile")
+async def start_profiling(
+    request: Request,
+    requests: Optional[int] = Form(None),
+    seconds: Optional[float] = Form(None),
+):
+    """
+    Profile the next N requests or T seconds, whichever ends first
+    
+    Writes collapsed Python stacks (flamegraph.pl / speedscope) and one
+    Chrome trace per ResNet and YOLO call under PROFILE_DIR.
+    
+    Args:
+        requests: Number of requests to profile
+        seconds: Maximum session length (capped at PROFILE_MAX_SECONDS)
+    
+    Returns:
+        JSON describing the session and where its files will be written
+    """
+    require_admin(request)
+    if requests is None and seconds is None:
+        raise HTTPException(status_code=400, detail="Set requests, seconds or both")
+    if (requests is not None and requests <= 0) or (seconds is not None and seconds <= 0):
+        raise HTTPException(status_code=400, detail="requests and seconds must be positive")
+    try:
+        return profiler.start(requests, seconds)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@app.post("/admin/resuggest")
+async def resuggest_catalog(request: Request, recompute: bool = Form(False)):
+    """
+    Rebuild the catalog suggestions of every upload in the artifact store
+    with the current taxonomy (format_jewelry_name, get_hsn_code, ...)
+    
+    Stored recognition results are reused, so no model runs for images
+    whose result is current. Writes one JSON line per image to a
+    resuggest-<timestamp>.jsonl file under ARTIFACT_DIR.
+    
+    Args:
+        recompute: Re-run recognition from the kept upload for images whose
+            stored result is missing or from an older model version
+            (otherwise they are only counted as stale)
+    
+    Returns:
+        JSON summary with counts, duration and the output path
+    """
+    require_admin(request)
+    if not ARTIFACT_STORE:
+        raise HTTPException(status_code=409, detail="The artifact store is disabled; set ARTIFACT_STORE=1 to enable it")
+    return await run_in_threadpool(resuggest_all, recompute)
+
+
+@app.post("/admin/models/{name}")
+async def swap_model(
+    request: Request,
+    name: str,
+    version: str = Form(...),
+    filename: Optional[str] = Form(None),
+):
+    """
+    Hot-swap a model (yolov8n or resnet50) to another version
+    
+    The version is loaded and warmed in the background (in every worker of
+    the model's family with MODEL_WORKERS=1) while the current one keeps
+    serving; requests running on the old version finish on it before it is
+    freed. Poll GET /admin/models for the outcome.
+    
+    Args:
+        name: Model to swap
+        version: Version directory under MODEL_DIR holding the artifact and
+            its checksum (python model_store.py add <name> <version> <file>)
+        filename: Artifact file in that directory (defaults to the manifest's)
+    
+    Returns:
+        202 with the swap state
+    """
+    require_admin(request)
+    if name not in SWAPPABLE:
+        raise HTTPException(status_code=404, detail=f"Model must be one of {', '.join(SWAPPABLE)}")
+    try:
+        # Verified here so a bad version is reported now, not by the loader
+        path = await run_in_threadpool(artifact_path, name, version, filename)
+    except ModelArtifactError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    filename = os.path.basename(path)
+    try:
+        if model_workers.MODEL_WORKERS:
+            state = model_workers.swap_model(name, version, filename)
+        else:
+            state = registry.swap(name, version, filename)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return JSONResponse(status_code=202, content=state)
+
+
+@app.get("/admin/models")
+async def model_status(request: Request):
+    """Model versions in service, models still draining and the last swaps"""
+    require_admin(request)
+    return {
+        "in_service": {name: model_version(name) for name in SWAPPABLE},
+        "registry": registry.status(),
+        "workers": {
+            family: [{"index": w["index"], "models": w["models"]} for w in workers]
+            for family, workers in model_workers.worker_status()["pools"].items()
+            if family in model_workers.MODEL_FAMILIES.values()
+        },
+    }
+
+
+@app.get("/admin/profile")
+async def profiling_status(request: Request):
+    """Active and last finished profiling session"""
+    require_admin(request)
+    return profiler.status()
+
+
+@app.delete("/admin/profile")
+async def stop_profiling(request: Request):
+    """Stop the active profiling session early and write its files"""
+    require_admin(request)
+    summary = await run_in_threadpool(profiler.stop)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="No profiling session is running")
+    return summary
+
+
 @app.post("/process-image")
 async def process_image(
+    request: Request,
     file: UploadFile = File(...),
     remove_background: bool = Form(True),
     auto_tag: bool = Form(True),
     generate_description: bool = Form(False),
+    quality_gate: Optional[str] = Form(None),
+    background_mode: Optional[str] = Form(None),
+    tagging_input: Optional[str] = Form(None),
+    variants: bool = Form(False),
+    timeout_ms: Optional[float] = Form(None),
 ):
     """
     Process jewelry image with multiple AI operations
     
+    Identical concurrent requests (same bytes and options) share one
+    computation and receive the same processed image.
+    
+    With a deadline (timeout_ms, X-Request-Timeout-Ms or X-Request-Deadline)
+    operations that cannot finish in time are skipped and the response is
+    marked partial.
+    
     Args:
         file: Image file to process
         remove_background: Whether to remove background
         auto_tag: Whether to generate tags
         generate_description: Whether to generate description
+        quality_gate: "off", "flag" or "reject" (defaults to QUALITY_GATE_MODE)
+        background_mode: "full" or "lowres" (defaults to BG_REMOVAL_MODE)
+        tagging_input: Tag the "original" (default, runs alongside background
+            removal) or the "segmented" image
+        variants: Also store the VARIANT_SIZES x VARIANT_FORMATS variants of
+            the processed image and return their ids
+        timeout_ms: Time budget for the request in milliseconds
     
     Returns:
         JSON with processed image URL, tags, and description
     """
+    options = {
+        "remove_background": remove_background,
+        "auto_tag": auto_tag,
+        "generate_description": generate_description,
+        "gate_mode": validate_gate_mode(quality_gate),
+        "background_mode": validate_background_mode(background_mode),
+        "tagging_input": validate_tagging_input(tagging_input),
+        "variants": variants,
+    }
+    deadline = request_deadline(request, timeout_ms)
+    
     try:
         # Read image file
         contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
-        
-        # Convert to RGB if needed
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        result = {
-            "success": True,
-            "original_filename": file.filename,
-            "operations": [],
-        }
+        filename = file.filename
         
-        # Background removal
-        if remove_background:
-            logger.info("Removing background...")
-            image = remove_image_background(image)
-            result["operations"].append("background_removal")
-            result["processed_image_available"] = True
+        def job() -> dict:
+            result, _ = run_process_image(contents, filename, output="file", deadline=deadline, **options)
+            return result
         
-        # Auto-tagging
-        if auto_tag:
-            logger.info("Generating tags...")
-            tags = generate_tags(image)
-            result["tags"] = tags
-            result["operations"].append("auto_tagging")
-        
-        # Generate description
-        if generate_description:
-            logger.info("Generating description...")
-            description = generate_product_description(
-                result.get("tags", []),
-                file.filename
-            )
-            result["description"] = description
-            result["operations"].append("description_generation")
-        
-        # Save processed image
-        if remove_background:
-            image_id = str(uuid.uuid4())
-            output_path = os.path.join(TEMP_DIR, f"{image_id}.png")
-            image.save(output_path, format='PNG')
-            result["processed_image_path"] = output_path
-            result["processed_image_id"] = image_id
-        
-        result["confidence"] = 0.85  # Placeholder confidence score
+        key = request_key(contents, transport="multipart", filename=filename, deadline=deadline_key(deadline), **options)
+        result = await asyncio.wait_for(
+            process_flight.do(key, lambda: scheduled(request.headers, lambda: run_in_threadpool(job)), request.is_disconnected),
+            timeout=wait_timeout(deadline),
+        )
         
         return JSONResponse(content=result)
     
+    except ClientDisconnected:
+        return Response(status_code=499)
+    except asyncio.TimeoutError:
+        counters.incr("deadline.exceeded")
+        raise HTTPException(status_code=504, detail="Deadline exceeded")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing image: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
 
 
 @app.post("/remove-background")
-async def remove_background_endpoint(file: UploadFile = File(...)):
+async def remove_background_endpoint(
+    request: Request,
+    file: UploadFile = File(...),
+    background_mode: Optional[str] = Form(None),
+):
     """
     Remove background from jewelry image using U^2-Net model
     
     Args:
         file: Image file
+        background_mode: "full" or "lowres" (defaults to BG_REMOVAL_MODE)
     
     Returns:
         Image with transparent background (PNG)
     """
+    background_mode = validate_background_mode(background_mode)
+    
     try:
         # Read image
         contents = await file.read()
@@ -178,7 +415,9 @@ async def remove_background_endpoint(file: UploadFile = File(...)):
         
         # Remove background
         logger.info(f"Removing background from {file.filename}...")
-        output_image = remove_image_background(input_image)
+        output_image = await scheduled(
+            request.headers, lambda: run_in_threadpool(model_workers.segment, input_image, background_mode)
+        )
         
         # Convert to bytes
         img_byte_arr = io.BytesIO()
@@ -199,7 +438,7 @@ async def remove_background_endpoint(file: UploadFile = File(...)):
 
 
 @app.post("/auto-tag")
-async def auto_tag_endpoint(file: UploadFile = File(...)):
+async def auto_tag_endpoint(request: Request, file: UploadFile = File(...)):
     """
     Automatically generate tags for jewelry image
     
@@ -212,17 +451,19 @@ async def auto_tag_endpoint(file: UploadFile = File(...)):
     try:
         # Read image
         contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
+        image = ImageBuffer.from_bytes(contents)
         
         # Generate tags
         logger.info(f"Generating tags for {file.filename}...")
-        tags = generate_tags(image)
+        tagging = await scheduled(request.headers, lambda: run_in_threadpool(model_workers.tag, image))
         
         return JSONResponse(content={
             "success": True,
             "filename": file.filename,
-            "tags": tags,
-            "confidence": 0.85,
+            "tags": tagging["tags"],
+            "tag_scores": tagging["tag_scores"],
+            "confidence": tagging["confidence"],
+            "model_versions": {"resnet50": tagging.get("model_version")},
         })
     
     except Exception as e:
@@ -252,26 +493,16 @@ async def analyze_quality(file: UploadFile = File(...)):
         
         # Calculate sharpness (Laplacian variance)
         gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        sharpness = cv2.Laplacian(gray, cv2.CV_64F).var()
+        sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
         
         # Calculate brightness
-        brightness = np.mean(gray)
+        brightness = float(np.mean(gray))
         
         # Calculate contrast
-        contrast = np.std(gray)
+        contrast = float(np.std(gray))
         
         # Determine quality score
-        quality_score = min(100, (sharpness / 100 + brightness / 2.55 + contrast / 2.55) / 3)
-        
-        recommendations = []
-        if sharpness < 100:
-            recommendations.append("Image appears blurry. Use better focus.")
-        if brightness < 100:
-            recommendations.append("Image is too dark. Increase lighting.")
-        if brightness > 200:
-            recommendations.append("Image is too bright. Reduce lighting.")
-        if contrast < 50:
-            recommendations.append("Low contrast. Adjust lighting or camera settings.")
+        quality_score = compute_quality_score(sharpness, brightness, contrast)
         
         return JSONResponse(content={
             "success": True,
@@ -282,7 +513,7 @@ async def analyze_quality(file: UploadFile = File(...)):
                 "brightness": round(brightness, 2),
                 "contrast": round(contrast, 2),
             },
-            "recommendations": recommendations if recommendations else ["Image quality is good!"],
+            "recommendations": quality_recommendations(sharpness, brightness, contrast),
         })
     
     except Exception as e:
@@ -290,83 +521,145 @@ async def analyze_quality(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=f"Error analyzing quality: {str(e)}")
 
 
-# ==================== HELPER FUNCTIONS ====================
-
-def remove_image_background(image: Image.Image) -> Image.Image:
+@app.post("/analyze-quality/batch")
+async def analyze_quality_batch(files: List[UploadFile] = File(...)):
     """
-    Remove background from image using rembg (U^2-Net)
+    Analyze the quality of several images in one vectorized pass
+    
+    Metrics are computed on a downscaled grayscale copy of each image, so
+    sharpness values are on a different scale than /analyze-quality.
     
     Args:
-        image: PIL Image
+        files: Image files
     
     Returns:
-        PIL Image with transparent background
+        JSON with one quality report per file, in upload order; files that
+        cannot be decoded get an "error" entry instead
     """
     try:
-        # Use rembg to remove background
-        output = remove(image)
-        return output
+        contents = [await file.read() for file in files]
+        
+        logger.info(f"Analyzing quality of {len(files)} images...")
+        with timed_stage("quality_batch"):
+            reports = analyze_batch(contents)
+        
+        for file, report in zip(files, reports):
+            report["filename"] = file.filename
+        failed = sum("error" in report for report in reports)
+        if failed:
+            logger.warning(f"{failed} of {len(files)} images could not be decoded")
+        
+        return JSONResponse(content={
+            "success": True,
+            "count": len(reports),
+            "failed": failed,
+            "results": reports,
+        })
+    
     except Exception as e:
-        logger.error(f"Background removal failed: {str(e)}")
-        # Fallback: return original image
-        return image
+        logger.error(f"Error analyzing quality batch: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error analyzing quality: {str(e)}")
+
+
+# ==================== HELPER FUNCTIONS ====================
+
+def validate_gate_mode(mode: Optional[str]) -> str:
+    """Resolve the per-request quality gate mode or fail with 400"""
+    try:
+        return resolve_gate_mode(mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def validate_background_mode(mode: Optional[str]) -> str:
+    """Resolve the per-request background removal mode or fail with 400"""
+    try:
+        return resolve_background_mode(mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def validate_tagging_input(value: Optional[str]) -> str:
+    """Resolve the per-request tagging input or fail with 400"""
+    try:
+        return resolve_stage_input(value or TAGGING_INPUT)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"tagging_input: {e}")
 
 
-def generate_tags(image: Image.Image) -> List[str]:
+def parse_crop_padding(value: Union[float, str]) -> float:
+    """Parse crop_padding (form field or binary API option) or fail with 400"""
+    try:
+        padding = float(value)
+    except (TypeError, ValueError):
+        padding = math.nan
+    if not math.isfinite(padding) or padding < 0:
+        raise HTTPException(status_code=400, detail="crop_padding must be a finite number >= 0")
+    return padding
+
+
+def validate_crop_options(padding: float, output: Optional[str]) -> str:
+    """Validate the detection-guided crop options or fail with 400"""
+    parse_crop_padding(padding)
+    try:
+        return resolve_crop_output(output)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def validate_tray_options(tile_size: Optional[int], overlap: Optional[float], tile_batch: Optional[int]) -> None:
+    """Validate the tray mode tiling options or fail with 400"""
+    if tile_size is not None and not 128 <= tile_size <= 2048:
+        raise HTTPException(status_code=400, detail="tile_size must be between 128 and 2048")
+    if overlap is not None and not 0 <= overlap <= 0.5:
+        raise HTTPException(status_code=400, detail="overlap must be between 0 and 0.5")
+    if tile_batch is not None and not 1 <= tile_batch <= 64:
+        raise HTTPException(status_code=400, detail="tile_batch must be between 1 and 64")
+
+
+def request_deadline(request: Request, timeout_ms: Optional[Union[float, str]]) -> Optional[Deadline]:
+    """Resolve the request deadline; 400 if malformed, 504 if already passed"""
+    try:
+        deadline = Deadline.from_headers(request.headers, None if timeout_ms is None else float(timeout_ms))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="timeout_ms and deadline headers must be numbers")
+    if deadline is not None and deadline.expired():
+        counters.incr("deadline.dropped_on_arrival")
+        raise HTTPException(status_code=504, detail="Request deadline already passed")
+    return deadline
+
+
+def deadline_key(deadline: Optional[Deadline]) -> bool:
     """
-    Generate tags for jewelry image using deep learning
+    Deadline component of a coalescing key
+    
+    Only whether a request has a deadline is part of the key, not when it
+    expires (no two clients send the same instant). Requests without one
+    never receive a partial result; deadline-bound requests share the
+    computation started under the first one's budget, and each waiter still
+    gives up at its own deadline (wait_timeout).
+    """
+    return deadline is not None
+
+
+def apply_quality_gate_failure(result: dict, gate: dict) -> dict:
+    """
+    Handle an image that failed the quality gate
     
     Args:
-        image: PIL Image
+        result: Partially built endpoint result
+        gate: Gate report from run_quality_gate
     
     Returns:
-        List of tags
+        The flagged result (raises 422 in reject mode)
     """
-    try:
-        # Preprocess image
-        input_tensor = preprocess(image)
-        input_batch = input_tensor.unsqueeze(0).to(device)
-        
-        # Run inference
-        with torch.no_grad():
-            output = classification_model(input_batch)
-        
-        # Get top predictions
-        probabilities = torch.nn.functional.softmax(output[0], dim=0)
-        top5_prob, top5_catid = torch.topk(probabilities, 5)
-        
-        # Generate jewelry-specific tags
-        tags = []
-        
-        # Analyze image colors
-        image_array = np.array(image)
-        avg_color = image_array.mean(axis=(0, 1))
-        
-        # Determine metal type based on color
-        if avg_color[0] > 180:  # Yellowish
-            tags.append("gold")
-        elif avg_color.mean() > 200:  # Bright/white
-            tags.append("silver")
-        
-        # Add shape-based tags (simplified)
-        height, width = image_array.shape[:2]
-        aspect_ratio = width / height
-        
-        if aspect_ratio > 1.5:
-            tags.append("necklace")
-        elif aspect_ratio < 0.8:
-            tags.append("earring")
-        else:
-            tags.append("ring")
-        
-        # Add generic jewelry tags
-        tags.extend(["handcrafted", "elegant", "premium"])
-        
-        return list(set(tags))  # Remove duplicates
-    
-    except Exception as e:
-        logger.error(f"Tag generation failed: {str(e)}")
-        return ["jewelry", "handcrafted"]
+    if gate["mode"] == "reject":
+        raise HTTPException(status_code=422, detail={
+            "error": "Image failed quality gate",
+            "quality": gate,
+        })
+    result["quality_flagged"] = True
+    return result
 
 
 def generate_product_description(tags: List[str], filename: str) -> str:
@@ -399,6 +692,7 @@ def generate_product_description(tags: List[str], filename: str) -> str:
 
 @app.post("/recognize-jewelry")
 async def recognize_jewelry_endpoint(
+    request: Request,
     file: UploadFile = File(...),
 ):
     """
@@ -413,18 +707,11 @@ async def recognize_jewelry_endpoint(
     try:
         # Read image file
         contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
-        
-        # Convert to RGB if needed
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        # Get recognizer instance
-        recognizer = get_recognizer()
+        image = ImageBuffer.from_bytes(contents)
         
         # Recognize jewelry
         logger.info("Recognizing jewelry...")
-        recognition_result = recognizer.recognize(image)
+        recognition_result = await scheduled(request.headers, lambda: run_in_threadpool(model_workers.recognize, image))
         
         # Build response
         result = {
@@ -442,6 +729,7 @@ async def recognize_jewelry_endpoint(
                 "metal_type": map_metal_type(recognition_result['metal']),
             },
             "bounding_box": recognition_result.get('bounding_box'),
+            "model_versions": {"yolov8n": recognition_result.get('model_version')},
         }
         
         return JSONResponse(content=result)
@@ -451,88 +739,873 @@ async def recognize_jewelry_endpoint(
         raise HTTPException(status_code=500, detail=f"Recognition failed: {str(e)}")
 
 
+@app.post("/recognize-jewelry/tray")
+async def recognize_tray_endpoint(
+    request: Request,
+    file: UploadFile = File(...),
+    tile_size: Optional[int] = Form(None),
+    overlap: Optional[float] = Form(None),
+    tile_batch: Optional[int] = Form(None),
+):
+    """
+    Recognize every piece in a photo of a tray of jewelry
+    
+    The image is cut into overlapping tiles that YOLO sees at full
+    resolution, so small rings and studs are not lost to downscaling; boxes
+    are merged across tiles.
+    
+    Args:
+        file: Image file of the tray
+        tile_size: Tile side in pixels (defaults to TRAY_TILE_SIZE)
+        overlap: Tile overlap fraction, 0-0.5 (defaults to TRAY_TILE_OVERLAP)
+        tile_batch: Tiles per YOLO call (defaults to TRAY_TILE_BATCH)
+    
+    Returns:
+        JSON with every piece (jewelry_type, metal, confidence, bounding_box
+        and suggestions), the piece count and the number of tiles
+    """
+    validate_tray_options(tile_size, overlap, tile_batch)
+    try:
+        contents = await file.read()
+        image = ImageBuffer.from_bytes(contents)
+        
+        options = {"tile_size": tile_size, "overlap": overlap, "batch_size": tile_batch}
+        tiles = tile_grid(
+            image.width, image.height,
+            tile_size or TRAY_TILE_SIZE, TRAY_TILE_OVERLAP if overlap is None else overlap,
+        )
+        logger.info(f"Recognizing tray {file.filename} in {len(tiles)} tiles...")
+        # Each tile is a detector pass, which is what the tenant is charged
+        tray = await scheduled(
+            request.headers,
+            lambda: run_in_threadpool(model_workers.recognize_tray, image, **options),
+            cost=len(tiles),
+        )
+        
+        pieces = [
+            {
+                **piece,
+                "suggestions": {
+                    "name": format_jewelry_name(piece['jewelry_type'], piece['metal']),
+                    "hsn_code": get_hsn_code(piece['jewelry_type']),
+                    "category": piece['jewelry_type'],
+                    "metal_type": map_metal_type(piece['metal']),
+                },
+            }
+            for piece in tray["pieces"]
+        ]
+        return JSONResponse(content={
+            "success": True,
+            "filename": file.filename,
+            "count": tray["count"],
+            "pieces": pieces,
+            "tiles": tray["tiles"],
+            "tile_size": tray["tile_size"],
+            "overlap": tray["overlap"],
+            "model_versions": {"yolov8n": tray["model_version"]},
+        })
+    
+    except Exception as e:
+        logger.error(f"Tray recognition failed: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Tray recognition failed: {str(e)}")
+
+
 @app.post("/catalog/upload-with-recognition")
 async def upload_catalog_with_recognition(
+    request: Request,
     file: UploadFile = File(...),
     remove_background: bool = Form(True),
     auto_fill: bool = Form(True),
+    quality_gate: Optional[str] = Form(None),
+    background_mode: Optional[str] = Form(None),
+    crop_to_detection: bool = Form(False),
+    crop_padding: float = Form(0.1),
+    crop_output: Optional[str] = Form(None),
+    variants: bool = Form(False),
+    timeout_ms: Optional[float] = Form(None),
 ):
     """
     Upload jewelry image, recognize it, and prepare catalog entry
     
+    Identical concurrent uploads (retries, double clicks) share one
+    computation and receive the same processed image.
+    
+    With a deadline (timeout_ms, X-Request-Timeout-Ms or X-Request-Deadline)
+    operations that cannot finish in time are skipped and the response is
+    marked partial.
+    
     Args:
         file: Image file to upload
         remove_background: Whether to remove background
         auto_fill: Whether to auto-fill product details
+        quality_gate: "off", "flag" or "reject" (defaults to QUALITY_GATE_MODE)
+        background_mode: "full" or "lowres" (defaults to BG_REMOVAL_MODE)
+        crop_to_detection: Segment only the detected box (requires auto_fill)
+        crop_padding: Padding around the box, as a fraction of its size
+        crop_output: "canvas" (original size) or "tight" (cropped size)
+        variants: Also store the VARIANT_SIZES x VARIANT_FORMATS variants of
+            the processed image and return their ids
+        timeout_ms: Time budget for the request in milliseconds
     
     Returns:
         JSON with recognition results and processed image
     """
+    options = {
+        "remove_background": remove_background,
+        "auto_fill": auto_fill,
+        "gate_mode": validate_gate_mode(quality_gate),
+        "background_mode": validate_background_mode(background_mode),
+        "crop_to_detection": crop_to_detection,
+        "crop_padding": crop_padding,
+        "crop_output": validate_crop_options(crop_padding, crop_output),
+        "variants": variants,
+    }
+    deadline = request_deadline(request, timeout_ms)
+    
     try:
         # Read image file
         contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
+        filename = file.filename
         
-        # Convert to RGB if needed
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
+        def job() -> dict:
+            result, _ = run_catalog_upload(contents, filename, output="file", deadline=deadline, **options)
+            return result
         
-        result = {
-            "success": True,
-            "original_filename": file.filename,
-        }
+        key = request_key(contents, transport="multipart", filename=filename, deadline=deadline_key(deadline), **options)
+        result = await asyncio.wait_for(
+            catalog_flight.do(key, lambda: scheduled(request.headers, lambda: run_in_threadpool(job)), request.is_disconnected),
+            timeout=wait_timeout(deadline),
+        )
         
-        # Recognize jewelry first
-        if auto_fill:
-            logger.info("Recognizing jewelry for auto-fill...")
-            recognizer = get_recognizer()
-            recognition_result = recognizer.recognize(image)
-            
-            result["recognition"] = {
-                "jewelry_type": recognition_result['jewelry_type'],
-                "metal": recognition_result['metal'],
-                "confidence": recognition_result['confidence'],
-            }
-            
-            result["suggested_details"] = {
-                "name": format_jewelry_name(
-                    recognition_result['jewelry_type'],
-                    recognition_result['metal']
-                ),
-                "description": generate_product_description(
-                    [recognition_result['jewelry_type'], recognition_result['metal']],
-                    file.filename
-                ),
-                "hsn_code": get_hsn_code(recognition_result['jewelry_type']),
-                "category": recognition_result['jewelry_type'],
-                "metal_type": map_metal_type(recognition_result['metal']),
-                "tags": [
-                    recognition_result['jewelry_type'],
-                    recognition_result['metal'],
-                    "handcrafted"
-                ],
-            }
+        return JSONResponse(content=result)
+    
+    except ClientDisconnected:
+        return Response(status_code=499)
+    except asyncio.TimeoutError:
+        counters.incr("deadline.exceeded")
+        raise HTTPException(status_code=504, detail="Deadline exceeded")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Catalog upload failed: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+
+
+@app.post("/catalog/upload-with-recognition/stream")
+async def stream_catalog_upload(
+    request: Request,
+    file: UploadFile = File(...),
+    remove_background: bool = Form(True),
+    auto_fill: bool = Form(True),
+    quality_gate: Optional[str] = Form(None),
+    background_mode: Optional[str] = Form(None),
+    crop_to_detection: bool = Form(False),
+    crop_padding: float = Form(0.1),
+    crop_output: Optional[str] = Form(None),
+    variants: bool = Form(False),
+    timeout_ms: Optional[float] = Form(None),
+    stream_format: Optional[str] = Form(None),
+):
+    """
+    Streaming variant of /catalog/upload-with-recognition
+    
+    Emits one event per finished stage instead of waiting for the whole
+    upload: quality, recognition, suggested_details (as soon as recognition
+    is done), processed_image (once the segmented image is saved), variants,
+    skipped,
+    and finally result (the same body the non-streaming endpoint returns)
+    or error. Every event carries elapsed_ms since the request started.
+    
+    Args:
+        Same as /catalog/upload-with-recognition, plus
+        stream_format: "ndjson" (default) or "sse"; without it, an Accept
+            header of text/event-stream selects SSE
+    
+    Returns:
+        NDJSON or server-sent event stream
+    """
+    options = {
+        "remove_background": remove_background,
+        "auto_fill": auto_fill,
+        "gate_mode": validate_gate_mode(quality_gate),
+        "background_mode": validate_background_mode(background_mode),
+        "crop_to_detection": crop_to_detection,
+        "crop_padding": crop_padding,
+        "crop_output": validate_crop_options(crop_padding, crop_output),
+        "variants": variants,
+    }
+    try:
+        stream_format = resolve_stream_format(stream_format, request.headers.get("accept", ""))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    deadline = request_deadline(request, timeout_ms)
+    
+    contents = await file.read()
+    filename = file.filename
+    channel = EventChannel()
+    
+    def job() -> None:
+        try:
+            result, _ = run_catalog_upload(
+                contents, filename, output="file", deadline=deadline, on_event=channel.emit, **options
+            )
+            channel.emit("result", result)
+        except HTTPException as e:
+            channel.emit("error", {"status_code": e.status_code, "detail": e.detail})
+        except Exception as e:
+            logger.error(f"Catalog upload failed: {str(e)}", exc_info=True)
+            channel.emit("error", {"status_code": 500, "detail": f"Upload failed: {str(e)}"})
+        finally:
+            channel.close()
+    
+    # Runs to completion even if the client goes away; events are then dropped
+    task = asyncio.ensure_future(scheduled(request.headers, lambda: run_in_threadpool(job)))
+    stream_tasks.add(task)
+    task.add_done_callback(lambda t: stream_task_done(t, channel))
+    counters.incr(f"stream.{stream_format}")
+    
+    return StreamingResponse(
+        channel.stream(stream_format),
+        media_type=MEDIA_TYPES[stream_format],
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def stream_task_done(task: asyncio.Task, channel: EventChannel) -> None:
+    """Release a finished streaming job and report a failure nothing else would see"""
+    stream_tasks.discard(task)
+    if task.cancelled():
+        return
+    error = task.exception()
+    if error is not None:
+        # job reports its own errors, so this failed before it ran (e.g. in the scheduler)
+        counters.incr("stream.failed")
+        logger.error(f"Streaming catalog upload failed: {error}", exc_info=error)
+        channel.emit("error", {"status_code": 500, "detail": f"Upload failed: {error}"})
+        channel.close()
+
+
+# ==================== INTERNAL BINARY API ====================
+# Raw image bytes in the request body, options in the query string or
+# X-<option> headers, msgpack envelope out (see binary_api.py)
+
+@app.post("/internal/process-image")
+async def internal_process_image(request: Request):
+    """
+    Binary variant of /process-image for service-to-service calls
+    
+    Options: remove_background, auto_tag, generate_description,
+    quality_gate, background_mode, tagging_input, include_image, filename,
+    timeout_ms
+    
+    Returns:
+        msgpack envelope with the result and the processed PNG inline
+    """
+    try:
+        options = {
+            "remove_background": read_bool_option(request, "remove_background", True),
+            "auto_tag": read_bool_option(request, "auto_tag", True),
+            "generate_description": read_bool_option(request, "generate_description", False),
+            "gate_mode": validate_gate_mode(read_option(request, "quality_gate")),
+            "background_mode": validate_background_mode(read_option(request, "background_mode")),
+            "tagging_input": resolve_stage_input(read_option(request, "tagging_input", TAGGING_INPUT)),
+        }
+        include_image = read_bool_option(request, "include_image", True)
+        filename = read_option(request, "filename", "upload")
+        timeout_ms = read_option(request, "timeout_ms")
+        body = await request.body()
+        image = await run_in_threadpool(decode_raw_image, body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    deadline = request_deadline(request, timeout_ms)
+    
+    try:
+        def job() -> bytes:
+            output = "png" if include_image else None
+            result, png = run_process_image(body, filename, output=output, deadline=deadline, decoded=image, **options)
+            return pack_envelope(result, png)
         
-        # Background removal
-        if remove_background:
-            logger.info("Removing background...")
-            image = remove_image_background(image)
-            
-            # Save processed image
-            image_id = str(uuid.uuid4())
-            output_path = os.path.join(TEMP_DIR, f"{image_id}.png")
-            image.save(output_path, format='PNG')
-            
-            result["processed_image_path"] = output_path
-            result["processed_image_id"] = image_id
+        key = request_key(
+            body, transport="binary", filename=filename, include_image=include_image,
+            deadline=deadline_key(deadline), **options
+        )
+        content = await asyncio.wait_for(
+            process_flight.do(key, lambda: scheduled(request.headers, lambda: run_in_threadpool(job)), request.is_disconnected),
+            timeout=wait_timeout(deadline),
+        )
+        return msgpack_response(content)
+    
+    except ClientDisconnected:
+        return Response(status_code=499)
+    except asyncio.TimeoutError:
+        counters.incr("deadline.exceeded")
+        raise HTTPException(status_code=504, detail="Deadline exceeded")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error processing image: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
+
+
+@app.post("/internal/catalog/upload-with-recognition")
+async def internal_upload_catalog_with_recognition(request: Request):
+    """
+    Binary variant of /catalog/upload-with-recognition
+    
+    Options: remove_background, auto_fill, quality_gate, background_mode,
+    crop_to_detection, crop_padding, crop_output, include_image, filename,
+    timeout_ms
+    
+    Returns:
+        msgpack envelope with the result and the processed PNG inline
+    """
+    try:
+        crop_padding = parse_crop_padding(read_option(request, "crop_padding", "0.1"))
+        options = {
+            "remove_background": read_bool_option(request, "remove_background", True),
+            "auto_fill": read_bool_option(request, "auto_fill", True),
+            "gate_mode": validate_gate_mode(read_option(request, "quality_gate")),
+            "background_mode": validate_background_mode(read_option(request, "background_mode")),
+            "crop_to_detection": read_bool_option(request, "crop_to_detection", False),
+            "crop_padding": crop_padding,
+            "crop_output": validate_crop_options(crop_padding, read_option(request, "crop_output")),
+        }
+        include_image = read_bool_option(request, "include_image", True)
+        filename = read_option(request, "filename", "upload")
+        timeout_ms = read_option(request, "timeout_ms")
+        body = await request.body()
+        image = await run_in_threadpool(decode_raw_image, body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    deadline = request_deadline(request, timeout_ms)
+    
+    try:
+        def job() -> bytes:
+            output = "png" if include_image else None
+            result, png = run_catalog_upload(body, filename, output=output, deadline=deadline, decoded=image, **options)
+            return pack_envelope(result, png)
         
-        return JSONResponse(content=result)
+        key = request_key(
+            body, transport="binary", filename=filename, include_image=include_image,
+            deadline=deadline_key(deadline), **options
+        )
+        content = await asyncio.wait_for(
+            catalog_flight.do(key, lambda: scheduled(request.headers, lambda: run_in_threadpool(job)), request.is_disconnected),
+            timeout=wait_timeout(deadline),
+        )
+        return msgpack_response(content)
     
+    except ClientDisconnected:
+        return Response(status_code=499)
+    except asyncio.TimeoutError:
+        counters.incr("deadline.exceeded")
+        raise HTTPException(status_code=504, detail="Deadline exceeded")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Catalog upload failed: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
 
+# ==================== PIPELINES ====================
+
+def run_process_image(
+    source: Union[bytes, ImageBuffer],
+    filename: str,
+    remove_background: bool = True,
+    auto_tag: bool = True,
+    generate_description: bool = False,
+    gate_mode: str = "off",
+    background_mode: str = "full",
+    tagging_input: str = TAGGING_INPUT,
+    variants: bool = False,
+    output: Optional[str] = None,
+    deadline: Optional[Deadline] = None,
+    decoded: Optional[ImageBuffer] = None,
+) -> Tuple[dict, Optional[Union[Image.Image, bytes]]]:
+    """
+    Run the /process-image operations as a stage graph
+    
+        decode -> quality -> background_removal -> encode
+                                                -> variants
+                          -> auto_tagging -> description_generation
+    
+    Background removal and tagging run concurrently unless tagging is set
+    to work on the segmented image.
+    
+    Args:
+        source: Encoded image bytes or an already decoded buffer
+        filename: Original filename (used for the description)
+        remove_background: Whether to remove background
+        auto_tag: Whether to generate tags
+        generate_description: Whether to generate description
+        gate_mode: Resolved quality gate mode
+        background_mode: Resolved background removal mode
+        tagging_input: "original" or "segmented" image for tagging
+        variants: With output "file", also save the resized variants under
+            the processed image id
+        output: "file" saves the processed image to TEMP_DIR, "png" encodes
+            it in memory, None leaves it as a PIL Image
+        deadline: Optional request deadline; stages that cannot finish in
+            time are skipped and the result is marked partial
+        decoded: source already decoded by the caller (source is still
+            used as the artifact store key)
+    
+    Returns:
+        Tuple of (result dict, processed image (PNG bytes for "png") or None)
+    """
+    result = {
+        "success": True,
+        "original_filename": filename,
+        "operations": [],
+    }
+    if deadline is not None:
+        result["partial"] = False
+    
+    guarded = [stage for stage, enabled in (
+        ("background_removal", remove_background),
+        ("auto_tagging", auto_tag),
+    ) if enabled]
+    
+    key = store_key(source)
+    stages = [
+        decode_stage(decoded if decoded is not None else source),
+        quality_stage(gate_mode, guarded),
+    ]
+    if key:
+        stages.append(store_source_stage(key, source, filename))
+    if remove_background:
+        stages.append(Stage(
+            "background_removal",
+            lambda o: artifact_store.segment(key, o["decode"], background_mode),
+            requires=["decode"],
+            deps=["quality_gate"],
+            when=gate_passed,
+            megapixels=lambda o: o["decode"].megapixels,
+        ))
+    def tag(o: dict) -> dict:
+        if tagging_input == "segmented" and o.get("background_removal") is not None:
+            return artifact_store.tag(key, o["background_removal"], f"segmented-{background_mode}")
+        return artifact_store.tag(key, o["decode"], "original")
+    
+    if auto_tag:
+        stages.append(Stage(
+            "auto_tagging",
+            tag,
+            requires=["decode"],
+            deps=["quality_gate"] + (["background_removal"] if tagging_input == "segmented" else []),
+            when=gate_passed,
+        ))
+    if generate_description:
+        stages.append(Stage(
+            "description_generation",
+            lambda o: generate_product_description((o.get("auto_tagging") or {}).get("tags", []), filename),
+            deps=["auto_tagging"],
+            when=gate_passed,
+        ))
+    # Encoding and variants need the processed image
+    image_id = str(uuid.uuid4()) if output == "file" and remove_background else None
+    if output and remove_background:
+        stages.append(encode_stage(output, image_id=image_id))
+    if variants and image_id:
+        stages.append(variants_stage(image_id))
+    
+    outcomes = run_dag(stages, deadline)
+    
+    gate = outcomes["quality_gate"][1]
+    if gate is not None:
+        result["quality"] = gate
+        if not gate["passed"]:
+            return apply_quality_gate_failure(result, gate), None
+    record_stage_outcome(result, "decode", outcomes["decode"])
+    
+    for operation in ("background_removal", "auto_tagging", "description_generation"):
+        if operation in outcomes and record_stage_outcome(result, operation, outcomes[operation]):
+            result["operations"].append(operation)
+    
+    processed = outcomes.get("background_removal", (False, None, None))[1]
+    if processed is not None:
+        result["processed_image_available"] = True
+    # Calibrated tag confidence (None when tagging did not run)
+    result["confidence"] = None
+    if "auto_tagging" in outcomes and outcomes["auto_tagging"][0]:
+        tagging = outcomes["auto_tagging"][1]
+        result["tags"] = tagging["tags"]
+        result["tag_scores"] = tagging["tag_scores"]
+        result["confidence"] = tagging["confidence"]
+        result["model_versions"] = {"resnet50": tagging.get("model_version")}
+    if "description_generation" in outcomes and outcomes["description_generation"][0]:
+        result["description"] = outcomes["description_generation"][1]
+    
+    if "encode" in outcomes:
+        processed = apply_encode_outcome(result, output, outcomes["encode"], processed)
+    if "variants" in outcomes and record_stage_outcome(result, "variants", outcomes["variants"]):
+        result["variants"] = outcomes["variants"][1]
+    
+    if deadline is not None:
+        result["deadline_remaining_ms"] = remaining_ms(deadline)
+    
+    return result, processed
+
+
+def run_catalog_upload(
+    source: Union[bytes, ImageBuffer],
+    filename: str,
+    remove_background: bool = True,
+    auto_fill: bool = True,
+    gate_mode: str = "off",
+    background_mode: str = "full",
+    crop_to_detection: bool = False,
+    crop_padding: float = 0.1,
+    crop_output: str = "canvas",
+    variants: bool = False,
+    output: Optional[str] = None,
+    deadline: Optional[Deadline] = None,
+    on_event: Optional[EventSink] = None,
+    decoded: Optional[ImageBuffer] = None,
+) -> Tuple[dict, Optional[Union[Image.Image, bytes]]]:
+    """
+    Run recognition and background removal for a catalog upload as a stage graph
+    
+        decode -> quality -> recognition
+                          -> background_removal -> encode
+                                                -> variants
+    
+    Recognition and background removal run concurrently, except with
+    crop_to_detection, where segmentation needs the detected box.
+    
+    Args:
+        source: Encoded image bytes or an already decoded buffer
+        filename: Original filename
+        remove_background: Whether to remove background
+        auto_fill: Whether to auto-fill product details
+        gate_mode: Resolved quality gate mode
+        background_mode: Resolved background removal mode
+        crop_to_detection: Segment only the padded detection box
+        crop_padding: Padding around the box, as a fraction of its size
+        crop_output: "canvas" or "tight"
+        variants: With output "file", also save the resized variants under
+            the processed image id
+        output: "file", "png" or None (see run_process_image)
+        deadline: Optional request deadline; stages that cannot finish in
+            time are skipped and the result is marked partial
+        on_event: Optional sink receiving quality, recognition,
+            suggested_details, processed_image, variants and skipped events as the
+            stages finish
+        decoded: source already decoded by the caller (see run_process_image)
+    
+    Returns:
+        Tuple of (result dict, processed image (PNG bytes for "png") or None)
+    """
+    result = {
+        "success": True,
+        "original_filename": filename,
+        "operations": [],
+    }
+    if deadline is not None:
+        result["partial"] = False
+    
+    def on_stage(name: str, outcome: Tuple[bool, object, Optional[str]]) -> None:
+        completed, value, reason = outcome
+        if not completed:
+            if reason is not None:
+                on_event("skipped", {"operation": name, "reason": reason})
+        elif name == "quality_gate" and value is not None:
+            on_event("quality", value)
+        elif name == "recognition":
+            suggestions = build_catalog_suggestions(value, filename)
+            on_event("recognition", suggestions["recognition"])
+            on_event("suggested_details", suggestions["suggested_details"])
+        elif name == "encode" and output == "file":
+            on_event("processed_image", {"processed_image_id": value[0], "processed_image_path": value[1]})
+        elif name == "variants":
+            on_event("variants", {"variants": value})
+    
+    guarded = [stage for stage, enabled in (
+        ("recognition", auto_fill),
+        ("background_removal", remove_background),
+    ) if enabled]
+    
+    def segment(o: dict) -> Tuple[Image.Image, Optional[dict]]:
+        image = o["decode"]
+        recognition_result = o.get("recognition")
+        bounding_box = recognition_result.get('bounding_box') if recognition_result else None
+        if crop_to_detection and bounding_box:
+            logger.info("Removing background from detected region...")
+            return remove_background_in_box(image, bounding_box, crop_padding, crop_output, background_mode)
+        
+        crop = None
+        if crop_to_detection:
+            crop = {"applied": False, "reason": "no detection" if auto_fill else "auto_fill disabled"}
+        logger.info("Removing background...")
+        with timed_stage("background_removal", image.megapixels):
+            return artifact_store.segment(key, image, background_mode), crop
+    
+    key = store_key(source)
+    stages = [
+        decode_stage(decoded if decoded is not None else source),
+        quality_stage(gate_mode, guarded),
+    ]
+    if key:
+        stages.append(store_source_stage(key, source, filename))
+    if auto_fill:
+        stages.append(Stage(
+            "recognition",
+            lambda o: artifact_store.recognize(key, o["decode"]),
+            requires=["decode"],
+            deps=["quality_gate"],
+            when=gate_passed,
+        ))
+    if remove_background:
+        stages.append(Stage(
+            "background_removal",
+            segment,
+            requires=["decode"],
+            deps=["quality_gate"] + (["recognition"] if crop_to_detection else []),
+            when=gate_passed,
+            megapixels=lambda o: o["decode"].megapixels,
+            record=False,
+        ))
+    # Encoding and variants need the processed image
+    image_id = str(uuid.uuid4()) if output == "file" and remove_background else None
+    if output and remove_background:
+        stages.append(encode_stage(output, lambda o: o["background_removal"][0], image_id))
+    if variants and image_id:
+        stages.append(variants_stage(image_id, lambda o: o["background_removal"][0]))
+    
+    outcomes = run_dag(stages, deadline, on_stage if on_event is not None else None)
+    
+    gate = outcomes["quality_gate"][1]
+    if gate is not None:
+        result["quality"] = gate
+        if not gate["passed"]:
+            return apply_quality_gate_failure(result, gate), None
+    record_stage_outcome(result, "decode", outcomes["decode"])
+    
+    if "recognition" in outcomes and record_stage_outcome(result, "recognition", outcomes["recognition"]):
+        result.update(build_catalog_suggestions(outcomes["recognition"][1], filename))
+        result["model_versions"] = {"yolov8n": outcomes["recognition"][1].get("model_version")}
+        result["operations"].append("recognition")
+    
+    processed = None
+    if "background_removal" in outcomes and record_stage_outcome(result, "background_removal", outcomes["background_removal"]):
+        processed, crop = outcomes["background_removal"][1]
+        if crop is not None:
+            result["crop"] = crop
+        result["operations"].append("background_removal")
+    
+    if "encode" in outcomes:
+        processed = apply_encode_outcome(result, output, outcomes["encode"], processed)
+    if "variants" in outcomes and record_stage_outcome(result, "variants", outcomes["variants"]):
+        result["variants"] = outcomes["variants"][1]
+    
+    if deadline is not None:
+        result["deadline_remaining_ms"] = remaining_ms(deadline)
+    
+    return result, processed
+
+
+def decode_stage(source: Union[bytes, ImageBuffer]) -> Stage:
+    """Graph root: decode the upload (or pass an already decoded buffer through)"""
+    if isinstance(source, ImageBuffer):
+        return Stage("decode", lambda o: source, record=False)
+    return Stage("decode", lambda o: decode_raw_image(source))
+
+
+def store_source_stage(key: str, source: bytes, filename: str) -> Stage:
+    """Record the upload in the artifact store, alongside the other stages"""
+    return Stage("store_source", lambda o: artifacts.save_source(key, source, filename), record=False)
+
+
+def quality_stage(gate_mode: str, guarded: List[str]) -> Stage:
+    """Quality gate in front of the model stages (records its own timing)"""
+    return Stage(
+        "quality_gate",
+        lambda o: run_quality_gate(o["decode"], gate_mode, guarded),
+        requires=["decode"],
+        record=False,
+    )
+
+
+def gate_passed(outputs: dict) -> bool:
+    """Stage condition: the quality gate did not fail the image"""
+    gate = outputs.get("quality_gate")
+    return gate is None or gate["passed"]
+
+
+def encode_stage(output: str, processed=lambda o: o["background_removal"], image_id: Optional[str] = None) -> Stage:
+    """Persist ("file") or encode ("png") the processed image"""
+    def encode(o: dict):
+        image = processed(o)
+        if output == "file":
+            return write_processed_image(image, image_id)
+        return encode_png(image)
+    
+    return Stage(
+        "encode",
+        encode,
+        requires=["background_removal"],
+        megapixels=lambda o: o["decode"].megapixels,
+    )
+
+
+def variants_stage(image_id: str, processed=lambda o: o["background_removal"]) -> Stage:
+    """Save the resized variants of the processed image (alongside encode)"""
+    return Stage(
+        "variants",
+        lambda o: write_variants(processed(o), image_id, TEMP_DIR),
+        requires=["background_removal"],
+        megapixels=lambda o: o["decode"].megapixels,
+    )
+
+
+def record_stage_outcome(result: dict, operation: str, outcome: Tuple[bool, object, Optional[str]]) -> bool:
+    """Report a skipped stage in result; returns whether it completed"""
+    completed, _, reason = outcome
+    if not completed and reason is not None:
+        record_skip(result, operation, reason)
+    return completed
+
+
+def apply_encode_outcome(result: dict, output: str, outcome, processed):
+    """Fill in the saved image id/path, or return the encoded PNG bytes"""
+    if not record_stage_outcome(result, "encode", outcome):
+        return None
+    if output == "file":
+        result["processed_image_id"], result["processed_image_path"] = outcome[1]
+        return processed
+    return outcome[1]
+
+
+def resuggest_all(recompute: bool = False) -> dict:
+    """Catalog suggestions for every stored upload (see POST /admin/resuggest)"""
+    start = time.perf_counter()
+    version = artifact_store.recognition_version()
+    summary = {"images": 0, "reused": 0, "recomputed": 0, "stale": 0}
+    output_path = os.path.join(ARTIFACT_DIR, f"resuggest-{time.strftime('%Y%m%d-%H%M%S')}.jsonl")
+    os.makedirs(ARTIFACT_DIR, exist_ok=True)
+    
+    with open(output_path, "w", encoding="utf-8") as out:
+        for key in artifacts.keys():
+            summary["images"] += 1
+            recognition_result = artifacts.get(key, "recognition", version)
+            if recognition_result is not None:
+                summary["reused"] += 1
+            else:
+                contents = artifacts.load_source(key) if recompute else None
+                if contents is None:
+                    summary["stale"] += 1
+                    continue
+                recognition_result = artifact_store.recognize(key, decode_raw_image(contents))
+                summary["recomputed"] += 1
+            filename = artifacts.source(key)["filename"]
+            line = {"content_hash": key, "filename": filename, **build_catalog_suggestions(recognition_result, filename)}
+            out.write(json.dumps(line) + "\n")
+    
+    summary["seconds"] = round(time.perf_counter() - start, 3)
+    summary["output"] = output_path
+    return summary
+
+
+def build_catalog_suggestions(recognition_result: dict, filename: str) -> dict:
+    """
+    Build the recognition and suggested_details blocks of a catalog upload
+    
+    Args:
+        recognition_result: Output of JewelryRecognizer.recognize
+        filename: Original filename
+    
+    Returns:
+        Dictionary with "recognition" and "suggested_details"
+    """
+    return {
+        "recognition": {
+            "jewelry_type": recognition_result['jewelry_type'],
+            "metal": recognition_result['metal'],
+            "confidence": recognition_result['confidence'],
+            "bounding_box": recognition_result.get('bounding_box'),
+            "model_version": recognition_result.get('model_version'),
+        },
+        "suggested_details": {
+            "name": format_jewelry_name(
+                recognition_result['jewelry_type'],
+                recognition_result['metal']
+            ),
+            "description": generate_product_description(
+                [recognition_result['jewelry_type'], recognition_result['metal']],
+                filename
+            ),
+            "hsn_code": get_hsn_code(recognition_result['jewelry_type']),
+            "category": recognition_result['jewelry_type'],
+            "metal_type": map_metal_type(recognition_result['metal']),
+            "tags": [
+                recognition_result['jewelry_type'],
+                recognition_result['metal'],
+                "handcrafted"
+            ],
+        },
+    }
+
+
+def remove_background_in_box(
+    image: ImageBuffer,
+    bounding_box: dict,
+    padding: float,
+    output: str,
+    background_mode: str,
+) -> Tuple[Image.Image, dict]:
+    """
+    Segment only the padded detection box instead of the whole frame
+    
+    Args:
+        image: Full-frame image buffer
+        bounding_box: Detection box (x1, y1, x2, y2)
+        padding: Padding around the box, as a fraction of its size
+        output: "canvas" pastes the cutout onto a transparent frame of the
+            original size; "tight" returns the cropped cutout
+        background_mode: Resolved background removal mode
+    
+    Returns:
+        Tuple of (processed image, crop report)
+    """
+    x1, y1, x2, y2 = padded_box(bounding_box, image.width, image.height, padding)
+    region = ImageBuffer(image.crop(x1, y1, x2, y2))
+    
+    start = time.perf_counter()
+    processed = model_workers.segment(region, background_mode)
+    seconds = time.perf_counter() - start
+    stage_stats.record("background_removal_cropped", seconds, region.megapixels)
+    
+    if output == "canvas":
+        processed = paste_on_canvas(processed, image.size, (x1, y1))
+    
+    # Full-frame cost estimated from uncropped runs at this image size
+    full_estimate = stage_stats.estimate("background_removal", image.megapixels)
+    pixel_reduction = 1 - region.megapixels / image.megapixels
+    counters.incr("crop.requests")
+    counters.incr("crop.megapixels_skipped", image.megapixels - region.megapixels)
+    
+    return processed, {
+        "applied": True,
+        "box": {"x1": x1, "y1": y1, "x2": x2, "y2": y2},
+        "output": output,
+        "original_megapixels": round(image.megapixels, 3),
+        "segmented_megapixels": round(region.megapixels, 3),
+        "pixel_reduction": round(pixel_reduction, 4),
+        "segmentation_seconds": round(seconds, 4),
+        "estimated_full_frame_seconds": round(full_estimate, 4) if full_estimate else None,
+        "estimated_speedup": round(full_estimate / seconds, 2) if full_estimate and seconds else None,
+    }
+
+
+def write_processed_image(image: Image.Image, image_id: Optional[str] = None) -> Tuple[str, str]:
+    """Save a processed image to TEMP_DIR; returns (image_id, path)"""
+    image_id = image_id or str(uuid.uuid4())
+    output_path = os.path.join(TEMP_DIR, f"{image_id}.png")
+    image.save(output_path, format='PNG')
+    return image_id, output_path
+
+
 def format_jewelry_name(jewelry_type: str, metal: str) -> str:
     """Format a product name based on recognition results"""
     jewelry_names = {
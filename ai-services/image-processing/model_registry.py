@@ -0,0 +1,272 @@
+"""
+Model Registry Module
+
+Hot-swappable model versions. The YOLO detector (yolov8n) and the ResNet-50
+tagger (resnet50) are held in one slot each, in every process that runs them
+(the service itself, or each worker process with MODEL_WORKERS=1).
+
+A swap (POST /admin/models/<name>):
+1. loads the new version in a background thread, from MODEL_DIR/<version>/
+   and checksum-verified like any artifact (see model_store.py)
+2. warms it with sample inputs: the images in MODEL_WARMUP_DIR, or synthetic
+   ones, MODEL_WARMUP_RUNS passes
+3. swaps the slot under a lock; requests keep being served by the old
+   version until then, and requests already running on it finish on it
+4. frees the old model when its last request releases it
+
+Results carry the version that produced them (model_versions in the
+responses). A failed load or warm-up leaves the old version in service.
+
+rembg's U^2-Net session is not swappable: rembg resolves its model through
+the process-wide U2NET_HOME.
+"""
+
+import gc
+import importlib
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from image_buffer import ImageBuffer
+from model_store import artifact_path, current_version, select_version
+from service_metrics import counters, stage_stats
+
+logger = logging.getLogger(__name__)
+
+MODEL_WARMUP_DIR = os.getenv("MODEL_WARMUP_DIR", "")
+MODEL_WARMUP_RUNS = int(os.getenv("MODEL_WARMUP_RUNS", "3"))
+
+# Synthetic warm-up images (width, height) when MODEL_WARMUP_DIR is unset
+WARMUP_SIZES = ((640, 640), (1200, 900))
+
+# Swappable models and the modules that register them
+SWAPPABLE = {"yolov8n": "jewelry_recognition", "resnet50": "tagging"}
+
+
+def warmup_images() -> List[ImageBuffer]:
+    """Sample inputs for warming up a new model version"""
+    images = []
+    if MODEL_WARMUP_DIR and os.path.isdir(MODEL_WARMUP_DIR):
+        for name in sorted(os.listdir(MODEL_WARMUP_DIR))[:8]:
+            try:
+                with open(os.path.join(MODEL_WARMUP_DIR, name), "rb") as f:
+                    images.append(ImageBuffer.from_bytes(f.read()))
+            except Exception as e:
+                logger.warning(f"Skipping warm-up image {name}: {e}")
+    if not images:
+        rng = np.random.default_rng(0)
+        images = [
+            ImageBuffer(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+            for width, height in WARMUP_SIZES
+        ]
+    return images
+
+
+class ModelHandle:
+    """One loaded version of a model and the requests using it"""
+
+    __slots__ = ("name", "version", "model", "in_flight", "retired", "loaded_at")
+
+    def __init__(self, name: str, version: str, model: Any):
+        self.name = name
+        self.version = version
+        self.model = model
+        self.in_flight = 0
+        self.retired = False
+        self.loaded_at = time.time()
+
+    def status(self) -> Dict:
+        return {"version": self.version, "in_flight": self.in_flight, "loaded_at": self.loaded_at}
+
+
+class _Spec:
+    def __init__(self, load: Callable[[Optional[str]], Any], warm: Callable[[Any, List[ImageBuffer]], None]):
+        self.load = load
+        self.warm = warm
+
+
+class ModelRegistry:
+    """Versioned model slots with reference-counted handles"""
+
+    def __init__(self):
+        self._specs: Dict[str, _Spec] = {}
+        self._active: Dict[str, ModelHandle] = {}
+        self._retired: List[ModelHandle] = []
+        self._swaps: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def register(
+        self,
+        name: str,
+        load: Callable[[Optional[str]], Any],
+        warm: Callable[[Any, List[ImageBuffer]], None],
+    ) -> None:
+        """
+        Declare how a model is loaded and warmed
+
+        Args:
+            name: Artifact name (models.json)
+            load: Builds the model from an artifact path (None for the
+                version in service)
+            warm: Runs the model on sample images
+        """
+        self._specs[name] = _Spec(load, warm)
+
+    def _spec(self, name: str) -> _Spec:
+        if name not in self._specs and name in SWAPPABLE:
+            importlib.import_module(SWAPPABLE[name])
+        if name not in self._specs:
+            raise KeyError(f"Model '{name}' is not swappable")
+        return self._specs[name]
+
+    def active(self, name: str) -> ModelHandle:
+        """Handle of the version in service, loading it on first use"""
+        handle = self._active.get(name)
+        if handle is None:
+            with self._load_lock:
+                handle = self._active.get(name)
+                if handle is None:
+                    version, filename = current_version(name)
+                    handle = ModelHandle(name, f"{version}/{filename}", self._spec(name).load(None))
+                    with self._lock:
+                        self._active[name] = handle
+        return handle
+
+    @contextmanager
+    def acquire(self, name: str) -> Iterator[ModelHandle]:
+        """
+        Use the version in service for one call; a swap during the call
+        does not free it until the call is done
+        """
+        self.active(name)
+        with self._lock:
+            handle = self._active[name]
+            handle.in_flight += 1
+        try:
+            yield handle
+        finally:
+            with self._lock:
+                handle.in_flight -= 1
+                drained = handle.retired and handle.in_flight == 0
+                if drained:
+                    self._retired.remove(handle)
+            if drained:
+                self._free(handle)
+
+    def _free(self, handle: ModelHandle) -> None:
+        handle.model = None
+        gc.collect()
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+        counters.incr(f"model_registry.{handle.name}.freed")
+        logger.info(f"Freed {handle.name} {handle.version}")
+
+    def swap(
+        self,
+        name: str,
+        version: str,
+        filename: Optional[str] = None,
+        done: Optional[Callable[[Dict], None]] = None,
+    ) -> Dict:
+        """
+        Load, warm and switch to another version of a model in the background
+
+        Args:
+            name: Model to swap (one of SWAPPABLE)
+            version: Version directory under MODEL_DIR
+            filename: Artifact file in it (defaults to the manifest's)
+            done: Called with the final swap state
+
+        Returns:
+            The swap state (state "loading")
+
+        Raises:
+            KeyError: For a model that is not registered
+            RuntimeError: If a swap of the model is already running
+        """
+        self._spec(name)
+        with self._lock:
+            previous = self._swaps.get(name)
+            if previous is not None and previous["state"] in ("loading", "warming"):
+                raise RuntimeError(f"A swap of {name} to {previous['version']} is already running")
+            state = self._swaps[name] = {
+                "model": name,
+                "version": version,
+                "filename": filename,
+                "state": "loading",
+                "started": time.time(),
+            }
+        threading.Thread(
+            target=self._swap, args=(name, version, filename, state, done),
+            name=f"swap-{name}", daemon=True,
+        ).start()
+        return dict(state)
+
+    def _swap(self, name: str, version: str, filename: Optional[str], state: Dict, done) -> None:
+        spec = self._spec(name)
+        start = time.perf_counter()
+        try:
+            path = artifact_path(name, version, filename)
+            filename = os.path.basename(path)
+            model = spec.load(path)
+            state["state"] = "warming"
+            warm_start = time.perf_counter()
+            images = warmup_images()
+            for _ in range(max(1, MODEL_WARMUP_RUNS)):
+                spec.warm(model, images)
+            stage_stats.record(f"model_registry.{name}.warmup", time.perf_counter() - warm_start)
+
+            handle = ModelHandle(name, f"{version}/{filename}", model)
+            with self._load_lock, self._lock:
+                old = self._active.get(name)
+                self._active[name] = handle
+                select_version(name, version, filename)
+                drained = old is not None and old.in_flight == 0
+                if old is not None:
+                    old.retired = True
+                    if not drained:
+                        self._retired.append(old)
+            if drained:
+                self._free(old)
+            state.update(
+                state="active",
+                filename=filename,
+                previous=old.version if old is not None else None,
+                seconds=round(time.perf_counter() - start, 2),
+            )
+            counters.incr(f"model_registry.{name}.swaps")
+            logger.info(f"Swapped {name} to {handle.version} in {state['seconds']}s")
+        except Exception as e:
+            state.update(state="failed", error=f"{type(e).__name__}: {e}")
+            counters.incr(f"model_registry.{name}.failed_swaps")
+            logger.error(f"Swap of {name} to {version} failed: {e}", exc_info=True)
+        if done is not None:
+            done(dict(state))
+
+    def versions(self) -> Dict[str, str]:
+        """Version in service per loaded model"""
+        return {name: handle.version for name, handle in self._active.items()}
+
+    def status(self) -> Dict:
+        with self._lock:
+            return {
+                name: {
+                    "active": self._active[name].status() if name in self._active else None,
+                    "draining": [h.status() for h in self._retired if h.name == name],
+                    "last_swap": dict(self._swaps[name]) if name in self._swaps else None,
+                }
+                for name in self._specs
+            }
+
+
+registry = ModelRegistry()
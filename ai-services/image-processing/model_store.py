@@ -0,0 +1,377 @@
+"""
+Model Store Module
+
+Offline, checksum-verified model artifacts. Weights listed in models.json
+are fetched into a versioned local directory at build time:
+
+    python model_store.py fetch
+
+At runtime they are loaded from that directory only. A missing or corrupted
+artifact raises ModelArtifactError instead of falling back to a download.
+
+Every artifact must pin a checksum (sha256, sha256_prefix or md5) in
+models.json; fetch refuses to download one that does not. Record it from a
+copy obtained from a trusted source with:
+
+    python model_store.py pin yolov8n /path/to/yolov8n.pt
+
+Other versions (e.g. a fine-tuned detector) are added next to it and can be
+hot-swapped in at runtime (see model_registry.py):
+
+    python model_store.py add yolov8n 2024.06-jewelry /path/to/best.pt
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+import urllib.request
+from typing import Dict, Optional, Tuple
+
+from service_metrics import stage_stats
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_MANIFEST = os.getenv("MODEL_MANIFEST", os.path.join(BASE_DIR, "models.json"))
+MODEL_DIR = os.getenv("MODEL_DIR", os.path.join(BASE_DIR, "models"))
+
+# Verify checksums when an artifact is first resolved in this process
+MODEL_VERIFY = os.getenv("MODEL_VERIFY", "1") == "1"
+
+# Development escape hatch: download missing artifacts at runtime
+MODEL_AUTO_FETCH = os.getenv("MODEL_AUTO_FETCH", "0") == "1"
+
+# Development escape hatch: fetch artifacts models.json pins no checksum for
+MODEL_ALLOW_UNPINNED = os.getenv("MODEL_ALLOW_UNPINNED", "0") == "1"
+
+# Manifest keys that pin an artifact's content
+PIN_KEYS = ("sha256", "sha256_prefix", "md5")
+
+CHECKSUMS_FILE = "checksums.json"
+
+_verified: Dict[Tuple[str, str, str], str] = {}
+
+# Versions put in service by a hot swap, overriding the manifest:
+# name -> (version, filename)
+_selected: Dict[str, Tuple[str, str]] = {}
+
+
+class ModelArtifactError(RuntimeError):
+    """A model artifact is missing, corrupted or not declared in the manifest"""
+
+
+def load_manifest() -> Dict:
+    """Read models.json"""
+    with open(MODEL_MANIFEST, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def current_version(name: str) -> Tuple[str, str]:
+    """(version, filename) of an artifact in service: the swapped-in one, else the manifest's"""
+    if name in _selected:
+        return _selected[name]
+    manifest = load_manifest()
+    return manifest["version"], manifest["artifacts"][name]["filename"]
+
+
+def model_version(name: str) -> str:
+    """Version and file of an artifact in service, e.g. "2024.01/yolov8n.pt" """
+    version, filename = current_version(name)
+    return f"{version}/{filename}"
+
+
+def select_version(name: str, version: str, filename: str) -> None:
+    """Record the version of an artifact a hot swap put in service"""
+    _selected[name] = (version, filename)
+
+
+def version_dir(manifest: Dict) -> str:
+    """Directory holding the artifacts of the manifest's version"""
+    return os.path.join(MODEL_DIR, manifest["version"])
+
+
+def _file_digests(path: str) -> Dict[str, str]:
+    sha256, md5 = hashlib.sha256(), hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(chunk)
+            md5.update(chunk)
+    return {"sha256": sha256.hexdigest(), "md5": md5.hexdigest()}
+
+
+def _check_declared(name: str, spec: Dict, digests: Dict[str, str]) -> None:
+    """Compare digests against the checksums pinned in the manifest"""
+    if "sha256" in spec and digests["sha256"] != spec["sha256"]:
+        raise ModelArtifactError(f"{name}: sha256 {digests['sha256']} does not match manifest {spec['sha256']}")
+    if "sha256_prefix" in spec and not digests["sha256"].startswith(spec["sha256_prefix"]):
+        raise ModelArtifactError(f"{name}: sha256 {digests['sha256']} does not start with {spec['sha256_prefix']}")
+    if "md5" in spec and digests["md5"] != spec["md5"]:
+        raise ModelArtifactError(f"{name}: md5 {digests['md5']} does not match manifest {spec['md5']}")
+
+
+def _read_checksums(directory: str) -> Dict[str, str]:
+    path = os.path.join(directory, CHECKSUMS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def fetch(names=None) -> Dict[str, str]:
+    """
+    Download artifacts into the versioned directory and record their checksums
+
+    Artifacts already present with a matching checksum are not downloaded
+    again. Meant for image build time, not for the request path.
+
+    Args:
+        names: Artifact names to fetch (defaults to all in the manifest)
+
+    Returns:
+        Mapping of artifact name to local path
+    """
+    manifest = load_manifest()
+    directory = version_dir(manifest)
+    os.makedirs(directory, exist_ok=True)
+    checksums = _read_checksums(directory)
+    paths = {}
+
+    for name, spec in manifest["artifacts"].items():
+        if names and name not in names:
+            continue
+        path = os.path.join(directory, spec["filename"])
+        if os.path.exists(path) and checksums.get(name) == _file_digests(path)["sha256"]:
+            logger.info(f"{name}: already present at {path}")
+            paths[name] = path
+            continue
+
+        if not any(key in spec for key in PIN_KEYS):
+            if not MODEL_ALLOW_UNPINNED:
+                raise ModelArtifactError(
+                    f"{name}: {MODEL_MANIFEST} pins no checksum; download it from a trusted source "
+                    f"and run 'python model_store.py pin {name} <file>'"
+                )
+            logger.warning(f"{name}: no checksum pinned in {MODEL_MANIFEST}; fetching unverified")
+        logger.info(f"{name}: downloading {spec['url']}")
+        partial = path + ".part"
+        start = time.perf_counter()
+        urllib.request.urlretrieve(spec["url"], partial)
+        digests = _file_digests(partial)
+        try:
+            _check_declared(name, spec, digests)
+        except ModelArtifactError:
+            os.remove(partial)
+            raise
+        os.replace(partial, path)
+        checksums[name] = digests["sha256"]
+        logger.info(f"{name}: {os.path.getsize(path) / 1e6:.1f} MB in {time.perf_counter() - start:.1f}s, sha256 {digests['sha256']}")
+        paths[name] = path
+
+    with open(os.path.join(directory, CHECKSUMS_FILE), "w", encoding="utf-8") as f:
+        json.dump(checksums, f, indent=2, sort_keys=True)
+    return paths
+
+
+def artifact_path(name: str, version: Optional[str] = None, filename: Optional[str] = None) -> str:
+    """
+    Resolve a local, verified artifact path (never downloads unless
+    MODEL_AUTO_FETCH=1)
+
+    Args:
+        name: Artifact name from models.json
+        version: Version directory under MODEL_DIR (defaults to the version
+            in service, see current_version)
+        filename: File in that directory (defaults to the manifest's)
+
+    Returns:
+        Absolute path of the artifact
+
+    Raises:
+        ModelArtifactError: If the artifact is missing or fails verification
+    """
+    manifest = load_manifest()
+    spec = manifest["artifacts"].get(name)
+    if spec is None:
+        raise ModelArtifactError(f"Model artifact '{name}' is not declared in {MODEL_MANIFEST}")
+    if version is None:
+        version, filename = current_version(name)
+    filename = filename or spec["filename"]
+    if os.path.basename(filename) != filename or os.path.basename(version) != version:
+        raise ModelArtifactError(f"Invalid model version '{version}/{filename}'")
+
+    cache_key = (name, version, filename)
+    if cache_key in _verified:
+        return _verified[cache_key]
+
+    # Only the manifest's own file is covered by its declared checksums and URL
+    declared = version == manifest["version"] and filename == spec["filename"]
+    directory = os.path.join(MODEL_DIR, version)
+    path = os.path.join(directory, filename)
+    if not os.path.exists(path):
+        if not declared:
+            raise ModelArtifactError(
+                f"Model artifact '{name}' version {version} not found at {path}. "
+                f"Add it with 'python model_store.py add {name} {version} <file>'."
+            )
+        if not MODEL_AUTO_FETCH:
+            raise ModelArtifactError(
+                f"Model artifact '{name}' not found at {path}. "
+                f"Run 'python model_store.py fetch' at build time (or set MODEL_AUTO_FETCH=1 for development)."
+            )
+        fetch([name])
+
+    if MODEL_VERIFY:
+        start = time.perf_counter()
+        expected = _read_checksums(directory).get(name)
+        if expected is None:
+            raise ModelArtifactError(f"No recorded checksum for '{name}' in {directory}; re-run 'python model_store.py fetch'")
+        digests = _file_digests(path)
+        if digests["sha256"] != expected:
+            raise ModelArtifactError(f"Model artifact '{name}' at {path} is corrupted (sha256 {digests['sha256']}, expected {expected})")
+        if declared:
+            _check_declared(name, spec, digests)
+        stage_stats.record(f"cold_start.verify.{name}", time.perf_counter() - start)
+
+    _verified[cache_key] = path
+    return path
+
+
+def verify_artifacts(names=None) -> Dict[str, str]:
+    """
+    Resolve (and with MODEL_VERIFY=1, checksum) the artifacts in service
+
+    Called at startup so a missing or corrupted artifact fails the service
+    before the first request that needs it.
+
+    Args:
+        names: Artifact names (defaults to all in the manifest)
+
+    Returns:
+        Mapping of artifact name to local path
+
+    Raises:
+        ModelArtifactError: If an artifact is missing or fails verification
+    """
+    return {name: artifact_path(name) for name in names or load_manifest()["artifacts"]}
+
+
+def pin(name: str, source: str) -> str:
+    """
+    Pin the sha256 of a trusted copy of an artifact in models.json
+
+    Returns:
+        The recorded digest
+    """
+    manifest = load_manifest()
+    if name not in manifest["artifacts"]:
+        raise ModelArtifactError(f"Model artifact '{name}' is not declared in {MODEL_MANIFEST}")
+    digest = _file_digests(source)["sha256"]
+    manifest["artifacts"][name]["sha256"] = digest
+    with open(MODEL_MANIFEST, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+        f.write("\n")
+    return digest
+
+
+def add_version(name: str, version: str, source: str) -> str:
+    """
+    Copy a model file into MODEL_DIR/<version>/ and record its checksum, so
+    the version can be hot-swapped in
+
+    Returns:
+        Local path of the artifact
+    """
+    if name not in load_manifest()["artifacts"]:
+        raise ModelArtifactError(f"Model artifact '{name}' is not declared in {MODEL_MANIFEST}")
+    directory = os.path.join(MODEL_DIR, version)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, os.path.basename(source))
+    shutil.copyfile(source, path)
+    checksums = _read_checksums(directory)
+    checksums[name] = _file_digests(path)["sha256"]
+    with open(os.path.join(directory, CHECKSUMS_FILE), "w", encoding="utf-8") as f:
+        json.dump(checksums, f, indent=2, sort_keys=True)
+    return path
+
+
+def _timed_load(name: str, loader):
+    start = time.perf_counter()
+    model = loader()
+    seconds = time.perf_counter() - start
+    stage_stats.record(f"cold_start.load.{name}", seconds)
+    logger.info(f"Cold start: loaded {name} in {seconds:.2f}s")
+    return model
+
+
+def load_resnet50(path: Optional[str] = None):
+    """
+    Build torchvision's ResNet-50 with the local ImageNet weights (or the
+    weights at path)
+
+    The state dict is memory-mapped (torch.load mmap=True) so pages are read
+    lazily; legacy-format checkpoints fall back to a regular load.
+    """
+    import torch
+    from torchvision import models
+
+    path = path or artifact_path("resnet50")
+
+    def loader():
+        model = models.resnet50()
+        try:
+            state = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+        except RuntimeError:
+            state = torch.load(path, map_location="cpu", weights_only=True)
+        model.load_state_dict(state)
+        return model
+
+    return _timed_load("resnet50", loader)
+
+
+def load_yolo(path: Optional[str] = None):
+    """Load the YOLOv8 detector from its local checkpoint (or the one at path)"""
+    from ultralytics import YOLO
+
+    path = path or artifact_path("yolov8n")
+    return _timed_load("yolov8n", lambda: YOLO(path))
+
+
+def create_rembg_session():
+    """
+    Create the rembg U^2-Net session from the local model file
+
+    rembg looks for its models in U2NET_HOME and only downloads when the
+    file is missing or its hash differs; both cases are ruled out by
+    artifact_path.
+    """
+    from rembg import new_session
+
+    path = artifact_path("u2net")
+    os.environ["U2NET_HOME"] = os.path.dirname(path)
+    return _timed_load("u2net", lambda: new_session("u2net"))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) == 5 and sys.argv[1] == "add":
+        _, _, artifact, version, source = sys.argv
+        path = add_version(artifact, version, source)
+        print(f"{artifact}: OK {artifact_path(artifact, version, os.path.basename(path))}")
+        sys.exit(0)
+    if len(sys.argv) == 4 and sys.argv[1] == "pin":
+        print(f"{sys.argv[2]}: sha256 {pin(sys.argv[2], sys.argv[3])} pinned in {MODEL_MANIFEST}")
+        sys.exit(0)
+    if len(sys.argv) < 2 or sys.argv[1] not in ("fetch", "verify"):
+        print("Usage: python model_store.py fetch|verify [name ...]")
+        print("       python model_store.py add <name> <version> <file>")
+        print("       python model_store.py pin <name> <file>")
+        sys.exit(2)
+    selected = sys.argv[2:] or None
+    if sys.argv[1] == "fetch":
+        fetch(selected)
+    for artifact, path in verify_artifacts(selected).items():
+        print(f"{artifact}: OK {path}")
@@ -0,0 +1,494 @@
+"""
+Model Workers Module
+
+Optional out-of-process model execution. With MODEL_WORKERS=1 each model
+family (YOLO recognizer, ResNet tagger, rembg segmenter) runs in its own
+long-lived worker processes, so their Python-level work no longer shares a
+GIL with the FastAPI event loop.
+
+Decoded images are handed over through multiprocessing.shared_memory: the
+front end copies the pixel buffer into a shared block once and sends only
+its name and shape; the segmenter writes its RGBA output into a second block
+allocated by the front end. Only small results (dicts, tag lists) are pickled.
+
+A supervisor thread restarts workers that die; calls that were in flight on
+a crashed worker fail with WorkerCrashed.
+
+Model hot swaps (model_registry.py) are broadcast to every worker of the
+family; each loads and warms the new version in a background thread while
+it keeps serving jobs. Restarted workers load the last version swapped in.
+
+While a profiling session is active (profiling.py), each job carries the
+session so the worker writes its torch Chrome traces into the session
+directory.
+
+With MODEL_WORKERS=0 (default) the same functions run in-process.
+"""
+
+import itertools
+import logging
+import multiprocessing as mp
+import os
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+from image_buffer import ImageBuffer
+from profiling import profiler
+from service_metrics import counters, stage_stats
+
+logger = logging.getLogger(__name__)
+
+MODEL_WORKERS = os.getenv("MODEL_WORKERS", "0") == "1"
+
+FAMILIES = ("recognizer", "tagger", "segmenter")
+
+# Family whose workers run each hot-swappable model
+MODEL_FAMILIES = {"yolov8n": "recognizer", "resnet50": "tagger"}
+
+# Processes per family, e.g. MODEL_WORKERS_SEGMENTER=2
+WORKER_PROCESSES = {family: int(os.getenv(f"MODEL_WORKERS_{family.upper()}", "1")) for family in FAMILIES}
+
+# torch intra-op threads per worker process (0 keeps torch's default)
+WORKER_TORCH_THREADS = int(os.getenv("MODEL_WORKER_TORCH_THREADS", "0"))
+
+# Longest a front-end call waits for its worker
+CALL_TIMEOUT_SECONDS = float(os.getenv("MODEL_WORKER_TIMEOUT", "120"))
+
+SUPERVISE_INTERVAL_SECONDS = 1.0
+
+
+class WorkerCrashed(RuntimeError):
+    """The worker process handling a call died before answering"""
+
+
+# ==================== WORKER PROCESS ====================
+
+def _warm(family: str) -> None:
+    """Load the family's model before accepting jobs"""
+    if family == "recognizer":
+        from jewelry_recognition import get_recognizer
+        get_recognizer()
+    elif family == "tagger":
+        from tagging import get_classifier, get_projector
+        get_classifier()
+        get_projector()
+    elif family == "segmenter":
+        from segmentation import get_session
+        get_session()
+
+
+def _handle(family: str, image: np.ndarray, out: Optional[np.ndarray], options: Dict) -> Any:
+    """Run one job on a shared-memory image; returns a picklable value"""
+    if family == "recognizer":
+        from jewelry_recognition import get_recognizer
+        if options.get("tray") is not None:
+            return get_recognizer().recognize_tray(ImageBuffer(image), **options["tray"])
+        return get_recognizer().recognize(ImageBuffer(image))
+    if family == "tagger":
+        if options.get("probabilities"):
+            from tagging import class_probabilities
+            return class_probabilities([ImageBuffer(image)])[0].numpy()
+        from tagging import tag_image
+        return tag_image(ImageBuffer(image))
+    if family == "segmenter":
+        from segmentation import remove_image_background
+        processed = remove_image_background(ImageBuffer(image), options.get("mode"))
+        mode = "RGBA" if processed.mode != "RGB" else "RGB"
+        pixels = np.asarray(processed.convert(mode))
+        out[:pixels.size] = pixels.reshape(-1)
+        return mode
+    raise ValueError(f"Unknown model family: {family}")
+
+
+def _run_job(family: str, job: Tuple) -> Tuple[bool, Any]:
+    _, in_name, shape, out_name, out_size, options, profile = job
+    in_shm = shared_memory.SharedMemory(name=in_name)
+    out_shm = shared_memory.SharedMemory(name=out_name) if out_name else None
+    image = out = None
+    try:
+        image = np.ndarray(shape, dtype=np.uint8, buffer=in_shm.buf)
+        out = np.ndarray((out_size,), dtype=np.uint8, buffer=out_shm.buf) if out_shm else None
+        with profiler.attach(profile):
+            return True, _handle(family, image, out, options)
+    except Exception as e:
+        logger.error(f"{family} worker job failed: {e}", exc_info=True)
+        return False, f"{type(e).__name__}: {e}"
+    finally:
+        # Views must be released before the blocks can be closed
+        image = out = None
+        in_shm.close()
+        if out_shm is not None:
+            out_shm.close()
+
+
+def _swap(index: int, results: mp.Queue, name: str, version: str, filename: str) -> None:
+    """Start a hot swap in this worker; the outcome is reported as a ("swap", ...) message"""
+    from model_registry import registry
+
+    def done(state: Dict) -> None:
+        results.put(("swap", index, state))
+
+    try:
+        registry.swap(name, version, filename, done=done)
+    except (KeyError, RuntimeError) as e:
+        done({"model": name, "version": version, "filename": filename, "state": "failed", "error": str(e)})
+
+
+def _worker_main(
+    family: str,
+    index: int,
+    requests: mp.Queue,
+    results: mp.Queue,
+    versions: Dict[str, Tuple[str, str]],
+) -> None:
+    """Entry point of a worker process"""
+    logging.basicConfig(level=logging.INFO)
+    if WORKER_TORCH_THREADS:
+        import torch
+        torch.set_num_threads(WORKER_TORCH_THREADS)
+    if versions:
+        from model_store import select_version
+        for name, (version, filename) in versions.items():
+            select_version(name, version, filename)
+    _warm(family)
+    results.put(("ready", index, os.getpid()))
+    while True:
+        job = requests.get()
+        if job is None:
+            return
+        if job[0] == "swap":
+            _swap(index, results, *job[1:])
+            continue
+        ok, value = _run_job(family, job)
+        results.put((job[0], ok, value))
+
+
+# ==================== FRONT END ====================
+
+class _Worker:
+    """One worker process and the calls currently assigned to it"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[mp.Process] = None
+        self.requests: Optional[mp.Queue] = None
+        self.in_flight: Dict[int, Future] = {}
+        self.ready = False
+        self.restarts = 0
+        # Last hot-swap state per model
+        self.models: Dict[str, Dict] = {}
+
+
+class WorkerPool:
+    """Supervised worker processes for one model family"""
+
+    def __init__(self, family: str, processes: int = 1):
+        self.family = family
+        self._ctx = mp.get_context("spawn")
+        self._results = self._ctx.Queue()
+        self._workers = [_Worker(i) for i in range(max(1, processes))]
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._owner: Dict[int, _Worker] = {}
+        self._stopping = threading.Event()
+        # Versions swapped in, loaded by (re)started workers
+        self._versions: Dict[str, Tuple[str, str]] = {}
+
+    def start(self) -> None:
+        for worker in self._workers:
+            self._spawn(worker)
+        threading.Thread(target=self._collect, name=f"{self.family}-results", daemon=True).start()
+        threading.Thread(target=self._supervise, name=f"{self.family}-supervisor", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        for worker in self._workers:
+            worker.requests.put(None)
+        for worker in self._workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        self._results.put(None)
+
+    def _spawn(self, worker: _Worker) -> None:
+        worker.requests = self._ctx.Queue()
+        worker.ready = False
+        # A (re)started worker loads the swapped-in versions directly
+        worker.models = {
+            name: {"model": name, "version": version, "filename": filename, "state": "active"}
+            for name, (version, filename) in self._versions.items()
+        }
+        worker.process = self._ctx.Process(
+            target=_worker_main,
+            args=(self.family, worker.index, worker.requests, self._results, dict(self._versions)),
+            name=f"model-worker-{self.family}-{worker.index}",
+            daemon=True,
+        )
+        worker.process.start()
+        logger.info(f"Started {self.family} worker {worker.index} (pid {worker.process.pid})")
+
+    def _collect(self) -> None:
+        """Resolve futures as results come back from any worker"""
+        while True:
+            message = self._results.get()
+            if message is None:
+                return
+            if message[0] == "ready":
+                _, index, _pid = message
+                self._workers[index].ready = True
+                continue
+            if message[0] == "swap":
+                _, index, state = message
+                self._swapped(self._workers[index], state)
+                continue
+            job_id, ok, value = message
+            with self._lock:
+                worker = self._owner.pop(job_id, None)
+                future = worker.in_flight.pop(job_id, None) if worker else None
+            if future is None:
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(RuntimeError(f"{self.family} worker: {value}"))
+
+    def _supervise(self) -> None:
+        """Restart dead workers and fail the calls they were holding"""
+        while not self._stopping.wait(SUPERVISE_INTERVAL_SECONDS):
+            for worker in self._workers:
+                if worker.process.is_alive():
+                    continue
+                with self._lock:
+                    lost = list(worker.in_flight.items())
+                    worker.in_flight.clear()
+                    for job_id, _ in lost:
+                        self._owner.pop(job_id, None)
+                exit_code = worker.process.exitcode
+                for _, future in lost:
+                    future.set_exception(WorkerCrashed(
+                        f"{self.family} worker {worker.index} exited with code {exit_code}"
+                    ))
+                logger.error(f"{self.family} worker {worker.index} died (exit code {exit_code}); restarting")
+                counters.incr(f"model_workers.{self.family}.restarts")
+                counters.incr(f"model_workers.{self.family}.lost_calls", len(lost))
+                worker.restarts += 1
+                self._spawn(worker)
+
+    def swap(self, name: str, version: str, filename: str) -> Dict:
+        """
+        Hot-swap a model in every worker (each keeps serving while it loads)
+
+        Raises:
+            RuntimeError: If a swap of the model is still running on a worker
+        """
+        with self._lock:
+            if any(w.models.get(name, {}).get("state") in ("pending", "loading", "warming") for w in self._workers):
+                raise RuntimeError(f"A swap of {name} is already running")
+            self._versions[name] = (version, filename)
+            state = {"model": name, "version": version, "filename": filename, "state": "pending", "started": time.time()}
+            for worker in self._workers:
+                worker.models[name] = dict(state)
+                worker.requests.put(("swap", name, version, filename))
+        return {**state, "workers": len(self._workers)}
+
+    def _swapped(self, worker: _Worker, state: Dict) -> None:
+        """
+        Record a worker's swap outcome; the front end switches versions once all workers have
+
+        When a worker fails to load the new version, the pool goes back to the
+        version the front end has in service, and workers that already
+        switched (or switch later) are swapped back so all of them serve the
+        same model.
+        """
+        from model_store import current_version, select_version
+
+        name = state["model"]
+        with self._lock:
+            worker.models[name] = state
+            target = self._versions.get(name)
+            if state["state"] == "failed":
+                logger.error(f"{self.family} worker {worker.index}: swap of {name} to {state['version']} failed: {state.get('error')}")
+                if target is not None and state["version"] == target[0]:
+                    # Restarted workers go back to the version in service too
+                    target = self._versions[name] = current_version(name)
+            revert = [
+                w for w in self._workers
+                if target and w.models.get(name, {}).get("state") == "active"
+                and (w.models[name]["version"], w.models[name]["filename"]) != target
+            ]
+            for w in revert:
+                w.models[name] = {"model": name, "version": target[0], "filename": target[1], "state": "pending", "started": time.time()}
+                w.requests.put(("swap", name, *target))
+            states = [w.models.get(name, {}) for w in self._workers]
+        if revert:
+            logger.warning(
+                f"{self.family} workers {', '.join(str(w.index) for w in revert)}: "
+                f"swapping {name} back to {target[0]}/{target[1]}"
+            )
+        elif target and all(s.get("state") == "active" and (s["version"], s["filename"]) == target for s in states):
+            select_version(name, *target)
+            logger.info(f"{self.family} workers: {name} {target[0]}/{target[1]} in service")
+
+    def _assign(self, job_id: int, future: Future) -> _Worker:
+        """Pick the alive worker with the fewest calls in flight"""
+        with self._lock:
+            alive = [w for w in self._workers if w.process.is_alive()] or self._workers
+            worker = min(alive, key=lambda w: (not w.ready, len(w.in_flight)))
+            worker.in_flight[job_id] = future
+            self._owner[job_id] = worker
+        return worker
+
+    def call(self, image: ImageBuffer, out_size: int = 0, **options: Any) -> Tuple[Any, Optional[np.ndarray]]:
+        """
+        Run a job on a worker
+
+        Args:
+            image: Input image, copied once into shared memory
+            out_size: Bytes of shared output buffer to allocate (0 for none)
+            **options: Small picklable job options
+
+        Returns:
+            Tuple of (result value, copy of the output buffer or None)
+
+        Raises:
+            WorkerCrashed: If the worker died while handling the call
+        """
+        start = time.perf_counter()
+        array = image.rgb()
+        in_shm = shared_memory.SharedMemory(create=True, size=array.nbytes)
+        out_shm = shared_memory.SharedMemory(create=True, size=out_size) if out_size else None
+        try:
+            staged = np.ndarray(array.shape, dtype=np.uint8, buffer=in_shm.buf)
+            staged[:] = array
+            del staged
+            stage_stats.record(f"model_workers.{self.family}.handoff", time.perf_counter() - start, image.megapixels)
+
+            job_id = next(self._ids)
+            future: Future = Future()
+            worker = self._assign(job_id, future)
+            worker.requests.put((
+                job_id, in_shm.name, array.shape,
+                out_shm.name if out_shm else None, out_size, options,
+                profiler.job_context(),
+            ))
+            counters.incr(f"model_workers.{self.family}.calls")
+            try:
+                value = future.result(timeout=CALL_TIMEOUT_SECONDS)
+            except FutureTimeout:
+                with self._lock:
+                    self._owner.pop(job_id, None)
+                    worker.in_flight.pop(job_id, None)
+                counters.incr(f"model_workers.{self.family}.timeouts")
+                raise
+
+            out = None
+            if out_shm is not None:
+                out = np.ndarray((out_size,), dtype=np.uint8, buffer=out_shm.buf).copy()
+            return value, out
+        finally:
+            for shm in (in_shm, out_shm):
+                if shm is not None:
+                    shm.close()
+                    shm.unlink()
+
+    def status(self) -> List[Dict]:
+        return [
+            {
+                "index": w.index,
+                "pid": w.process.pid if w.process else None,
+                "alive": bool(w.process and w.process.is_alive()),
+                "ready": w.ready,
+                "in_flight": len(w.in_flight),
+                "restarts": w.restarts,
+                "models": w.models,
+            }
+            for w in self._workers
+        ]
+
+
+_pools: Dict[str, WorkerPool] = {}
+
+
+def start_workers() -> None:
+    """Start one pool per model family (no-op unless MODEL_WORKERS=1)"""
+    if not MODEL_WORKERS or _pools:
+        return
+    for family in FAMILIES:
+        pool = WorkerPool(family, WORKER_PROCESSES[family])
+        pool.start()
+        _pools[family] = pool
+
+
+def stop_workers() -> None:
+    for pool in _pools.values():
+        pool.stop()
+    _pools.clear()
+
+
+def swap_model(name: str, version: str, filename: str) -> Dict:
+    """Hot-swap a model in the workers of its family"""
+    return _pools[MODEL_FAMILIES[name]].swap(name, version, filename)
+
+
+def worker_status() -> Dict:
+    return {
+        "enabled": MODEL_WORKERS,
+        "pools": {family: pool.status() for family, pool in _pools.items()},
+    }
+
+
+# ==================== DISPATCH ====================
+
+def recognize(image: ImageBuffer) -> Dict:
+    """Jewelry recognition, in the recognizer worker or in-process"""
+    pool = _pools.get("recognizer")
+    if pool is None:
+        from jewelry_recognition import get_recognizer
+        return get_recognizer().recognize(image)
+    return pool.call(image)[0]
+
+
+def recognize_tray(image: ImageBuffer, **options: Any) -> Dict:
+    """Tiled recognition of every piece in a tray photo, in the recognizer worker or in-process"""
+    pool = _pools.get("recognizer")
+    if pool is None:
+        from jewelry_recognition import get_recognizer
+        return get_recognizer().recognize_tray(image, **options)
+    return pool.call(image, tray=options)[0]
+
+
+def tag(image: Union[Image.Image, ImageBuffer]) -> Dict:
+    """Auto-tagging (tags, tag_scores, confidence), in the tagger worker or in-process"""
+    pool = _pools.get("tagger")
+    if pool is None:
+        from tagging import tag_image
+        return tag_image(image)
+    return pool.call(ImageBuffer.wrap(image))[0]
+
+
+def classify(image: Union[Image.Image, ImageBuffer]) -> np.ndarray:
+    """ImageNet class probabilities (1000,), in the tagger worker or in-process"""
+    pool = _pools.get("tagger")
+    if pool is None:
+        from tagging import class_probabilities
+        return class_probabilities([ImageBuffer.wrap(image)])[0].numpy()
+    return pool.call(ImageBuffer.wrap(image), probabilities=True)[0]
+
+
+def segment(image: Union[Image.Image, ImageBuffer], mode: Optional[str] = None) -> Image.Image:
+    """Background removal, in the segmenter worker or in-process"""
+    pool = _pools.get("segmenter")
+    if pool is None:
+        from segmentation import remove_image_background
+        return remove_image_background(image, mode)
+    buffer = ImageBuffer.wrap(image)
+    out_mode, out = pool.call(buffer, out_size=buffer.width * buffer.height * 4, mode=mode)
+    channels = len(out_mode)
+    pixels = out[:buffer.width * buffer.height * channels].reshape(buffer.height, buffer.width, channels)
+    return Image.fromarray(pixels, mode=out_mode)
@@ -0,0 +1,163 @@
+"""
+Pipeline DAG Module
+
+A small dependency-graph executor for the request pipelines. Each stage
+declares the stages it depends on; every stage whose dependencies have
+finished is submitted to a shared thread pool, so independent stages (e.g.
+background removal, tagging and recognition) run at the same time and the
+pipeline takes roughly as long as its slowest chain instead of the sum of
+all stages. Model calls inside stages go through model_workers, so with
+MODEL_WORKERS=1 they land on the worker processes.
+
+With a request deadline, a stage that no longer fits is skipped before it
+is submitted, and stages still running when the deadline passes are
+abandoned: the graph stops waiting for them and their dependents are
+skipped. An abandoned stage keeps its DAG thread until it finishes.
+"""
+
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from deadlines import Deadline, record_timeout, skip_reason, timed_call
+
+DAG_WORKERS = int(os.getenv("PIPELINE_DAG_WORKERS", "8"))
+_dag_executor = ThreadPoolExecutor(max_workers=DAG_WORKERS, thread_name_prefix="dag")
+
+# Which image each stage that has a choice works on: "original" or "segmented"
+STAGE_INPUTS = ("original", "segmented")
+TAGGING_INPUT = os.getenv("PIPELINE_TAGGING_INPUT", "original")
+
+# (completed, value, reason); reason is None for completed stages and stages
+# that were not needed, "insufficient_time" or "timed_out" for stages cut by
+# the deadline and "dependency_skipped" for stages whose required input was
+# skipped
+Outcome = Tuple[bool, Any, Optional[str]]
+
+
+def resolve_stage_input(value: Optional[str]) -> str:
+    """Validate a stage input choice ("original" or "segmented")"""
+    value = (value or "original").lower()
+    if value not in STAGE_INPUTS:
+        raise ValueError(f"stage input must be one of {', '.join(STAGE_INPUTS)}")
+    return value
+
+
+class Stage:
+    """One node of a pipeline graph"""
+
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[[Dict[str, Any]], Any],
+        deps: Iterable[str] = (),
+        requires: Iterable[str] = (),
+        when: Optional[Callable[[Dict[str, Any]], bool]] = None,
+        megapixels: Optional[Callable[[Dict[str, Any]], float]] = None,
+        record: bool = True,
+    ):
+        """
+        Args:
+            name: Stage name, as recorded in stage_stats
+            fn: Receives the outputs of the completed stages by name
+            deps: Stages that must finish (or be skipped) first
+            requires: Stages whose output the stage cannot run without; if
+                one of them did not complete, the stage does not run either
+            when: Optional condition on those outputs; the stage is not run
+                when it returns False
+            megapixels: Input size for per-megapixel deadline estimates
+            record: Record the duration in stage_stats (False when fn does)
+        """
+        self.name = name
+        self.fn = fn
+        self.requires = tuple(requires)
+        self.deps = tuple(deps) + self.requires
+        self.when = when
+        self.megapixels = megapixels
+        self.record = record
+
+
+def run_dag(
+    stages: List[Stage],
+    deadline: Optional[Deadline] = None,
+    on_stage: Optional[Callable[[str, Outcome], None]] = None,
+) -> Dict[str, Outcome]:
+    """
+    Run the stages of a graph, each as soon as its dependencies have finished
+
+    Dependencies on stages that are not part of the graph are ignored, so a
+    disabled stage can simply be left out. A stage exception propagates to
+    the caller.
+
+    Args:
+        stages: Graph nodes
+        deadline: Optional request deadline
+        on_stage: Called with (name, outcome) as each stage finishes, from
+            the calling thread (used to stream partial results)
+
+    Returns:
+        Outcome per stage name
+    """
+    names = {stage.name for stage in stages}
+    pending = {stage.name: stage for stage in stages}
+    outputs: Dict[str, Any] = {}
+    outcomes: Dict[str, Outcome] = {}
+    running = {}
+
+    def finish(name: str, outcome: Outcome) -> None:
+        outcomes[name] = outcome
+        if outcome[0]:
+            outputs[name] = outcome[1]
+        if on_stage is not None:
+            on_stage(name, outcome)
+
+    while pending or running:
+        # Stages that finish without running can unblock others; repeat the
+        # scheduling pass until nothing new becomes ready
+        progressed = True
+        while progressed:
+            progressed = False
+            for name, stage in list(pending.items()):
+                if any(dep in names and dep not in outcomes for dep in stage.deps):
+                    continue
+                del pending[name]
+                progressed = True
+                inputs = dict(outputs)
+                missing = [dep for dep in stage.requires if dep in names and dep not in outputs]
+                if missing:
+                    skipped = any(outcomes[dep][2] for dep in missing)
+                    finish(name, (False, None, "dependency_skipped" if skipped else None))
+                    continue
+                if stage.when is not None and not stage.when(inputs):
+                    finish(name, (False, None, None))
+                    continue
+                megapixels = stage.megapixels(inputs) if stage.megapixels else None
+                reason = skip_reason(stage.name, deadline, megapixels)
+                if reason is not None:
+                    finish(name, (False, None, reason))
+                    continue
+                future = _dag_executor.submit(timed_call(
+                    stage.name, lambda s=stage, i=inputs: s.fn(i), megapixels, stage.record,
+                ))
+                running[future] = stage
+
+        if not running:
+            if pending:
+                raise ValueError(f"Pipeline stages with unsatisfiable dependencies: {', '.join(pending)}")
+            break
+
+        timeout = None if deadline is None else max(0.0, deadline.remaining())
+        done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            # Deadline passed: abandon whatever is still running
+            for future, stage in list(running.items()):
+                future.cancel()
+                record_timeout(stage.name)
+                finish(stage.name, (False, None, "timed_out"))
+            running.clear()
+            continue
+        for future in done:
+            stage = running.pop(future)
+            finish(stage.name, (True, future.result(), None))
+
+    return outcomes
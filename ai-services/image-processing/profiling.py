@@ -0,0 +1,280 @@
+"""
+Profiling Module
+
+On-demand profiling of a live worker. An admin call starts a session that
+lasts for the next N requests or T seconds, whichever ends first. While it
+is active:
+
+- a sampler thread records the Python stack of every other thread and
+  writes them as collapsed stacks (<session>.collapsed), the input format of
+  flamegraph.pl and speedscope;
+- ResNet and YOLO calls wrapped in model_profiler() run under the torch
+  operator profiler and each writes a Chrome trace (<session>/<model>-<n>.json).
+
+With MODEL_WORKERS=1 the models run in worker processes, which never see the
+front end's session. Each worker job therefore carries job_context() (session
+id, directory and end time); the worker attaches to it for the job and writes
+its traces into the same directory (<session>/<model>-pid<pid>-<n>.json).
+
+When no session is active nothing runs: no sampler thread exists and
+model_profiler() is a single attribute check.
+"""
+
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from service_metrics import counters
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/jewelry-ai/profiles")
+
+# Interval between Python stack samples
+SAMPLE_INTERVAL_SECONDS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5")) / 1000.0
+
+# Upper bounds for one session, whatever the admin asks for
+MAX_SESSION_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "300"))
+MAX_SESSION_REQUESTS = int(os.getenv("PROFILE_MAX_REQUESTS", "1000"))
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class ProfileSession:
+    """One profiling window: stack samples plus per-call torch traces"""
+
+    def __init__(self, max_requests: Optional[int], max_seconds: float):
+        self.id = time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+        self.directory = os.path.join(PROFILE_DIR, self.id)
+        self.max_requests = max_requests
+        self.started = time.time()
+        self.ends_at = self.started + max_seconds
+        self.requests = 0
+        self.samples = 0
+        self._stacks: Counter = Counter()
+        self._trace_counts: Counter = Counter()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sampler = threading.Thread(target=self._sample_loop, name="profile-sampler", daemon=True)
+        os.makedirs(self.directory, exist_ok=True)
+
+    @property
+    def collapsed_path(self) -> str:
+        return self.directory + ".collapsed"
+
+    def start(self) -> None:
+        self._sampler.start()
+
+    def finished(self) -> bool:
+        if self.max_requests is not None and self.requests >= self.max_requests:
+            return True
+        return time.time() >= self.ends_at
+
+    def _sample_loop(self) -> None:
+        own = threading.get_ident()
+        names = {}
+        while not self._stopped.wait(SAMPLE_INTERVAL_SECONDS):
+            if self.finished():
+                profiler.stop(self)
+                return
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                if thread_id not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, f"thread-{thread_id}"))
+                self._stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def next_trace_path(self, model: str) -> str:
+        with self._lock:
+            self._trace_counts[model] += 1
+            return os.path.join(self.directory, f"{model}-{self._trace_counts[model]}.json")
+
+    def trace_paths(self) -> List[str]:
+        """Chrome traces written so far, by this process and by model workers"""
+        try:
+            names = sorted(n for n in os.listdir(self.directory) if n.endswith(".json"))
+        except FileNotFoundError:
+            return []
+        return [os.path.join(self.directory, name) for name in names]
+
+    def close(self) -> None:
+        """Stop sampling and write the collapsed stacks file"""
+        self._stopped.set()
+        if self._sampler.is_alive() and self._sampler is not threading.current_thread():
+            self._sampler.join()
+        with open(self.collapsed_path, "w", encoding="utf-8") as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def summary(self) -> Dict:
+        return {
+            "id": self.id,
+            "directory": self.directory,
+            "collapsed_stacks": self.collapsed_path,
+            "chrome_traces": self.trace_paths(),
+            "requests": self.requests,
+            "max_requests": self.max_requests,
+            "samples": self.samples,
+            "started_at": self.started,
+            "ends_at": self.ends_at,
+        }
+
+
+class WorkerTraceSession:
+    """A front-end session seen from a model worker: Chrome traces only"""
+
+    def __init__(self, session_id: str, directory: str, ends_at: float):
+        self.id = session_id
+        self.directory = directory
+        self.ends_at = ends_at
+        self._trace_counts: Counter = Counter()
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def next_trace_path(self, model: str) -> str:
+        with self._lock:
+            self._trace_counts[model] += 1
+            return os.path.join(self.directory, f"{model}-pid{os.getpid()}-{self._trace_counts[model]}.json")
+
+
+class Profiler:
+    """Holds at most one active ProfileSession"""
+
+    def __init__(self):
+        self.session: Optional[ProfileSession] = None
+        # In a model worker: the front-end session of the job being run
+        self.attached: Optional[WorkerTraceSession] = None
+        self._worker_session: Optional[WorkerTraceSession] = None
+        self.last: Optional[Dict] = None
+        self._lock = threading.Lock()
+        # The torch profiler is process-wide; profiled model calls take turns
+        self._torch_lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return self.session is not None
+
+    def start(self, max_requests: Optional[int] = None, max_seconds: Optional[float] = None) -> Dict:
+        """
+        Start a session for the next max_requests requests or max_seconds seconds
+
+        Raises:
+            RuntimeError: If a session is already running
+        """
+        seconds = min(max_seconds or MAX_SESSION_SECONDS, MAX_SESSION_SECONDS)
+        if max_requests is not None:
+            max_requests = min(max_requests, MAX_SESSION_REQUESTS)
+        with self._lock:
+            if self.session is not None:
+                raise RuntimeError(f"Profiling session {self.session.id} is already running")
+            session = ProfileSession(max_requests, seconds)
+            session.start()
+            self.session = session
+        counters.incr("profiling.sessions")
+        logger.info(f"Profiling session {session.id} started ({max_requests} requests / {seconds:.0f}s)")
+        return session.summary()
+
+    def stop(self, session: Optional[ProfileSession] = None) -> Optional[Dict]:
+        """Stop the given (or current) session and write its files"""
+        with self._lock:
+            if self.session is None or (session is not None and session is not self.session):
+                return None
+            session, self.session = self.session, None
+        session.close()
+        self.last = session.summary()
+        logger.info(f"Profiling session {session.id} written to {session.directory}")
+        return self.last
+
+    def request_finished(self) -> None:
+        """
+        Count a completed request against the active session
+
+        Stopping the session writes its files, so callers on the event loop
+        run this in the threadpool.
+        """
+        with self._lock:
+            session = self.session
+            if session is None:
+                return
+            session.requests += 1
+        if session.finished():
+            self.stop(session)
+
+    def job_context(self) -> Optional[Tuple[str, str, float]]:
+        """The active session as sent to model workers with each job: (id, directory, ends_at)"""
+        session = self.session
+        if session is None:
+            return None
+        return session.id, session.directory, session.ends_at
+
+    @contextmanager
+    def attach(self, context: Optional[Tuple[str, str, float]]) -> Iterator[None]:
+        """
+        In a model worker, run one job under the front end's session
+
+        Args:
+            context: job_context() of the front end when it sent the job
+        """
+        if context is None or time.time() >= context[2]:
+            yield
+            return
+        session_id, directory, ends_at = context
+        if self._worker_session is None or self._worker_session.id != session_id:
+            self._worker_session = WorkerTraceSession(session_id, directory, ends_at)
+        self.attached = self._worker_session
+        try:
+            yield
+        finally:
+            self.attached = None
+
+    def status(self) -> Dict:
+        session = self.session
+        return {
+            "active": session is not None,
+            "session": session.summary() if session is not None else None,
+            "last_session": self.last,
+        }
+
+
+profiler = Profiler()
+
+
+@contextmanager
+def model_profiler(model: str) -> Iterator[None]:
+    """
+    Run a model call under the torch operator profiler while a session is active
+
+    Args:
+        model: Model name used in the trace file name (e.g. "resnet50")
+    """
+    session = profiler.session or profiler.attached
+    if session is None:
+        yield
+        return
+
+    import torch
+    from torch.profiler import ProfilerActivity, profile
+
+    activities = [ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(ProfilerActivity.CUDA)
+
+    with profiler._torch_lock:
+        with profile(activities=activities, record_shapes=True) as prof:
+            yield
+        prof.export_chrome_trace(session.next_trace_path(model))
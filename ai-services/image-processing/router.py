@@ -0,0 +1,389 @@
+"""
+Cache-Affinity Router
+
+A small ASGI reverse proxy in front of several instances of the service.
+Each request is routed by a key:
+- the X-Routing-Key header, if the client sends one
+- else the SHA-256 of the uploaded file(s)
+- else the path
+
+The key goes on a consistent-hash ring of backends, so re-uploads of an
+image reach the node that already has its single-flight entry, artifacts
+and warm state.
+
+- Ring: ROUTER_VNODES virtual nodes per backend. Adding or removing a
+  backend moves only the keys on its arcs, about 1/N of them.
+- Health: GET / on every backend every ROUTER_HEALTH_INTERVAL seconds. A
+  backend is skipped (not removed) after ROUTER_HEALTH_FAILURES failed checks
+  or connection errors, so its keys come back to it once it recovers.
+- Failover: a request moves on to the next backend on the ring only when
+  the connection could not be made. A read timeout or dropped connection
+  answers 504/502 instead, since the backend may already have processed it.
+- Spillover (consistent hashing with bounded loads): a backend whose
+  in-flight count is at or above ROUTER_LOAD_FACTOR x the average passes the
+  request on to the next backend on the ring. Hot keys spread over a few
+  neighbours instead of overloading one node.
+
+Try it with local instances:
+
+    MODEL_WORKERS=0 uvicorn main:app --port 8001 &
+    MODEL_WORKERS=0 uvicorn main:app --port 8002 &
+    ROUTER_BACKENDS=http://127.0.0.1:8001,http://127.0.0.1:8002 uvicorn router:app --port 8000
+
+Responses carry X-Routed-To (backend URL) and X-Routing (primary, spillover
+or failover).
+"""
+
+import asyncio
+import bisect
+import hashlib
+import hmac
+import logging
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from service_metrics import counters
+
+logger = logging.getLogger(__name__)
+
+ROUTER_BACKENDS = [url.strip().rstrip("/") for url in os.getenv("ROUTER_BACKENDS", "").split(",") if url.strip()]
+ROUTER_VNODES = int(os.getenv("ROUTER_VNODES", "128"))
+ROUTER_HEALTH_INTERVAL = float(os.getenv("ROUTER_HEALTH_INTERVAL", "5"))
+ROUTER_HEALTH_FAILURES = int(os.getenv("ROUTER_HEALTH_FAILURES", "2"))
+ROUTER_LOAD_FACTOR = float(os.getenv("ROUTER_LOAD_FACTOR", "1.25"))
+ROUTER_TIMEOUT = float(os.getenv("ROUTER_TIMEOUT", "300"))
+
+ROUTING_KEY_HEADER = "x-routing-key"
+
+# Token for the /router/backends endpoints (same variable as the service)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Not forwarded in either direction
+HOP_BY_HOP = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade", "host", "content-length",
+}
+
+_BOUNDARY = re.compile(r'boundary="?([^";]+)"?')
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+def routing_key(headers, path: str, body: bytes) -> str:
+    """
+    Key a request is routed by: the client's X-Routing-Key, else a hash of
+    the uploaded content, else the path
+    """
+    key = headers.get(ROUTING_KEY_HEADER)
+    if key:
+        return key
+    content_type = headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        files = multipart_files(body, content_type)
+        if files:
+            digest = hashlib.sha256()
+            for payload in files:
+                digest.update(payload)
+            return digest.hexdigest()
+    elif body:
+        # Raw image body (internal binary API)
+        return hashlib.sha256(body).hexdigest()
+    return path
+
+
+def multipart_files(body: bytes, content_type: str) -> List[bytes]:
+    """
+    Payloads of the file parts of a multipart body
+
+    The boundary differs between otherwise identical uploads, so the key
+    is built from the file contents only.
+    """
+    match = _BOUNDARY.search(content_type)
+    if match is None:
+        return []
+    delimiter = b"--" + match.group(1).encode()
+    files = []
+    for part in body.split(delimiter)[1:]:
+        head, sep, payload = part.partition(b"\r\n\r\n")
+        if not sep or b"filename=" not in head:
+            continue
+        # Drop the CRLF that precedes the next delimiter
+        files.append(payload[:-2] if payload.endswith(b"\r\n") else payload)
+    return files
+
+
+class Backend:
+    """One service instance and its routing state"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.healthy = True
+        self.failures = 0
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+
+    def status(self) -> Dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "consecutive_failures": self.failures,
+        }
+
+
+class HashRing:
+    """Consistent-hash ring with virtual nodes and bounded-load lookups"""
+
+    def __init__(self, urls: List[str], vnodes: int = ROUTER_VNODES, load_factor: float = ROUTER_LOAD_FACTOR):
+        self.vnodes = vnodes
+        self.load_factor = load_factor
+        self.backends: Dict[str, Backend] = {}
+        self._points: List[int] = []
+        self._owners: List[str] = []
+        self._lock = threading.Lock()
+        for url in urls:
+            self.add(url)
+
+    def _rebuild(self) -> None:
+        ring = sorted(
+            (_hash(f"{url}#{i}"), url)
+            for url in self.backends
+            for i in range(self.vnodes)
+        )
+        self._points = [point for point, _ in ring]
+        self._owners = [url for _, url in ring]
+
+    def add(self, url: str) -> bool:
+        with self._lock:
+            if url in self.backends:
+                return False
+            self.backends[url] = Backend(url)
+            self._rebuild()
+            return True
+
+    def remove(self, url: str) -> bool:
+        with self._lock:
+            if self.backends.pop(url, None) is None:
+                return False
+            self._rebuild()
+            return True
+
+    def candidates(self, key: str) -> List[Backend]:
+        """Distinct healthy backends in ring order from the key's position"""
+        with self._lock:
+            if not self._points:
+                return []
+            start = bisect.bisect(self._points, _hash(key)) % len(self._points)
+            seen, order = set(), []
+            for i in range(len(self._points)):
+                url = self._owners[(start + i) % len(self._points)]
+                if url not in seen:
+                    seen.add(url)
+                    order.append(self.backends[url])
+                    if len(seen) == len(self.backends):
+                        break
+        return [backend for backend in order if backend.healthy]
+
+    def pick(self, key: str) -> Tuple[Optional[Backend], str, List[Backend]]:
+        """
+        Backend for a key: the first candidate whose in-flight count is
+        under the bounded-load cap
+
+        Returns:
+            (backend or None, "primary" or "spillover", remaining candidates
+            to fail over to)
+        """
+        candidates = self.candidates(key)
+        if not candidates:
+            return None, "unavailable", []
+        total = sum(backend.in_flight for backend in candidates)
+        cap = max(1.0, self.load_factor * (total + 1) / len(candidates))
+        for index, backend in enumerate(candidates):
+            if backend.in_flight < cap:
+                return backend, "primary" if index == 0 else "spillover", candidates[index + 1:] + candidates[:index]
+        return candidates[0], "primary", candidates[1:]
+
+    def status(self) -> List[Dict]:
+        with self._lock:
+            return [backend.status() for backend in self.backends.values()]
+
+
+ring = HashRing(ROUTER_BACKENDS)
+
+app = FastAPI(
+    title="Jewelry AI Router",
+    description="Cache-affinity router in front of several Jewelry AI Services instances",
+    version="1.0.0",
+)
+
+_client: Optional[httpx.AsyncClient] = None
+_health_task: Optional[asyncio.Task] = None
+
+
+def mark_failure(backend: Backend) -> None:
+    backend.failures += 1
+    if backend.healthy and backend.failures >= ROUTER_HEALTH_FAILURES:
+        backend.healthy = False
+        counters.incr("router.backend_down")
+        logger.warning(f"Backend {backend.url} marked unhealthy")
+
+
+def mark_success(backend: Backend) -> None:
+    backend.failures = 0
+    if not backend.healthy:
+        backend.healthy = True
+        counters.incr("router.backend_up")
+        logger.info(f"Backend {backend.url} healthy again")
+
+
+async def check_health() -> None:
+    """Probe GET / on every backend, including the ones marked unhealthy"""
+    async def probe(backend: Backend):
+        try:
+            response = await _client.get(backend.url + "/", timeout=min(ROUTER_HEALTH_INTERVAL, 5.0))
+            ok = response.status_code == 200
+        except httpx.HTTPError:
+            ok = False
+        if ok:
+            mark_success(backend)
+        else:
+            mark_failure(backend)
+
+    await asyncio.gather(*(probe(backend) for backend in list(ring.backends.values())))
+
+
+async def health_loop() -> None:
+    while True:
+        await check_health()
+        await asyncio.sleep(ROUTER_HEALTH_INTERVAL)
+
+
+@app.on_event("startup")
+async def start_router():
+    global _client, _health_task
+    _client = httpx.AsyncClient(timeout=ROUTER_TIMEOUT, limits=httpx.Limits(max_connections=None))
+    _health_task = asyncio.ensure_future(health_loop())
+
+
+@app.on_event("shutdown")
+async def stop_router():
+    if _health_task is not None:
+        _health_task.cancel()
+    if _client is not None:
+        await _client.aclose()
+
+
+# ==================== ADMIN ====================
+
+def require_admin(request: Request) -> None:
+    """Check the X-Admin-Token header against ADMIN_TOKEN"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    token = request.headers.get("x-admin-token", "")
+    if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+@app.get("/router/status")
+async def router_status():
+    """Backends, their health and load, and routing counters"""
+    return {
+        "backends": ring.status(),
+        "vnodes": ring.vnodes,
+        "load_factor": ring.load_factor,
+        "counters": {name: value for name, value in counters.snapshot().items() if name.startswith("router.")},
+    }
+
+
+@app.post("/router/backends")
+async def add_backend(request: Request, url: str):
+    """Add a backend to the ring (about 1/N of the keys move to it)"""
+    require_admin(request)
+    return {"added": ring.add(url.rstrip("/")), "backends": ring.status()}
+
+
+@app.delete("/router/backends")
+async def remove_backend(request: Request, url: str):
+    """Remove a backend; only its keys move, to their next backend on the ring"""
+    require_admin(request)
+    return {"removed": ring.remove(url.rstrip("/")), "backends": ring.status()}
+
+
+# ==================== PROXY ====================
+
+@app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
+async def proxy(request: Request, path: str):
+    """Forward a request to the backend its routing key maps to"""
+    body = await request.body()
+    key = routing_key(request.headers, request.url.path, body)
+    backend, routing, fallbacks = ring.pick(key)
+    if backend is None:
+        counters.incr("router.unavailable")
+        return JSONResponse(status_code=503, content={"detail": "No healthy backend"})
+
+    headers = [(name, value) for name, value in request.headers.items() if name.lower() not in HOP_BY_HOP]
+    url = "/" + path + (f"?{request.url.query}" if request.url.query else "")
+
+    # Fail over along the ring only when the connection could not be made; any
+    # later error means the backend may already have acted on the request
+    for attempt in [backend] + fallbacks:
+        attempt.in_flight += 1
+        attempt.requests += 1
+        try:
+            upstream = await _client.send(
+                _client.build_request(request.method, attempt.url + url, headers=headers, content=body),
+                stream=True,
+            )
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            attempt.in_flight -= 1
+            attempt.errors += 1
+            mark_failure(attempt)
+            logger.warning(f"Backend {attempt.url} unreachable: {e}")
+            routing = "failover"
+            continue
+        except httpx.TransportError as e:
+            attempt.in_flight -= 1
+            attempt.errors += 1
+            logger.warning(f"Backend {attempt.url} failed: {e}")
+            counters.incr("router.backend_error")
+            timed_out = isinstance(e, httpx.TimeoutException)
+            return JSONResponse(
+                status_code=504 if timed_out else 502,
+                content={"detail": f"Backend {'timed out' if timed_out else 'failed'}"},
+                headers={"X-Routed-To": attempt.url, "X-Routing": routing},
+            )
+        mark_success(attempt)
+        counters.incr(f"router.{routing}")
+        return StreamingResponse(
+            _relay(upstream, attempt),
+            status_code=upstream.status_code,
+            headers={
+                **{name: value for name, value in upstream.headers.items() if name.lower() not in HOP_BY_HOP},
+                "X-Routed-To": attempt.url,
+                "X-Routing": routing,
+            },
+        )
+
+    counters.incr("router.unavailable")
+    return JSONResponse(status_code=502, content={"detail": "All backends failed"})
+
+
+async def _relay(upstream: httpx.Response, backend: Backend):
+    """Stream the backend response through; the request counts as in flight until done"""
+    try:
+        async for chunk in upstream.aiter_raw():
+            yield chunk
+    finally:
+        backend.in_flight -= 1
+        await upstream.aclose()
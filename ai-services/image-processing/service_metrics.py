@@ -0,0 +1,126 @@
+"""
+Service Metrics Module
+
+Lightweight in-process counters and per-stage latency statistics shared by
+the endpoints (used to estimate how much compute each optimization saves)
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+
+class StageStats:
+    """
+    Running latency statistics per pipeline stage
+
+    Keeps a count, total and an exponentially weighted moving average so
+    callers can estimate what a stage would have cost without running it.
+    """
+
+    def __init__(self, alpha: float = 0.2):
+        """Initialize empty statistics with EWMA smoothing factor alpha"""
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def record(self, stage: str, seconds: float, megapixels: Optional[float] = None) -> None:
+        """
+        Record one execution of a stage
+
+        Args:
+            stage: Stage name (e.g. "background_removal")
+            seconds: Wall-clock duration of the stage
+            megapixels: Optional input size, used for per-megapixel estimates
+        """
+        with self._lock:
+            entry = self._stats.setdefault(stage, {
+                "count": 0,
+                "total_seconds": 0.0,
+                "ewma_seconds": seconds,
+                "ewma_seconds_per_mp": 0.0,
+            })
+            entry["count"] += 1
+            entry["total_seconds"] += seconds
+            entry["ewma_seconds"] += self.alpha * (seconds - entry["ewma_seconds"])
+            if megapixels:
+                per_mp = seconds / megapixels
+                if entry["ewma_seconds_per_mp"] == 0.0:
+                    entry["ewma_seconds_per_mp"] = per_mp
+                else:
+                    entry["ewma_seconds_per_mp"] += self.alpha * (per_mp - entry["ewma_seconds_per_mp"])
+
+    def estimate(self, stage: str, megapixels: Optional[float] = None, default: float = 0.0) -> float:
+        """
+        Estimate the duration of a stage from past executions
+
+        Args:
+            stage: Stage name
+            megapixels: Optional input size; uses the per-megapixel rate when known
+            default: Value returned when the stage has never been recorded
+
+        Returns:
+            Estimated duration in seconds
+        """
+        with self._lock:
+            entry = self._stats.get(stage)
+            if entry is None:
+                return default
+            if megapixels and entry["ewma_seconds_per_mp"]:
+                return entry["ewma_seconds_per_mp"] * megapixels
+            return entry["ewma_seconds"]
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Return a JSON-serializable copy of all stage statistics"""
+        with self._lock:
+            return {
+                stage: {
+                    "count": int(entry["count"]),
+                    "total_seconds": round(entry["total_seconds"], 4),
+                    "ewma_seconds": round(entry["ewma_seconds"], 4),
+                    "ewma_seconds_per_mp": round(entry["ewma_seconds_per_mp"], 4),
+                }
+                for stage, entry in self._stats.items()
+            }
+
+
+class Counters:
+    """Thread-safe named counters (ints or accumulated floats)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: Dict[str, float] = {}
+
+    def incr(self, name: str, amount: float = 1) -> None:
+        """Add amount to the named counter"""
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + amount
+
+    def get(self, name: str) -> float:
+        """Current value of the named counter"""
+        with self._lock:
+            return self._values.get(name, 0)
+
+    def snapshot(self) -> Dict[str, float]:
+        """Return a copy of all counters"""
+        with self._lock:
+            return {
+                name: round(value, 4) if isinstance(value, float) else value
+                for name, value in self._values.items()
+            }
+
+
+# Global instances
+stage_stats = StageStats()
+counters = Counters()
+
+
+@contextmanager
+def timed_stage(stage: str, megapixels: Optional[float] = None) -> Iterator[None]:
+    """Context manager that records the duration of a stage in stage_stats"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_stats.record(stage, time.perf_counter() - start, megapixels)
@@ -0,0 +1,138 @@
+"""
+Single-Flight Module
+
+Coalesces identical in-flight requests: the first caller for a key starts the
+computation, later callers with the same key await that computation instead
+of starting their own.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from service_metrics import counters
+
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "1") == "1"
+
+# How often waiters check whether their client has disconnected
+DISCONNECT_POLL_SECONDS = float(os.getenv("SINGLE_FLIGHT_DISCONNECT_POLL", "0.25"))
+
+
+class ClientDisconnected(Exception):
+    """Raised to a waiter whose client went away before the result was ready"""
+
+
+def request_key(contents: bytes, **options: Any) -> str:
+    """
+    Build a coalescing key from the upload content and the request options
+
+    Args:
+        contents: Raw uploaded bytes
+        **options: Every option that changes the result
+
+    Returns:
+        Hex digest identifying the request
+    """
+    digest = hashlib.sha256(contents)
+    digest.update(json.dumps(options, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+class _Call:
+    """One in-flight computation and the number of callers waiting on it"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+        self.joined = 0
+        self.started = time.perf_counter()
+
+
+class SingleFlight:
+    """
+    Per-key deduplication of concurrent async computations
+
+    The computation runs in its own task, shielded from the callers. It is
+    cancelled only when every caller waiting on it has gone away, so the
+    leading client disconnecting does not fail the requests that joined it.
+    """
+
+    def __init__(self, name: str):
+        """
+        Args:
+            name: Prefix for the counters reported on /metrics
+        """
+        self.name = name
+        self._calls: Dict[str, _Call] = {}
+
+    def _forget(self, key: str, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def _on_done(self, key: str, call: _Call) -> None:
+        self._forget(key, call)
+        if call.task.cancelled() or call.task.exception() is not None:
+            return
+        if call.joined:
+            elapsed = time.perf_counter() - call.started
+            counters.incr(f"singleflight.{self.name}.seconds_saved", elapsed * call.joined)
+
+    async def do(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    ) -> Any:
+        """
+        Run compute() for key, or join the computation already in flight
+
+        Args:
+            key: Coalescing key (see request_key)
+            compute: Coroutine factory producing the result
+            is_disconnected: Optional probe (e.g. request.is_disconnected);
+                when it reports True the caller stops waiting
+
+        Returns:
+            The (shared) result of compute()
+
+        Raises:
+            ClientDisconnected: If this caller's client disconnected first
+        """
+        if not SINGLE_FLIGHT_ENABLED:
+            return await compute()
+
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(compute()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _task, key=key, call=call: self._on_done(key, call))
+            counters.incr(f"singleflight.{self.name}.leaders")
+        else:
+            call.joined += 1
+            counters.incr(f"singleflight.{self.name}.coalesced")
+
+        call.waiters += 1
+        try:
+            if is_disconnected is None:
+                return await asyncio.shield(call.task)
+            return await self._wait_or_disconnect(call.task, is_disconnected)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Nobody is left to receive the result
+                call.task.cancel()
+                self._forget(key, call)
+                counters.incr(f"singleflight.{self.name}.cancelled")
+
+    @staticmethod
+    async def _wait_or_disconnect(task: asyncio.Task, is_disconnected: Callable[[], Awaitable[bool]]) -> Any:
+        """Await task without cancelling it, giving up if the client disconnects"""
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await is_disconnected():
+                raise ClientDisconnected()
@@ -0,0 +1,436 @@
+"""
+Tagging Module
+
+ResNet-50 based auto-tagging: builds the classifier input for a whole batch
+directly from the uint8 image buffers and projects the 1000-class ImageNet probabilities onto
+the JEWELRY_TAGS vocabulary through a sparse class-to-tag matrix built once
+(one matrix multiply per batch), followed by per-tag Platt calibration.
+Metal tags, which ImageNet has no classes for, still come from image color.
+"""
+
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+from image_buffer import ImageBuffer
+from model_registry import registry
+from model_store import load_resnet50, model_version
+from profiling import model_profiler
+
+logger = logging.getLogger(__name__)
+
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+# Image preprocessing for classification: the input torchvision's
+# Resize(256), CenterCrop(224), ToTensor() and Normalize(ImageNet) would give,
+# built in one resize of the crop region and one multiply-add per batch (see
+# classification_batch)
+PREPROCESS_RESIZE = 256
+PREPROCESS_CROP = 224
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+# Bump when the preprocessing changes the classifier input (part of the
+# version stored class probabilities are tagged with)
+PREPROCESS_REVISION = 2
+
+# ToTensor's / 255 and Normalize folded into x * scale + shift on the uint8
+# pixels. Not folded into conv1: it zero-pads the normalized input, so
+# shifting its bias would change the border outputs.
+_NORMALIZE_SCALE = (1.0 / (255.0 * torch.tensor(IMAGENET_STD))).view(1, 3, 1, 1)
+_NORMALIZE_SHIFT = (-torch.tensor(IMAGENET_MEAN) / torch.tensor(IMAGENET_STD)).view(1, 3, 1, 1)
+
+# Jewelry-specific tags mapping (simplified)
+JEWELRY_TAGS = {
+    "necklace": ["necklace", "chain", "pendant"],
+    "ring": ["ring", "band", "engagement ring"],
+    "earring": ["earring", "ear stud", "drop earring"],
+    "bracelet": ["bracelet", "bangle", "cuff"],
+    "gold": ["gold", "yellow gold", "rose gold"],
+    "silver": ["silver", "white gold", "platinum"],
+    "diamond": ["diamond", "gemstone", "precious stone"],
+}
+
+# Class-to-tag weights and per-tag calibration (see tag_projection.json)
+TAG_PROJECTION_CONFIG = os.getenv(
+    "TAG_PROJECTION_CONFIG",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "tag_projection.json"),
+)
+
+# Calibrated score a tag needs to be emitted
+TAG_SCORE_THRESHOLD = float(os.getenv("TAG_SCORE_THRESHOLD", "0.2"))
+
+SHAPE_TAGS = ("necklace", "ring", "earring", "bracelet")
+GENERIC_TAGS = ["handcrafted", "elegant", "premium"]
+
+_projector = None
+_projector_lock = threading.Lock()
+
+
+def load_classifier(path: Optional[str] = None) -> torch.nn.Module:
+    """Load a ResNet-50 classifier (eval mode, on device)"""
+    model = load_resnet50(path)
+    model.eval()
+    model.to(device)
+    return model
+
+
+def _warm_classifier(model: torch.nn.Module, images: List[ImageBuffer]) -> None:
+    """Run a newly loaded classifier on sample images before it takes traffic"""
+    with torch.no_grad():
+        model(classification_batch(images).to(device))
+
+
+registry.register("resnet50", load_classifier, _warm_classifier)
+
+
+def get_classifier() -> torch.nn.Module:
+    """The ResNet-50 classifier in service (loaded on first use, hot-swappable)"""
+    return registry.active("resnet50").model
+
+
+def imagenet_categories() -> List[str]:
+    """The 1000 ImageNet class names, in the classifier's output order"""
+    from torchvision.models import ResNet50_Weights
+    return list(ResNet50_Weights.IMAGENET1K_V1.meta["categories"])
+
+
+class TagProjector:
+    """
+    Maps class probabilities to calibrated JEWELRY_TAGS scores
+    
+    A class contributes to a tag when its ImageNet name equals one of the
+    tag's synonyms, or when tag_projection.json lists it under the tag's
+    "classes" with a weight. The (tags x classes) matrix is sparse, so a
+    batch is projected with a single sparse matmul.
+    
+    Tags no class maps to (gold, silver and diamond have no ImageNet
+    classes), or whose best possible calibrated score stays below the
+    threshold, are left out of the projection: their scores would be noise.
+    """
+    
+    def __init__(self, categories: List[str], config: Optional[Dict] = None, threshold: float = TAG_SCORE_THRESHOLD):
+        """
+        Args:
+            categories: Class names in model output order
+            config: {"classes": {tag: {class name: weight}},
+                     "calibration": {tag: {"a": slope, "b": intercept}}}
+            threshold: Calibrated score a tag needs to be emitted
+        """
+        config = config or {}
+        class_weights = config.get("classes", {})
+        calibration = config.get("calibration", {})
+        index = {name.lower(): i for i, name in enumerate(categories)}
+        
+        self.tags = []
+        rows, cols, values = [], [], []
+        for tag in JEWELRY_TAGS:
+            weights = {synonym: 1.0 for synonym in JEWELRY_TAGS[tag] if synonym in index}
+            weights.update({name.lower(): weight for name, weight in class_weights.get(tag, {}).items()})
+            for name in [name for name in weights if name not in index]:
+                logger.warning(f"Tag projection: unknown class '{name}' for tag '{tag}'")
+                del weights[name]
+            if not weights:
+                logger.info(f"Tag projection: no class maps to '{tag}'; not scored by the model")
+                continue
+            # All probability on the heaviest class is the best case
+            params = calibration.get(tag, {})
+            best = torch.sigmoid(
+                params.get("a", 1.0) * torch.logit(torch.tensor(min(max(weights.values()), 1.0)), eps=1e-6)
+                + params.get("b", 0.0)
+            )
+            if best < threshold:
+                logger.warning(f"Tag projection: '{tag}' can score at most {float(best):.3f} (threshold {threshold}); not scored by the model")
+                continue
+            row = len(self.tags)
+            self.tags.append(tag)
+            for name, weight in weights.items():
+                rows.append(row)
+                cols.append(index[name])
+                values.append(weight)
+        
+        self.matrix = torch.sparse_coo_tensor(
+            torch.tensor([rows, cols], dtype=torch.long).reshape(2, -1),
+            torch.tensor(values, dtype=torch.float32),
+            (len(self.tags), len(categories)),
+            check_invariants=True,
+        ).coalesce()
+        self.slope = torch.tensor([calibration.get(tag, {}).get("a", 1.0) for tag in self.tags])
+        self.intercept = torch.tensor([calibration.get(tag, {}).get("b", 0.0) for tag in self.tags])
+    
+    def project(self, probabilities: torch.Tensor) -> torch.Tensor:
+        """(N, classes) probabilities -> (N, tags) raw tag probabilities"""
+        raw = torch.sparse.mm(self.matrix, probabilities.t().float()).t()
+        return raw.clamp_(0.0, 1.0)
+    
+    def calibrate(self, raw: torch.Tensor) -> torch.Tensor:
+        """Platt scaling on the logit of the raw tag probability"""
+        logit = torch.logit(raw, eps=1e-6)
+        return torch.sigmoid(self.slope * logit + self.intercept)
+    
+    def scores(self, probabilities: torch.Tensor) -> torch.Tensor:
+        return self.calibrate(self.project(probabilities))
+
+
+def load_projection_config(path: str = TAG_PROJECTION_CONFIG) -> Dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def get_projector() -> TagProjector:
+    """Get or build the shared tag projector"""
+    global _projector
+    if _projector is None:
+        with _projector_lock:
+            if _projector is None:
+                _projector = TagProjector(imagenet_categories(), load_projection_config())
+    return _projector
+
+
+def crop_region(width: int, height: int) -> Tuple[float, float, float, float]:
+    """
+    Source-pixel region (x, y, x scale, y scale) that Resize(256) followed by
+    CenterCrop(224) keeps: the crop starts at (x, y) and each output pixel
+    spans (x scale, y scale) source pixels
+    """
+    # Same output size as transforms.Resize(256): short side to 256
+    if width <= height:
+        resized = (PREPROCESS_RESIZE, int(PREPROCESS_RESIZE * height / width))
+    else:
+        resized = (int(PREPROCESS_RESIZE * width / height), PREPROCESS_RESIZE)
+    scale_x, scale_y = width / resized[0], height / resized[1]
+    # Same offsets as transforms.CenterCrop(224)
+    left = int(round((resized[0] - PREPROCESS_CROP) / 2.0))
+    top = int(round((resized[1] - PREPROCESS_CROP) / 2.0))
+    return left * scale_x, top * scale_y, scale_x, scale_y
+
+
+def resize_crop(rgb: np.ndarray, out: np.ndarray) -> None:
+    """
+    Resize and center crop a uint8 RGB image into out (224, 224, 3), reading
+    only the crop region and never making a resized copy of the whole image
+    
+    Downscaling by s runs as an INTER_AREA reduction by the integer factor
+    floor(s) of the crop region (aligned to whole pixels, OpenCV's fast path)
+    followed by one bilinear warp that places output pixel centers at their
+    exact sub-pixel source positions; upscaling is that warp alone.
+    """
+    height, width = rgb.shape[:2]
+    x, y, scale_x, scale_y = crop_region(width, height)
+    factor = max(1, int(min(scale_x, scale_y)))
+    source, origin_x, origin_y = rgb, 0, 0
+    if factor > 1:
+        origin_x, origin_y = int(x) // factor * factor, int(y) // factor * factor
+        span_x = int(np.ceil(x + PREPROCESS_CROP * scale_x)) - origin_x
+        span_y = int(np.ceil(y + PREPROCESS_CROP * scale_y)) - origin_y
+        roi = rgb[origin_y:origin_y + -(-span_y // factor) * factor, origin_x:origin_x + -(-span_x // factor) * factor]
+        source = cv2.resize(
+            roi, (roi.shape[1] // factor, roi.shape[0] // factor), interpolation=cv2.INTER_AREA,
+        )
+    # Output pixel center u + 0.5 lies at x + (u + 0.5) * scale in the image
+    matrix = np.array([
+        [scale_x / factor, 0, (x - origin_x + 0.5 * scale_x) / factor - 0.5],
+        [0, scale_y / factor, (y - origin_y + 0.5 * scale_y) / factor - 0.5],
+    ])
+    cv2.warpAffine(
+        source, matrix, (PREPROCESS_CROP, PREPROCESS_CROP), dst=out,
+        flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP, borderMode=cv2.BORDER_REPLICATE,
+    )
+
+
+def normalize_batch(pixels: torch.Tensor) -> torch.Tensor:
+    """
+    (N, 3, H, W) uint8 pixels to the normalized float classifier input in a
+    single fused op (the result is channels-last in memory when the input is)
+    """
+    return torch.addcmul(_NORMALIZE_SHIFT, pixels, _NORMALIZE_SCALE)
+
+
+def classification_batch(images: Union[List[Union[Image.Image, ImageBuffer, np.ndarray]], torch.Tensor]) -> torch.Tensor:
+    """
+    Build the normalized (N, 3, 224, 224) ResNet input for a batch
+    
+    Every image is resized and cropped straight into one preallocated uint8
+    batch (resize_crop), which is converted and normalized in one op; the
+    only float tensor allocated is the result.
+    
+    Args:
+        images: PIL Images, ImageBuffers or (H, W, 3) uint8 RGB arrays of any
+            sizes, or a (N, 3, H, W) uint8 tensor of same-size images
+    
+    Returns:
+        Normalized float tensor
+    """
+    if isinstance(images, torch.Tensor):
+        return _tensor_batch(images)
+    pixels = np.empty((len(images), PREPROCESS_CROP, PREPROCESS_CROP, 3), dtype=np.uint8)
+    for index, image in enumerate(images):
+        resize_crop(ImageBuffer.wrap(image).rgb(), pixels[index])
+    return normalize_batch(torch.from_numpy(pixels).permute(0, 3, 1, 2))
+
+
+def _tensor_batch(pixels: torch.Tensor) -> torch.Tensor:
+    """classification_batch for a uint8 tensor: one antialiased interpolate of the crop regions"""
+    height, width = pixels.shape[-2:]
+    x, y, scale_x, scale_y = crop_region(width, height)
+    x0, y0 = int(round(x)), int(round(y))
+    roi = pixels[:, :, y0:y0 + int(round(PREPROCESS_CROP * scale_y)), x0:x0 + int(round(PREPROCESS_CROP * scale_x))]
+    resized = torch.nn.functional.interpolate(
+        roi.float(), size=(PREPROCESS_CROP, PREPROCESS_CROP), mode="bilinear", antialias=True, align_corners=False,
+    )
+    return normalize_batch(resized.clamp_(0, 255))
+
+
+def classification_input(buffer: ImageBuffer) -> torch.Tensor:
+    """Normalized (3, 224, 224) ResNet input for one image (see classification_batch)"""
+    return classification_batch([buffer])[0]
+
+
+def classify_batch(buffers: List[ImageBuffer]) -> Tuple[torch.Tensor, str]:
+    """
+    (N, 1000) ImageNet class probabilities for a batch of images, on the
+    CPU, and the classifier version that produced them
+    """
+    batch = classification_batch(buffers).to(device)
+    with torch.no_grad(), registry.acquire("resnet50") as classifier, model_profiler("resnet50"):
+        logits = classifier.model(batch)
+    return torch.softmax(logits, dim=1).cpu(), classifier.version
+
+
+def class_probabilities(buffers: List[ImageBuffer]) -> torch.Tensor:
+    """(N, 1000) ImageNet class probabilities for a batch of images, on the CPU"""
+    return classify_batch(buffers)[0]
+
+
+def embedding_version() -> str:
+    """What stored class probabilities depend on: the weights and the preprocessing"""
+    return f"{model_version('resnet50')}:{PREPROCESS_RESIZE}/{PREPROCESS_CROP}:p{PREPROCESS_REVISION}"
+
+
+def score_batch(buffers: List[ImageBuffer]) -> torch.Tensor:
+    """
+    Calibrated JEWELRY_TAGS scores for a batch of images
+    
+    Args:
+        buffers: Image buffers
+    
+    Returns:
+        (N, len(get_projector().tags)) tensor, columns in that order
+    """
+    return get_projector().scores(class_probabilities(buffers))
+
+
+def assemble_tags(buffer: ImageBuffer, tag_scores: Dict[str, float]) -> Dict:
+    """
+    Turn calibrated model scores and image statistics into the tag result
+    
+    Returns:
+        Dictionary with tags, tag_scores and confidence (the highest
+        calibrated score among the model tags emitted, None when the model
+        emitted none)
+    """
+    model_tags = [tag for tag, score in tag_scores.items() if score >= TAG_SCORE_THRESHOLD]
+    tags = list(model_tags)
+    
+    # ImageNet has no metal classes: determine metal type based on color
+    avg_color = buffer.mean_color()
+    if avg_color[0] > 180:  # Yellowish
+        tags.append("gold")
+    elif avg_color.mean() > 200:  # Bright/white
+        tags.append("silver")
+    
+    # Shape-based fallback (simplified) when the model saw no jewelry shape
+    if not any(tag in SHAPE_TAGS for tag in model_tags):
+        aspect_ratio = buffer.width / buffer.height
+        if aspect_ratio > 1.5:
+            tags.append("necklace")
+        elif aspect_ratio < 0.8:
+            tags.append("earring")
+        else:
+            tags.append("ring")
+    
+    # Add generic jewelry tags
+    tags.extend(GENERIC_TAGS)
+    
+    confidence = max((tag_scores[tag] for tag in model_tags), default=None)
+    return {
+        "tags": list(dict.fromkeys(tags)),  # Remove duplicates, keep order
+        "tag_scores": {tag: round(score, 4) for tag, score in tag_scores.items()},
+        "confidence": round(confidence, 4) if confidence is not None else None,
+    }
+
+
+def tag_images(images: List[Union[Image.Image, ImageBuffer]]) -> List[Dict]:
+    """
+    Tag a batch of images with one classifier pass and one projection
+    
+    Args:
+        images: PIL Images or ImageBuffers
+    
+    Returns:
+        One result per image (see assemble_tags), with the classifier's
+        model_version
+    """
+    buffers = [ImageBuffer.wrap(image) for image in images]
+    probabilities, version = classify_batch(buffers)
+    projector = get_projector()
+    scores = projector.scores(probabilities).tolist()
+    return [
+        {**assemble_tags(buffer, dict(zip(projector.tags, row))), "model_version": version}
+        for buffer, row in zip(buffers, scores)
+    ]
+
+
+def tags_from_probabilities(image: Union[Image.Image, ImageBuffer], probabilities: np.ndarray) -> Dict:
+    """
+    Tag result for one image from its stored class probabilities, without a
+    classifier pass (the projection and calibration are re-applied, so their
+    changes take effect)
+    """
+    projector = get_projector()
+    scores = projector.scores(torch.from_numpy(probabilities).float().unsqueeze(0))[0].tolist()
+    return assemble_tags(ImageBuffer.wrap(image), dict(zip(projector.tags, scores)))
+
+
+def tag_image(image: Union[Image.Image, ImageBuffer]) -> Dict:
+    """
+    Generate tags and calibrated scores for one jewelry image
+    
+    Args:
+        image: PIL Image or ImageBuffer
+    
+    Returns:
+        Dictionary with tags, tag_scores, confidence and model_version
+    """
+    try:
+        return tag_images([image])[0]
+    except Exception as e:
+        logger.error(f"Tag generation failed: {str(e)}")
+        return fallback_tags()
+
+
+def fallback_tags() -> Dict:
+    """Result returned when the classifier fails"""
+    return {"tags": ["jewelry", "handcrafted"], "tag_scores": {}, "confidence": None}
+
+
+def generate_tags(image: Union[Image.Image, ImageBuffer]) -> List[str]:
+    """
+    Generate tags for jewelry image using deep learning
+    
+    Args:
+        image: PIL Image or ImageBuffer
+    
+    Returns:
+        List of tags
+    """
+    return tag_image(image)["tags"]
@@ -0,0 +1,166 @@
+"""
+Image Variants Module
+
+Derived sizes of the processed (segmented) image for the catalog: e.g. 128,
+512 and 1600 px on the longest side, each as WebP and PNG. All variants come
+from the in-memory result of the pipeline, so the upload is decoded once.
+
+Sizes are produced largest first, each one downscaled from the previous
+variant rather than from the full-size image (progressive reduction); with
+INTER_AREA the small sizes then cost a fraction of a full-size resample.
+Color is premultiplied by alpha while resizing so transparent pixels do not
+bleed a dark fringe into the jewelry's edges.
+
+Files are stored next to the processed image as
+    <processed_image_id>-<size>-<format>.<format>
+and that file name without extension is the variant id.
+"""
+
+import os
+import re
+from typing import Dict, List, Optional, Sequence
+
+import cv2
+import numpy as np
+from PIL import Image
+
+SUPPORTED_FORMATS = ("webp", "png")
+MEDIA_TYPES = {"webp": "image/webp", "png": "image/png"}
+
+WEBP_QUALITY = int(os.getenv("VARIANT_WEBP_QUALITY", "85"))
+MAX_VARIANT_SIZE = 4096
+
+# Processed image ids are uuid4 strings; variant ids add -<size>-<format>
+_IMAGE_ID = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}(?:-(\d+)-(webp|png))?$")
+
+
+def parse_sizes(value: str) -> List[int]:
+    """Parse a comma-separated list of longest-side sizes in pixels"""
+    try:
+        sizes = sorted({int(part) for part in value.split(",") if part.strip()}, reverse=True)
+    except ValueError:
+        raise ValueError("variant sizes must be comma-separated integers")
+    if not sizes or sizes[-1] < 1 or sizes[0] > MAX_VARIANT_SIZE:
+        raise ValueError(f"variant sizes must be between 1 and {MAX_VARIANT_SIZE}")
+    return sizes
+
+
+def parse_formats(value: str) -> List[str]:
+    """Parse a comma-separated list of variant formats"""
+    formats = []
+    for part in value.lower().split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if part not in SUPPORTED_FORMATS:
+            raise ValueError(f"variant formats must be among {', '.join(SUPPORTED_FORMATS)}")
+        if part not in formats:
+            formats.append(part)
+    if not formats:
+        raise ValueError("at least one variant format is required")
+    return formats
+
+
+VARIANT_SIZES = parse_sizes(os.getenv("VARIANT_SIZES", "128,512,1600"))
+VARIANT_FORMATS = parse_formats(os.getenv("VARIANT_FORMATS", "webp,png"))
+
+
+def _premultiply(rgba: np.ndarray) -> np.ndarray:
+    out = rgba.copy()
+    alpha = rgba[..., 3:4].astype(np.uint16)
+    out[..., :3] = (rgba[..., :3].astype(np.uint16) * alpha + 127) // 255
+    return out
+
+
+def _unpremultiply(rgba: np.ndarray) -> np.ndarray:
+    out = rgba.copy()
+    alpha = rgba[..., 3:4].astype(np.uint32)
+    color = (rgba[..., :3].astype(np.uint32) * 255 + alpha // 2) // np.maximum(alpha, 1)
+    out[..., :3] = np.minimum(color, 255).astype(np.uint8)
+    return out
+
+
+def progressive_resize(image: Image.Image, sizes: Sequence[int]) -> Dict[int, Image.Image]:
+    """
+    Downscale image to each longest-side size, largest first, every step
+    starting from the previous result; sizes at or above the image's own
+    size get the image unchanged (no upscaling)
+
+    Returns:
+        Resized image per size
+    """
+    has_alpha = image.mode == "RGBA"
+    array = np.asarray(image if has_alpha else image.convert("RGB"))
+    if has_alpha:
+        array = _premultiply(array)
+    height, width = array.shape[:2]
+    longest = max(width, height)
+
+    variants = {}
+    current = array
+    for size in sorted(set(sizes), reverse=True):
+        if size >= longest:
+            variants[size] = image if has_alpha else image.convert("RGB")
+            continue
+        scale = size / longest
+        target = (max(1, round(width * scale)), max(1, round(height * scale)))
+        current = cv2.resize(current, target, interpolation=cv2.INTER_AREA)
+        pixels = _unpremultiply(current) if has_alpha else current
+        variants[size] = Image.fromarray(pixels, "RGBA" if has_alpha else "RGB")
+    return variants
+
+
+def write_variants(
+    image: Image.Image,
+    image_id: str,
+    directory: str,
+    sizes: Optional[Sequence[int]] = None,
+    formats: Optional[Sequence[str]] = None,
+) -> List[dict]:
+    """
+    Save every size x format variant of a processed image
+
+    Args:
+        image: Processed image (RGBA after background removal)
+        image_id: Processed image id the variants belong to
+        directory: Where the processed image is stored
+        sizes: Longest-side sizes (defaults to VARIANT_SIZES)
+        formats: Formats (defaults to VARIANT_FORMATS)
+
+    Returns:
+        One entry per variant: variant_id, size, format, width, height, bytes
+    """
+    sizes = sizes or VARIANT_SIZES
+    formats = formats or VARIANT_FORMATS
+    variants = []
+    for size, resized in progressive_resize(image, sizes).items():
+        for fmt in formats:
+            variant_id = f"{image_id}-{size}-{fmt}"
+            path = os.path.join(directory, f"{variant_id}.{fmt}")
+            if fmt == "webp":
+                resized.save(path, format="WEBP", quality=WEBP_QUALITY, method=4)
+            else:
+                resized.save(path, format="PNG")
+            variants.append({
+                "variant_id": variant_id,
+                "size": size,
+                "format": fmt,
+                "width": resized.width,
+                "height": resized.height,
+                "bytes": os.path.getsize(path),
+            })
+    return variants
+
+
+def image_file(image_id: str, directory: str) -> Optional[tuple]:
+    """
+    Resolve a processed image id or variant id to (path, media type)
+
+    Returns None for ids that are not well-formed, so callers never build
+    a path from arbitrary input.
+    """
+    match = _IMAGE_ID.match(image_id)
+    if match is None:
+        return None
+    fmt = match.group(2) or "png"
+    return os.path.join(directory, f"{image_id}.{fmt}"), MEDIA_TYPES[fmt]
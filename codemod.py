@@ -0,0 +1,190 @@
+"""
+Codemod runner for the repository patch scripts
+
+Each patch script (update_main.py, update_telegram.py, temp_updater.py,
+temp_update_ui.py) only defines PATCHES: a list of dicts describing a
+rewrite of one target file. This runner loads the definitions as data,
+groups them by target file, reads each file once, applies every patch for it
+in order with precompiled patterns, and writes it back once. Files are
+processed in parallel.
+
+Nothing is written unless --write is given; the default run prints the
+unified diff it would apply.
+
+Every patch lists "applied_if" markers: snippets that recognise the change
+in the code as it is now (e.g. the function it adds), not only the exact
+text the patch would insert. A patch is skipped as already applied when any
+marker, or its own replacement text, is in the file, so running the scripts
+over code that has since been edited by hand is a no-op.
+
+Patch keys:
+    id          name shown in the report
+    file        target path, relative to --root
+    pattern     regular expression (re.sub semantics), or
+    find        literal text (str.replace semantics)
+    replace     replacement text
+    flags       optional list of re flag names, e.g. ["DOTALL"]
+    applied_if  list of strings whose presence means "already applied"
+
+Usage:
+    python codemod.py                      # all patch scripts, print a diff only
+    python codemod.py --write              # apply and write the files
+    python codemod.py update_main.py --root ../other-checkout --write
+"""
+
+import argparse
+import difflib
+import importlib.util
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+PATCH_SCRIPTS = ["update_telegram.py", "temp_updater.py", "update_main.py", "temp_update_ui.py"]
+
+APPLIED = "applied"
+ALREADY_APPLIED = "already applied"
+NO_MATCH = "no match"
+
+_EMPTY_START = re.compile(r"\A")
+
+
+class Patch:
+    """One compiled rewrite of a target file"""
+
+    def __init__(self, spec: Dict, source: str):
+        self.id = spec["id"]
+        self.file = spec["file"]
+        self.source = source
+        self.replace = spec["replace"]
+
+        if "pattern" in spec:
+            flags = 0
+            for name in spec.get("flags", []):
+                flags |= getattr(re, name)
+            self.regex = re.compile(spec["pattern"], flags)
+            self.find = None
+        else:
+            self.regex = None
+            self.find = spec["find"]
+
+        if not spec.get("applied_if"):
+            raise ValueError(f"{self.source}: patch '{self.id}' needs 'applied_if' markers")
+        self.markers = list(spec["applied_if"])
+        inserted = self._inserted_text()
+        if inserted:
+            self.markers.append(inserted)
+
+    def _inserted_text(self) -> str:
+        """The text the patch inserts, or "" when it uses group references"""
+        if self.regex is None:
+            return self.replace
+        try:
+            # Expands escapes the way re.sub does; fails on group references
+            return _EMPTY_START.sub(self.replace, "", count=1)
+        except re.error:
+            return ""
+
+    def apply(self, text: str) -> Tuple[str, str]:
+        """Return (new text, status)"""
+        if any(marker in text for marker in self.markers):
+            return text, ALREADY_APPLIED
+        if self.regex is None:
+            if self.find not in text:
+                return text, NO_MATCH
+            return text.replace(self.find, self.replace), APPLIED
+        new_text, count = self.regex.subn(self.replace, text)
+        return new_text, APPLIED if count else NO_MATCH
+
+
+def load_patches(scripts: List[str]) -> List[Patch]:
+    """Import PATCHES from each script without running it as __main__"""
+    patches = []
+    for path in scripts:
+        name = os.path.splitext(os.path.basename(path))[0]
+        spec = importlib.util.spec_from_file_location(f"_patches_{name}", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        patches.extend(Patch(entry, os.path.basename(path)) for entry in module.PATCHES)
+    return patches
+
+
+def run_file(path: str, patches: List[Patch], write: bool) -> Dict:
+    """Apply all patches for one file: one read, at most one write"""
+    report = {"file": path, "patches": [], "changed": False, "diff": ""}
+    if not os.path.exists(path):
+        report["error"] = "file not found"
+        return report
+
+    with open(path, "r", encoding="utf-8") as f:
+        original = f.read()
+
+    text = original
+    for patch in patches:
+        text, status = patch.apply(text)
+        report["patches"].append((patch.source, patch.id, status))
+
+    if text != original:
+        report["changed"] = True
+        if not write:
+            report["diff"] = "".join(difflib.unified_diff(
+                original.splitlines(keepends=True),
+                text.splitlines(keepends=True),
+                fromfile=f"a/{path}",
+                tofile=f"b/{path}",
+            ))
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+    return report
+
+
+def run(scripts: List[str], root: str = ".", write: bool = False, jobs: int = 4) -> List[Dict]:
+    """
+    Apply the patches defined in scripts to the files under root
+
+    Files are only written when write is true; otherwise each report carries
+    the unified diff that would be applied.
+
+    Returns:
+        One report per target file
+    """
+    by_file: Dict[str, List[Patch]] = {}
+    for patch in load_patches(scripts):
+        by_file.setdefault(os.path.join(root, patch.file), []).append(patch)
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(lambda item: run_file(item[0], item[1], write), by_file.items()))
+
+
+def main(argv=None) -> int:
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Apply the repository patch scripts in one pass")
+    parser.add_argument("scripts", nargs="*", help="Patch scripts (default: all)")
+    parser.add_argument("--root", default=".", help="Directory the target paths are relative to")
+    parser.add_argument("--write", action="store_true", help="Write the patched files (default: print a unified diff)")
+    parser.add_argument("--jobs", type=int, default=4, help="Files processed in parallel")
+    args = parser.parse_args(argv)
+
+    scripts = args.scripts or [os.path.join(here, name) for name in PATCH_SCRIPTS]
+    reports = run(scripts, args.root, args.write, args.jobs)
+
+    missed = False
+    for report in reports:
+        if "error" in report:
+            print(f"{report['file']}: {report['error']}")
+            missed = True
+            continue
+        state = "would change" if not args.write and report["changed"] else ("updated" if report["changed"] else "unchanged")
+        print(f"{report['file']}: {state}")
+        for source, patch_id, status in report["patches"]:
+            print(f"  [{status}] {source}: {patch_id}")
+            missed = missed or status == NO_MATCH
+        if report["diff"]:
+            sys.stdout.write(report["diff"])
+    return 1 if missed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
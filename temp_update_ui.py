@@ -1,11 +1,10 @@
-﻿import re
+﻿"""
+Patch definitions: AutoPay debug logging and SIP loader in HomeLanding.tsx
 
-with open('apps/web-app/src/pages/HomeLanding.tsx', 'r', encoding='utf-8') as f:
-    text = f.read()
+Applied by codemod.py (python codemod.py temp_update_ui.py --write)
+"""
 
-# 1. ensure Sparkles is imported
-if ' Sparkles,' not in text and 'Sparkles ' not in text:
-    text = re.sub(r'(import \{.*?)(Loader2)(.*?} from \'lucide-react\';)', r'\1Loader2, Sparkles\3', text, flags=re.DOTALL)
+HOME_LANDING = 'apps/web-app/src/pages/HomeLanding.tsx'
 
 # 2. Add onDebug in handleAutoPay
 new_autopay = r'''const handleAutoPay = () => {
@@ -24,8 +23,6 @@ new_autopay = r'''const handleAutoPay = () => {
       customerPhone: custPhone,
       onDebug: (msg) => console.log('[AutoPay Debug]:', msg),
       onSuccess: async (id) => {'''
-      
-text = re.sub(r'const handleAutoPay = \(\) => \{.+?onSuccess: async \(id\) => \{', new_autopay, text, flags=re.DOTALL)
 
 # 3. Add aesthetic loader to BottomSheet
 loader_overlay = r'''
@@ -48,9 +45,36 @@ loader_overlay = r'''
               </div>
             )}
 '''
-text = re.sub(r'<BottomSheet title="Setup GOLD SIP" onClose=\{.+? \}\}>\s*<div className="space-y-4">', loader_overlay, text, flags=re.DOTALL)
+PATCHES = [
+    {
+        # Ensure Sparkles is imported from lucide-react
+        "id": "import-sparkles",
+        "file": HOME_LANDING,
+        "pattern": r'(import \{.*?)(Loader2)(.*?} from \'lucide-react\';)',
+        "flags": ["DOTALL"],
+        "replace": r'\1Loader2, Sparkles\3',
+        "applied_if": [' Sparkles,', 'Sparkles '],
+    },
+    {
+        "id": "autopay-debug",
+        "file": HOME_LANDING,
+        "pattern": r'const handleAutoPay = \(\) => \{.+?onSuccess: async \(id\) => \{',
+        "flags": ["DOTALL"],
+        "replace": new_autopay,
+        "applied_if": ["onDebug: (msg) => console.log('[AutoPay Debug]:'"],
+    },
+    {
+        "id": "sip-loader-overlay",
+        "file": HOME_LANDING,
+        "pattern": r'<BottomSheet title="Setup GOLD SIP" onClose=\{.+? \}\}>\s*<div className="space-y-4">',
+        "flags": ["DOTALL"],
+        "replace": loader_overlay,
+        # The SIP sheet's submit button already shows the paying spinner
+        "applied_if": ["Setting up your SIP...", "disabled={Boolean(paying || !autoPayForm.amount"],
+    },
+]
 
-with open('apps/web-app/src/pages/HomeLanding.tsx', 'w', encoding='utf-8') as f:
-    f.write(text)
-
-print('Updated HomeLanding.tsx successfully')
\ No newline at end of file
+if __name__ == "__main__":
+    import sys
+    import codemod
+    sys.exit(codemod.main([__file__] + sys.argv[1:]))
@@ -1,7 +1,8 @@
-﻿import re
+﻿"""
+Patch definitions: GOLD SIP AutoPay flow in the web app's Razorpay client
 
-with open('apps/web-app/src/lib/razorpay.ts', 'r', encoding='utf-8') as f:
-    text = f.read()
+Applied by codemod.py (python codemod.py temp_updater.py --write)
+"""
 
 new_autopay = r'''export interface AutoPayOptions {
   planAmount: number;
@@ -118,14 +119,18 @@ export async function setupGoldAutoPay(options: AutoPayOptions) {
 }
 '''
 
-new_text = re.sub(
-    r'export interface AutoPayOptions \{.*?(?=\n$|\Z)',
-    new_autopay,
-    text,
-    flags=re.DOTALL
-)
-
-with open('apps/web-app/src/lib/razorpay.ts', 'w', encoding='utf-8') as f:
-    f.write(new_text)
-
-print('Updated razorpay.ts successfully')
\ No newline at end of file
+PATCHES = [
+    {
+        "id": "autopay-subscription-flow",
+        "file": 'apps/web-app/src/lib/razorpay.ts',
+        "pattern": r'export interface AutoPayOptions \{.*?(?=\n$|\Z)',
+        "flags": ["DOTALL"],
+        "replace": new_autopay,
+        "applied_if": ["fetchWithFallback('/payments/create-subscription'"],
+    },
+]
+
+if __name__ == "__main__":
+    import sys
+    import codemod
+    sys.exit(codemod.main([__file__] + sys.argv[1:]))
@@ -1,7 +1,8 @@
-﻿import re
+﻿"""
+Patch definitions: animated vault loader in the web app's src/main.tsx
 
-with open('src/main.tsx', 'r', encoding='utf-8') as f:
-    text = f.read()
+Applied by codemod.py (python codemod.py update_main.py --write)
+"""
 
 new_loader = r'''  if (loadingAuth) {
     return (
@@ -50,14 +51,18 @@ new_loader = r'''  if (loadingAuth) {
     );
   }'''
 
-text = re.sub(
-    r'  if \(loadingAuth\) \{.*?    \}',
-    new_loader,
-    text,
-    flags=re.DOTALL
-)
+PATCHES = [
+    {
+        "id": "loading-auth-loader",
+        "file": "apps/web-app/src/main.tsx",
+        "pattern": r'  if \(loadingAuth\) \{.*?    \}',
+        "flags": ["DOTALL"],
+        "replace": new_loader,
+        "applied_if": ["Loading Secure Vault"],
+    },
+]
 
-with open('src/main.tsx', 'w', encoding='utf-8') as f:
-    f.write(text)
-
-print('Updated loader in main.tsx successfully')
\ No newline at end of file
+if __name__ == "__main__":
+    import sys
+    import codemod
+    sys.exit(codemod.main([__file__] + sys.argv[1:]))
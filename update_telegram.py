@@ -1,7 +1,10 @@
-﻿import re
+﻿"""
+Patch definitions: Telegram order alerts in the payments controller
 
-with open('apps/backend/src/modules/payments/payments.controller.ts', 'r', encoding='utf-8') as f:
-    text = f.read()
+Applied by codemod.py (python codemod.py update_telegram.py --write)
+"""
+
+PAYMENTS_CONTROLLER = 'apps/backend/src/modules/payments/payments.controller.ts'
 
 # Add Telegram helper at the top before paymentsRouter
 telegram_helper = r'''
@@ -19,8 +22,6 @@ async function sendTelegramAlert(text: string) {
 
 export function paymentsRouter(): Router {'''
 
-text = text.replace('export function paymentsRouter(): Router {', telegram_helper)
-
 # Add logic to handleVerifyBuyPayment
 verify_payment_repl = r'''      const lockData = lockSnap.data();
 
@@ -48,13 +49,6 @@ verify_payment_repl = r'''      const lockData = lockSnap.data();
         sendTelegramAlert(msg).catch(console.error);
       }'''
 
-text = re.sub(
-    r'await lockRef\.update\(\{\s*status: \'PAID\',\s*verifiedAt: new Date\(\),\s*razorpayOrderId,\s*razorpayPaymentId,\s*updatedAt: new Date\(\),\s*\}\);',
-    verify_payment_repl,
-    text,
-    flags=re.DOTALL
-)
-
 # Add logic to verify-subscription
 verify_sub_repl = r'''      // Here you could update the DB to mark the subscription as active for the user
       
@@ -66,12 +60,32 @@ verify_sub_repl = r'''      // Here you could update the DB to mark the subscrip
 
       return res.json({'''
 
-text = text.replace(
-    '// Here you could update the DB to mark the subscription as active for the user\n      return res.json({',
-    verify_sub_repl
-)
-
-with open('apps/backend/src/modules/payments/payments.controller.ts', 'w', encoding='utf-8') as f:
-    f.write(text)
+PATCHES = [
+    {
+        "id": "telegram-helper",
+        "file": PAYMENTS_CONTROLLER,
+        "find": 'export function paymentsRouter(): Router {',
+        "replace": telegram_helper,
+        "applied_if": ["function sendTelegramAlert"],
+    },
+    {
+        "id": "buy-payment-alert",
+        "file": PAYMENTS_CONTROLLER,
+        "pattern": r'await lockRef\.update\(\{\s*status: \'PAID\',\s*verifiedAt: new Date\(\),\s*razorpayOrderId,\s*razorpayPaymentId,\s*updatedAt: new Date\(\),\s*\}\);',
+        "flags": ["DOTALL"],
+        "replace": verify_payment_repl,
+        "applied_if": ["// FIRE TELEGRAM ALERT", "// Fire & Forget Telegram Alert"],
+    },
+    {
+        "id": "subscription-alert",
+        "file": PAYMENTS_CONTROLLER,
+        "find": '// Here you could update the DB to mark the subscription as active for the user\n      return res.json({',
+        "replace": verify_sub_repl,
+        "applied_if": ["(SIP) ACTIVATED", "SIP (AUTOPAY) ACTIVATED"],
+    },
+]
 
-print('Updated payments.controller.ts successfully with telegram logic')
\ No newline at end of file
+if __name__ == "__main__":
+    import sys
+    import codemod
+    sys.exit(codemod.main([__file__] + sys.argv[1:]))